@@ -128,9 +128,23 @@ scope =  FastMC_core.nidaq(num_stacks = 2,                # number of 3D stacks
                              image_width = 2060,            # px. horizontal ROI
                              frame_delay_time = 0.0,        # s. optional delay after each frame trigger
                              led_stack_fraction_on = 0.5,   # percent of time LED is on during every stack acquisition in software_fraction mode
-                             led_trigger = "hardware", # "hardware", "software_fraction", "software_time" triggering of LED if light control is desired
+                             led_trigger = "hardware", # "hardware", "software_fraction", "software_time", "modulation" control of LED if light control is desired
                              led_time_on = 1,               # s. time LED is on during acquisition in software_time mode (i.e. LED period)
-                             led_frequency = 1/3)           # pulses/second. Nonzero to pulse the LED for led_time_on at given frequency
+                             led_frequency = 1/3,           # pulses/second. Nonzero to pulse the LED for led_time_on at given frequency
+                             continuous = False,            # gapless streaming of all stacks. Requires stack_delay_time = 0.0
+                             schedule = None,               # optional rows (n_stacks, exposure per slice, delay after stack). Overrides num_stacks
+                             z_positions = None,            # microm. optional list of z planes. Overrides z_start, z_end, z_step
+                             z_ranges = None,               # microm. optional list of (z_start, z_end, z_step) sub-ranges
+                             calibration = None,            # optional FastMC_calibration.galvo_calibration.load("file.npz")
+                             led_modulation = None,         # V (0-5). modulation mode: function of time (s) in the stack, or array of volts over a stack
+                             ao_oversampling = 1,           # AO samples per frame. Increase to resolve fast LED modulation
+                             power_ramp = None,             # "linear", "exponential" or measured [z, signal] rows: ao1 excitation grows with depth
+                             power_range = (1.0, 5.0),      # V. ao1 at the shallowest and at the deepest plane
+                             attenuation_length = 100.0,    # microm. exponential power ramp
+                             wavelengths = None,            # nm. AOTF wavelength sequence, e.g. [488, 561]
+                             wavelength_switch = "frame",   # "frame": alternate within a stack. "stack": alternate stacks (continuous only)
+                             external_start = False,        # True: arm, then start on a rising edge at PFI1 (e.g. ephys rig)
+                             sync_input = False)            # True: timestamp every PFI1 edge and align it to the frames (scope.sync_edges)
 
 # -------------------------- do not modify below --------------------------------- #
 
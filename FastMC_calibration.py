@@ -0,0 +1,88 @@
+import numpy as np
+import hashlib
+
+# Measured conversion from z position to galvo voltage for the 2P-OPM.
+# Replaces the single linear factor nidaq.volt_per_z when the galvo response
+# is not linear over the scan range, or lags at high step rates.
+
+class galvo_calibration:
+
+    def __init__(
+            self,
+            z,                  # microm. measured z positions
+            volts,              # V. galvo voltage that reaches each z position
+            rates = None,       # frames/second. optional step rates of the dynamic correction
+            gains = None,       # optional voltage gain at each step rate (galvo undershoot compensation)
+            name = ""):         # free text: date, objective, who measured it
+
+        z = np.asarray(z, dtype=float)
+        volts = np.asarray(volts, dtype=float)
+        if z.ndim != 1 or z.shape != volts.shape or len(z) < 2:
+            raise ValueError("z and volts must be 1D arrays of the same length (at least 2 points)")
+        order = np.argsort(z)
+        z, volts = z[order], volts[order]
+        if np.any(np.diff(z) == 0):
+            raise ValueError("Calibration z positions must be unique")
+        if (rates is None) != (gains is None):
+            raise ValueError("Give both rates and gains for the dynamic correction")
+        if rates is not None:
+            rates = np.asarray(rates, dtype=float)
+            gains = np.asarray(gains, dtype=float)
+            if rates.shape != gains.shape:
+                raise ValueError("rates and gains must have the same length")
+            order = np.argsort(rates)
+            rates, gains = rates[order], gains[order]
+
+        self.z = z
+        self.volts = volts
+        self.rates = rates
+        self.gains = gains
+        self.name = name
+        self.version = self._get_version()
+
+
+    @classmethod
+    def linear(cls, volt_per_z, z_min=-200.0, z_max=200.0):
+        """Get the calibration equivalent to a single conversion factor"""
+        return cls([z_min, z_max], [volt_per_z * z_min, volt_per_z * z_max], name="linear")
+
+
+    def _get_version(self):
+        """Get content hash of the calibration data: key of compiled waveform caches"""
+        h = hashlib.sha1()
+        for arr in (self.z, self.volts, self.rates, self.gains):
+            if arr is not None:
+                h.update(arr.tobytes())
+        return h.hexdigest()[:12]
+
+
+    def get_gain(self, rate):
+        """Get dynamic voltage gain at a given step rate (1.0 without correction)"""
+        if self.rates is None or rate is None:
+            return 1.0
+        return float(np.interp(rate, self.rates, self.gains))
+
+
+    def z_to_volt(self, z, rate=None):
+        """Get galvo voltage for every z position (vectorized), corrected for the step rate"""
+        z = np.asarray(z, dtype=float)
+        if np.any(z < self.z[0]) or np.any(z > self.z[-1]):
+            raise ValueError(f"z positions out of calibrated range [{self.z[0]}, {self.z[-1]}]")
+        return np.interp(z, self.z, self.volts) * self.get_gain(rate)
+
+
+    def save(self, path):
+        """Save calibration to a .npz file"""
+        arrays = {"z": self.z, "volts": self.volts, "name": np.array(self.name)}
+        if self.rates is not None:
+            arrays.update(rates=self.rates, gains=self.gains)
+        np.savez(path, **arrays)
+
+
+    @classmethod
+    def load(cls, path):
+        """Load calibration from a .npz file"""
+        with np.load(path) as data:
+            rates = data["rates"] if "rates" in data else None
+            gains = data["gains"] if "gains" in data else None
+            return cls(data["z"], data["volts"], rates, gains, str(data["name"]))
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import types
+import numpy as np
+
+# Compiled protocols: the derived timing and every channel buffer of a
+# FastMC_core.nidaq configuration, stored as .npy files in a local cache
+# directory keyed by a hash of the configuration. Compiling a known protocol
+# again only memory maps the stored buffers, and acquire() then uses them
+# instead of regenerating the data. The cache keeps the most recently used
+# protocols within max_entries / max_bytes.
+#
+# Use:
+#   artifact = FastMC_compile.compile(scope)      # sets scope.compiled
+#   scope.acquire()
+
+FORMAT_VERSION = 1
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".fastmc_cache")
+
+# nidaq attributes that define the output of an acquisition
+CONFIG = ("num_stacks", "stack_delay_time", "exposure_time", "readout_mode", "multi_d", "image_height", "image_width",
+          "frame_delay_time", "z_start", "z_end", "z_step", "z_positions", "z_ranges", "led_fraction_on", "led_trigger",
+          "led_time_on", "led_frequency", "continuous", "schedule", "calibration", "led_modulation", "ao_oversampling",
+          "power_ramp", "power_range", "attenuation_length", "wavelengths", "wavelength_switch", "aotf_table")
+
+
+def _canonical(value, seen=None):
+    """Get a stable string of a configuration value (numbers, sequences, arrays, functions, calibrations)"""
+    if value is None or isinstance(value, (bool, np.bool_, str)):
+        return repr(value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return repr(float(value))
+    if isinstance(value, (complex, np.complexfloating, range, slice, type(Ellipsis))):
+        return repr(value)
+    if isinstance(value, (bytes, bytearray)):
+        return f"bytes:{hashlib.sha1(value).hexdigest()}"
+    if isinstance(value, np.ndarray):
+        return f"array{value.shape}{value.dtype.str}:{hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest()}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(_canonical(v, seen) for v in value) + "]"
+    if isinstance(value, (set, frozenset)):
+        # unordered: sorted canonical elements
+        return "{" + ",".join(sorted(_canonical(v, seen) for v in value)) + "}"
+    if isinstance(value, dict):
+        return "{" + ",".join(f"{k}:{_canonical(value[k], seen)}" for k in sorted(value)) + "}"
+    if isinstance(value, types.ModuleType):
+        return f"module:{value.__name__}"
+    if hasattr(value, "co_code"):
+        # nested function of a function's constants
+        return f"code:{value.co_code.hex()}:{_canonical(list(value.co_consts), seen)}"
+    if hasattr(value, "version"):
+        # FastMC_calibration.galvo_calibration
+        return f"calibration:{value.version}"
+    if isinstance(value, (types.BuiltinFunctionType, np.ufunc)):
+        # e.g. math.sin, np.sin: identified by name
+        return f"builtin:{getattr(value, '__module__', None) or 'numpy'}.{value.__name__}"
+    if isinstance(value, type):
+        # class (e.g. a global used to build values): identified by name
+        return f"type:{value.__module__}.{value.__qualname__}"
+    if callable(value):
+        return _function(value, set() if seen is None else seen)
+    if hasattr(value, "__dict__"):
+        # module-level object: its class and attributes
+        seen = set() if seen is None else seen
+        if id(value) in seen:
+            return f"object:{type(value).__qualname__}"
+        seen.add(id(value))
+        return f"object:{type(value).__qualname__}:{_canonical(vars(value), seen)}"
+    raise ValueError(f"Cannot hash {type(value).__name__} for a compiled protocol")
+
+
+def _names(code):
+    """Get global (or attribute) names used by code and its nested functions"""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            names |= _names(const)
+    return names
+
+
+def _function(func, seen):
+    """Get a stable string of a function: bytecode, constants, captured values, defaults and the current values
+    of the globals it uses (e.g. a modulation frequency F). Raises ValueError if any of them cannot be hashed"""
+    code = getattr(func, "__code__", None)
+    if code is None and hasattr(type(func).__call__, "__code__") and hasattr(func, "__dict__"):
+        # callable object (e.g. FastMC_saturation.scaled_modulation): its class, attributes and __call__
+        return f"object:{type(func).__qualname__}:{_canonical(vars(func), seen)}:{_function(type(func).__call__, seen)}"
+    if code is None:
+        raise ValueError(f"Cannot hash {func!r} for a compiled protocol")
+    if id(func) in seen:
+        # recursive function
+        return f"func:{code.co_name}"
+    seen.add(id(func))
+    cells = [c.cell_contents for c in (func.__closure__ or ())]
+    # co_names also holds attribute names (np.sin -> "sin"): only names bound in the module globals count
+    scope = func.__globals__
+    used = {name: scope[name] for name in sorted(_names(code)) if name in scope}
+    return (f"func:{_canonical(code, seen)}:{_canonical(cells, seen)}:{_canonical(func.__defaults__, seen)}:"
+            f"{_canonical(func.__kwdefaults__, seen)}:{_canonical(used, seen)}")
+
+
+def value_key(value):
+    """Get the hash of a configuration value by content (e.g. a modulation function and the globals it reads)"""
+    return hashlib.sha1(_canonical(value).encode()).hexdigest()
+
+
+def current_key(scope):
+    """Get protocol_key of scope, or None if a configuration value cannot be hashed (protocol not cached)"""
+    try:
+        return protocol_key(scope)
+    except ValueError:
+        return None
+
+
+def protocol_key(scope):
+    """Get the cache key of a nidaq configuration"""
+    h = hashlib.sha1(f"fastmc-protocol-{FORMAT_VERSION}".encode())
+    for name in CONFIG:
+        h.update(f"{name}={_canonical(getattr(scope, name, None))};".encode())
+    return h.hexdigest()[:16]
+
+
+def compile_buffers(scope):
+    """Get every buffer written to the DAQ by acquire(), as arrays"""
+    clocked = scope.continuous or scope.schedule is not None
+    buffers = {"pulse_table": np.vstack(scope.compile_pulse_table())}
+    if scope.use_ao:
+        buffers["ao"] = np.asarray(scope._get_ao_data(clocked=clocked), dtype=np.float64)
+    if scope.led_trigger == "software_fraction":
+        led = scope._get_do_led_data_clocked() if clocked else scope._get_do_led_data_trigger()
+        buffers["led"] = np.asarray(led, dtype=bool)
+    elif scope.led_trigger == "software_time":
+        buffers["led"] = np.asarray(scope._get_do_led_data_no_trigger(), dtype=bool)
+    return buffers
+
+
+def _content_hash(timing, buffers):
+    h = hashlib.sha1(json.dumps(timing, sort_keys=True).encode())
+    for name in sorted(buffers):
+        h.update(name.encode())
+        h.update(np.ascontiguousarray(buffers[name]).tobytes())
+    return h.hexdigest()
+
+
+class artifact:
+
+    def __init__(self, path, timing, buffers):
+        self.path = path
+        self.timing = timing
+        self.buffers = buffers
+        self.key = timing["key"]
+        self.content_hash = timing["content_hash"]
+
+
+    @classmethod
+    def load(cls, path):
+        """Load a compiled protocol, memory mapping its buffers"""
+        with open(os.path.join(path, "timing.json")) as f:
+            timing = json.load(f)
+        buffers = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in timing["buffers"]}
+        return cls(path, timing, buffers)
+
+
+    def verify(self):
+        """Check the buffers against the content hash (reads every buffer)"""
+        timing = {k: v for k, v in self.timing.items() if k != "content_hash"}
+        return _content_hash(timing, self.buffers) == self.content_hash
+
+
+    @property
+    def nbytes(self):
+        """Get total size of the buffers"""
+        return sum(b.nbytes for b in self.buffers.values())
+
+
+def _save(path, timing, buffers):
+    """Write the artifact to a temporary directory and move it in place (atomic for concurrent writers)"""
+    tmp = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    for name, data in buffers.items():
+        np.save(os.path.join(tmp, name + ".npy"), data)
+    with open(os.path.join(tmp, "timing.json"), "w") as f:
+        json.dump(timing, f, indent=4)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # already written by another process
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _entries(cache_dir):
+    """Get (last use, size, path) of every artifact in the cache, least recently used first"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        stamp = os.path.join(path, "timing.json")
+        if os.path.exists(stamp):
+            size = sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+            entries.append((os.path.getmtime(stamp), size, path))
+    return sorted(entries)
+
+
+def evict(cache_dir=DEFAULT_CACHE, max_entries=32, max_bytes=2 ** 30, keep=None):
+    """Remove least recently used artifacts beyond max_entries or max_bytes. Returns the removed paths"""
+    entries = _entries(cache_dir)
+    total = sum(size for _, size, _ in entries)
+    removed = []
+    for _, size, path in entries:
+        if len(entries) - len(removed) <= max_entries and total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(path)
+        total -= size
+    return removed
+
+
+def compile(scope, cache_dir=DEFAULT_CACHE, max_entries=32, max_bytes=2 ** 30):
+    """Get the compiled protocol of scope from the cache, compiling and storing it if new (None if it cannot be hashed). Sets scope.compiled"""
+    key = current_key(scope)
+    if key is None:
+        # acquire() compiles the buffers itself
+        print("Protocol not cached: a configuration value cannot be hashed")
+        scope.compiled = None
+        return None
+    path = os.path.join(cache_dir, key)
+    stamp = os.path.join(path, "timing.json")
+    if os.path.exists(stamp):
+        # mark as recently used
+        os.utime(stamp)
+    else:
+        os.makedirs(cache_dir, exist_ok=True)
+        buffers = compile_buffers(scope)
+        timing = {"format": FORMAT_VERSION, "key": key, "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                  "metadata": scope.get_metadata(),
+                  "rates": {"trigger_frequency": scope._get_trigger_exp_freq(),
+                            "stack_sampling_rate": scope.stack_sampling_rate,
+                            "ao_rate": scope.stack_sampling_rate * scope.ao_oversampling},
+                  "buffers": {name: {"dtype": data.dtype.str, "shape": list(data.shape)} for name, data in buffers.items()}}
+        timing["content_hash"] = _content_hash(timing, buffers)
+        _save(path, timing, buffers)
+        evict(cache_dir, max_entries, max_bytes, keep=path)
+    scope.compiled = artifact.load(path)
+    return scope.compiled
@@ -0,0 +1,216 @@
+import math
+import numpy as np
+
+# Every rule a FastMC_core.nidaq protocol must satisfy, declared in one table
+# and checked together: check(scope) returns all violations with the
+# quantities involved instead of stopping at the first one, and never touches
+# the hardware. A rule only runs when the rules it requires passed (e.g. the
+# duty cycle is not computed from an invalid exposure time), so a broken
+# parameter gives one violation instead of a crash further down.
+#
+# nidaq(), acquire() and FastMC_session.arm() call validate(scope) before creating any
+# task. A check takes under 10 microseconds, so a UI can run it on every edit.
+#
+# Use:
+#   for v in FastMC_constraints.check(scope):
+#       print(v["rule"], v["message"], v["values"])
+#   FastMC_constraints.validate(scope)     # ValueError listing every violation
+
+
+def _clocked(s):
+    return s.continuous or s.schedule is not None
+
+
+def _period(s):
+    """Get camera trigger period (s) without printing (nidaq._get_trigger_exp_freq prints when readout limited)"""
+    line_time = s.LINE_TIME_FAST if s.readout_mode == "fast" else s.LINE_TIME_SLOW
+    delay = s.frame_delay_time if s.multi_d else 0
+    return max(s.exposure_time, s.image_height * line_time / 2) + delay
+
+
+def _duty_cycle(s):
+    return 0.9 - s.frame_delay_time / _period(s)
+
+
+def _ranges(s):
+    """Get (z_start, z_end, z_step) of every z sub-range, or none if z_positions is given"""
+    if s.z_positions is not None:
+        return []
+    return list(s.z_ranges) if s.z_ranges is not None else [(s.z_start, s.z_end, s.z_step)]
+
+
+def _n_frames(s):
+    if not s.multi_d:
+        return 1
+    # every plane once per wavelength when switching per frame (nidaq.z_planes)
+    per_plane = len(s.wavelengths) if s.wavelengths is not None and s.wavelength_switch == "frame" else 1
+    if s.z_positions is not None:
+        return len(s.z_positions) * per_plane
+    return sum(math.floor((end - start) / step) + 1 for start, end, step in _ranges(s)) * per_plane
+
+
+def _total_time(s):
+    if s.schedule is not None:
+        high, low = s.compile_pulse_table()
+        return float(high.sum() + low.sum())
+    stack = _n_frames(s) * _period(s) + s.stack_delay_time
+    return stack * s.num_stacks + s.stack_delay_time * (s.num_stacks - 1)
+
+
+def _row_shape(row):
+    """Check a schedule row is (n_stacks, exposures, delay after stack)"""
+    return (isinstance(row, (tuple, list)) and len(row) == 3 and isinstance(row[0], (int, np.integer)) and row[0] >= 1
+            and np.ndim(row[1]) <= 1 and np.size(row[1]) >= 1 and np.isscalar(row[2]) and row[2] >= 0)
+
+
+def _schedule_exposures(s):
+    return np.concatenate([np.ravel(np.asarray(row[1], dtype=float)) for row in s.schedule])
+
+
+def _rf(s):
+    return np.atleast_1d(s.wavelength_to_rf(s.wavelengths))
+
+
+def _is_curve(ramp):
+    return np.ndim(ramp) == 2 and len(ramp) == 2 and np.shape(ramp)[1] >= 2
+
+
+# (name, rules that must pass first, check, offending quantities, message)
+RULES = (
+    ("readout_mode", (), lambda s: s.readout_mode in ("fast", "slow"),
+     lambda s: {"readout_mode": s.readout_mode}, "Invalid camera readout mode"),
+    ("exposure_time", (), lambda s: s.MIN_EXP <= s.exposure_time <= s.MAX_EXP,
+     lambda s: {"exposure_time": s.exposure_time}, "Exposure time is not between 100e-6 and 10.0 sec"),
+    ("frame_delay_time", (), lambda s: 0 <= s.frame_delay_time <= s.MAX_DELAY,
+     lambda s: {"frame_delay_time": s.frame_delay_time}, "Delay between frame triggers is not between 0 and 1.0 sec"),
+    ("stack_delay_time", (), lambda s: s.stack_delay_time >= 0,
+     lambda s: {"stack_delay_time": s.stack_delay_time}, "Delay between stacks is negative"),
+    # num_stacks is the sum of the schedule rows when a schedule is set
+    ("schedule_rows", (), lambda s: s.schedule is None or (isinstance(s.schedule, (tuple, list)) and
+                                                          all(_row_shape(row) for row in s.schedule)),
+     lambda s: {"bad_rows": [k for k, row in enumerate(s.schedule) if not _row_shape(row)]
+                if isinstance(s.schedule, (tuple, list)) else s.schedule},
+     "Schedule rows must be (n_stacks >= 1, exposures, delay after stack >= 0)"),
+    ("num_stacks", ("schedule_rows",), lambda s: int(s.num_stacks) == s.num_stacks and s.num_stacks >= 1,
+     lambda s: {"num_stacks": s.num_stacks}, "Number of stacks must be a positive integer"),
+    ("image_height", (), lambda s: s.MIN_HEIGHT <= s.image_height <= s.MAX_HEIGHT and s.image_height % 2 == 0,
+     lambda s: {"image_height": s.image_height}, "Image height is not an even number of pixels between 16 and 2048"),
+    ("image_width", (), lambda s: s.MIN_WIDTH <= s.image_width <= s.MAX_WIDTH,
+     lambda s: {"image_width": s.image_width}, "Image width is not between 40 and 2060 pixels"),
+
+    # z planes
+    ("z_source", (), lambda s: s.z_positions is None or s.z_ranges is None,
+     lambda s: {"z_positions": s.z_positions, "z_ranges": s.z_ranges}, "Give either z_positions or z_ranges, not both"),
+    ("z_positions", ("z_source",), lambda s: s.z_positions is None or (len(s.z_positions) > 0 and
+                                                 np.min(s.z_positions) >= -200 and np.max(s.z_positions) <= 200),
+     lambda s: {"z_positions": s.z_positions}, "z_positions are empty or out of range [-200, 200]"),
+    ("z_range", ("z_source",), lambda s: all(-200 <= start <= end <= 200 for start, end, _ in _ranges(s)),
+     lambda s: {"z_ranges": _ranges(s)}, "z ranges must have z_start <= z_end within [-200, 200]"),
+    # the number of planes is (z_end - z_start) / z_step + 1
+    ("z_step", ("z_source",), lambda s: not s.multi_d or all(step > 0 for _, _, step in _ranges(s)),
+     lambda s: {"z_steps": [step for _, _, step in _ranges(s)]}, "z_step must be positive in 3D acquisition"),
+
+    # camera trigger
+    ("duty_cycle", ("readout_mode", "exposure_time", "frame_delay_time", "image_height"), lambda s: _duty_cycle(s) > 0,
+     lambda s: {"duty_cycle": _duty_cycle(s), "frame_delay_time": s.frame_delay_time, "trigger_period": _period(s)},
+     "Frame delay time is too long for the exposure time: negative trigger pulse width"),
+    ("schedule", ("schedule_rows", "readout_mode", "image_height"), lambda s: s.schedule is None or (len(s.schedule) > 0 and
+                   s.MIN_EXP <= np.min(_schedule_exposures(s)) and np.max(_schedule_exposures(s)) <= s.MAX_EXP),
+     lambda s: {"exposures": _schedule_exposures(s) if s.schedule else []},
+     "Schedule is empty or an exposure time is not between 100e-6 and 10.0 sec"),
+    # one exposure for the whole stack or one per frame
+    ("schedule_exposures", ("schedule", "z_step", "z_range", "z_positions"),
+     lambda s: s.schedule is None or all(np.size(row[1]) in (1, _n_frames(s)) for row in s.schedule),
+     lambda s: {"exposures_per_row": [int(np.size(row[1])) for row in s.schedule], "frames_per_stack": _n_frames(s)},
+     "Schedule exposures must be one per stack or one per frame"),
+
+    # LED
+    ("led_trigger", (), lambda s: s.led_trigger in (None, "hardware", "software_fraction", "software_time", "modulation"),
+     lambda s: {"led_trigger": s.led_trigger}, "Invalid LED trigger mode"),
+    ("led_fraction_on", (), lambda s: s.led_trigger != "software_fraction" or 0 <= s.led_fraction_on <= 1,
+     lambda s: {"led_fraction_on": s.led_fraction_on}, "LED fraction on must be between 0 and 1"),
+    ("led_modulation", ("led_trigger",), lambda s: s.led_trigger != "modulation" or s.led_modulation is not None,
+     lambda s: {"led_modulation": s.led_modulation}, "LED modulation mode requires led_modulation"),
+    ("led_time_on", ("led_trigger",), lambda s: s.led_trigger != "software_time" or s.led_time_on > 0,
+     lambda s: {"led_time_on": s.led_time_on}, "LED time on must be positive in software_time mode"),
+    ("led_frequency", ("led_time_on",), lambda s: s.led_trigger != "software_time" or s.led_frequency > 0,
+     lambda s: {"led_frequency": s.led_frequency}, "LED frequency must be positive in software_time mode"),
+    ("led_period", ("led_frequency",), lambda s: s.led_trigger != "software_time" or 1 / s.led_frequency >= s.led_time_on,
+     lambda s: {"led_period": 1 / s.led_frequency, "led_time_on": s.led_time_on},
+     "LED period (1 / led_frequency) is shorter than LED time on"),
+    ("led_time_total", ("led_time_on", "duty_cycle", "schedule_exposures", "z_step", "z_range", "z_positions", "num_stacks"),
+     lambda s: s.led_trigger != "software_time" or s.led_time_on <= _total_time(s),
+     lambda s: {"led_time_on": s.led_time_on, "total_acq_time": _total_time(s)},
+     "LED time on is greater than total acquisition time"),
+
+    # continuous streaming
+    ("continuous_delay", (), lambda s: not s.continuous or s.schedule is not None or s.stack_delay_time == 0,
+     lambda s: {"stack_delay_time": s.stack_delay_time}, "Continuous streaming requires stack_delay_time = 0"),
+    ("continuous_led", (), lambda s: not _clocked(s) or s.led_trigger != "software_time",
+     lambda s: {"led_trigger": s.led_trigger}, "Continuous streaming does not support software_time LED trigger"),
+    # one DO sample per camera trigger: a 2D frame is either lit or not
+    ("continuous_fraction", ("led_trigger",), lambda s: not _clocked(s) or s.multi_d or s.led_trigger != "software_fraction",
+     lambda s: {"led_trigger": s.led_trigger, "multi_d": s.multi_d},
+     "2D continuous streaming clocks the LED once per frame: software_fraction cannot light a fraction of a frame"),
+    ("start_timeout", (), lambda s: not s.external_start or s.start_timeout > 0,
+     lambda s: {"start_timeout": s.start_timeout}, "Start timeout must be positive"),
+    ("ao_oversampling", (), lambda s: int(s.ao_oversampling) == s.ao_oversampling and s.ao_oversampling >= 1,
+     lambda s: {"ao_oversampling": s.ao_oversampling}, "AO oversampling must be a positive integer"),
+    ("continuous_oversampling", ("ao_oversampling",), lambda s: not _clocked(s) or s.ao_oversampling == 1,
+     lambda s: {"ao_oversampling": s.ao_oversampling},
+     "Continuous streaming outputs one AO sample per camera trigger: ao_oversampling must be 1"),
+
+    # ao1: power ramp and AOTF wavelength
+    ("ao1_exclusive", (), lambda s: (s.led_trigger == "modulation") + (s.power_ramp is not None) + (s.wavelengths is not None) <= 1,
+     lambda s: {"led_trigger": s.led_trigger, "power_ramp": s.power_ramp, "wavelengths": s.wavelengths},
+     "ao1 carries either the LED modulation, the power ramp or the AOTF wavelength, not more"),
+    ("power_ramp_3d", (), lambda s: s.power_ramp is None or s.multi_d,
+     lambda s: {"multi_d": s.multi_d}, "Power ramp requires multidimensional acquisition"),
+    ("power_ramp", (), lambda s: s.power_ramp is None or (s.power_ramp in ("linear", "exponential") if isinstance(s.power_ramp, str)
+                                                         else _is_curve(s.power_ramp)),
+     lambda s: {"power_ramp": s.power_ramp},
+     "Invalid power ramp: give \"linear\", \"exponential\" or a measured (z, signal) curve of at least 2 points"),
+    ("power_range", (), lambda s: s.power_ramp is None or s.MINV_LED <= min(s.power_range) <= max(s.power_range) <= s.MAXV_LED,
+     lambda s: {"power_range": s.power_range}, "Power range is out of volt range (0-5)"),
+    ("attenuation_length", (), lambda s: s.power_ramp is None or s.attenuation_length > 0,
+     lambda s: {"attenuation_length": s.attenuation_length}, "Attenuation length must be positive"),
+    ("wavelength_switch", (), lambda s: s.wavelengths is None or s.wavelength_switch in ("frame", "stack"),
+     lambda s: {"wavelength_switch": s.wavelength_switch}, "Invalid wavelength switch: give \"frame\" or \"stack\""),
+    ("wavelength_frame", ("wavelength_switch",), lambda s: s.wavelengths is None or s.wavelength_switch != "frame" or s.multi_d,
+     lambda s: {"multi_d": s.multi_d}, "2D acquisition has one frame per stack: use wavelength_switch = \"stack\""),
+    ("wavelength_stack", ("wavelength_switch",), lambda s: s.wavelengths is None or s.wavelength_switch != "stack" or _clocked(s),
+     lambda s: {"continuous": s.continuous}, "Wavelength switching per stack requires continuous streaming"),
+    ("wavelength_rf", ("wavelength_switch",), lambda s: s.wavelengths is None or s.MIN_RF <= _rf(s).min() <= _rf(s).max() <= s.MAX_RF,
+     lambda s: {"wavelengths": s.wavelengths}, "AOTF RF frequency out of range [74, 158] MHz"),
+)
+
+NAMES = tuple(rule[0] for rule in RULES)
+
+
+def check(scope, rules=RULES):
+    """Get every violated rule of a nidaq protocol as {"rule", "message", "values"}, in table order"""
+    passed = set()
+    violations = []
+    for name, requires, ok, values, message in rules:
+        if not passed.issuperset(requires):
+            continue
+        try:
+            valid = bool(ok(scope))
+            # the quantities are computed in the same guard: they may fail like the check
+            found = None if valid else values(scope)
+        except (ValueError, TypeError) as e:
+            # e.g. wavelength outside of the AOTF calibration table, or a parameter of the wrong type
+            valid, message, found = False, str(e), {}
+        if valid:
+            passed.add(name)
+            continue
+        violations.append({"rule": name, "message": message, "values": found})
+    return violations
+
+
+def validate(scope):
+    """Raise ValueError listing every violated rule of a nidaq protocol"""
+    violations = check(scope)
+    if violations:
+        raise ValueError("Invalid protocol:\n" + "\n".join(
+            f"  {v['rule']}: {v['message']} ({', '.join(f'{k} = {x}' for k, x in v['values'].items())})" for v in violations))
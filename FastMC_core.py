@@ -1,17 +1,45 @@
 import nidaqmx
 import nidaqmx.system
+import nidaqmx.stream_writers
 import numpy as np
 import tkinter as tk
 from tkinter import messagebox
 import pco   
-import matplotlib.pyplot as plt
-import scipy
 import math
+import json
+import contextlib
+from collections import OrderedDict
+import FastMC_timeline
+import FastMC_compile
+import FastMC_constraints
 
 # Create a workflow using the NI-DAQmx Python API to synchronize the 
 # acquisition of a camera with the generation of an analog signal to control a 
 # galvo mirror and digital signals to control 2 lasers (LED)
 
+# shared do-nothing context for untraced runs
+NO_TRACE = contextlib.nullcontext()
+
+
+class lru_cache(OrderedDict):
+    """Dict keeping only the max_entries most recently used entries (compiled buffers of live edits)"""
+
+    def __init__(self, max_entries=8):
+        super().__init__()
+        self.max_entries = max_entries
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.max_entries:
+            self.popitem(last=False)
+
+
 class nidaq:
     # Analog input/output only    
     ao0 = "Dev1/ao0"   # OPM galvo
@@ -22,10 +50,15 @@ class nidaq:
     ctr1_internal = "ctr1InternalOutput"   # idle
     ctr0 = "Dev1/ctr0"                     # stack trigger
     ctr0_internal = "ctr0InternalOutput"   # internal signal for stack trigger
+    ctr2 = "Dev1/ctr2"                     # PFI1 edge timestamps: 100 MHz timebase count
+    ctr3 = "Dev1/ctr3"                     # camera frame count at PFI1 edges
+    TIMEBASE = "100MHzTimebase"
+    TIMEBASE_RATE = 100e6                  # Hz
+    MAX_SYNC_RATE = 10e3                   # Hz. expected max rate of PFI1 edges
 
     # programmable function I/O (PFI lines)
     PFI0 = "PFI0"
-    PFI1 = "Dev1/PFI1"   
+    PFI1 = "Dev1/PFI1"   # external start / sync input
 
     # Digital and timing I/O (not all)
     do0 = "Dev1/port0/line0"   # LED
@@ -40,6 +73,13 @@ class nidaq:
     MIN_RF = 74e6         # Hz
     MAX_RF = 158e6        # Hz
     MAX_RF_POWER = 0.15   # Watts
+    MINV_RF = 0.0         # V. RF driver frequency control input at MIN_RF
+    MAXV_RF = 5.0         # V. RF driver frequency control input at MAX_RF
+    AOTF_TUNING = ((400.0, 158e6), (650.0, 74e6))   # (nm, Hz) ends of the tuning curve f = a + b / wavelength
+    
+    # LED / AOTF modulation input (ao1)
+    MAXV_LED = 5.0
+    MINV_LED = 0.0
 
     # pco 4.2 CL
     LINE_TIME_SLOW = 27.77e-6     # sec
@@ -73,44 +113,25 @@ class nidaq:
             frame_delay_time = 0.0,         # s. optional delay after each frame trigger
             rf_freq = 1e6,                  # RF frequency of AOTF
             led_stack_fraction_on = 1.0,    # percent of time LED is on during every stack acquisition in software_fraction mode
-            led_trigger = None,             # "hardware", "software_fraction", "software_time" triggering of LED if light control is desired
+            led_trigger = None,             # "hardware", "software_fraction", "software_time", "modulation" control of LED if light control is desired
             led_time_on = 0.0,              # s. time LED is on during acquisition in software_time mode (i.e. LED period)
-            led_frequency = 0):             # pulses/second. Nonzero to pulse the LED for led_time_on at given frequency
-        
-        if (exposure_time < self.MIN_EXP or exposure_time > self.MAX_EXP):
-            raise ValueError("Exposure time is not between 100e-6 and 10.0 sec")
-        if (frame_delay_time > self.MAX_DELAY):
-            raise ValueError("Delay between frame triggers is greater than 1.0 sec")
-        if (image_height > self.MAX_HEIGHT or image_height < self.MIN_HEIGHT):
-            raise ValueError("Image height is not between 16 and 2048 pixels")
-        if (image_height % 2 != 0):
-            raise ValueError("Image height should be an even number of pixels")
-        if (image_width > self.MAX_WIDTH or image_width < self.MIN_WIDTH):
-            raise ValueError("Image width is not between 40 and 2060 pixels")
-        if (z_end < z_start):
-            raise ValueError("z_end is smaller than z_start")
-        if (z_end > 200 or z_start < -200):
-            raise ValueError("z_end and/or z_start are out of range [-200, 200]")
-        
-        if readout_mode == "fast":
-            self.line_time = self.LINE_TIME_FAST
-            self.readout_rate = self.READOUT_RATE_FAST
-            self.max_full_frame_rate = self.MAX_FRAME_RATE_FAST
-        elif readout_mode == "slow":
-            self.line_time = self.LINE_TIME_SLOW
-            self.readout_rate = self.READOUT_RATE_SLOW
-            self.max_full_frame_rate = self.MAX_FRAME_RATE_SLOW
-        else:
-            raise ValueError("Invalid camera readout mode")
-        
-        if led_trigger == "hardware":
-            print("LED hardware trigger selected. Verify BNC cable connects Cam Exp Out to LED In")
-        elif led_trigger == "software_fraction" or led_trigger == "software_time":
-            print("LED software trigger selected. Verify BNC cable connects USER1 OUT to LED In")
-        elif led_trigger is None:
-            print("No LED light control selected.")
-        else:
-            raise ValueError("Invalid LED trigger mode")
+            led_frequency = 0,              # pulses/second. Nonzero to pulse the LED for led_time_on at given frequency
+            continuous = False,             # gapless streaming: the camera counter clocks galvo and LED for all stacks
+            schedule = None,                # rows (n_stacks, exposure per slice (s), delay after stack (s)). Overrides num_stacks
+            z_positions = None,             # microm. optional list of z planes. Overrides z_start, z_end, z_step
+            z_ranges = None,                # microm. optional list of (z_start, z_end, z_step) sub-ranges per stack
+            calibration = None,             # FastMC_calibration.galvo_calibration. Linear volt_per_z if None
+            led_modulation = None,          # V. function of time (s) from stack start, or array sampled over a stack. ao1 in modulation mode
+            ao_oversampling = 1,            # AO samples per camera frame. >1 resolves the LED modulation within a frame
+            power_ramp = None,              # "linear", "exponential" or measured (z microm, relative signal) curve: ao1 excitation per slice
+            power_range = (1.0, 5.0),       # V. ao1 voltage of the ramp at the brightest and at the dimmest plane
+            attenuation_length = 100.0,     # microm. exponential ramp: signal decays as exp(-depth / attenuation_length)
+            wavelengths = None,             # nm. AOTF wavelength sequence, cycled over frames of a stack or over stacks. ao1
+            wavelength_switch = "frame",    # "frame": every z plane once per wavelength. "stack": one wavelength per stack
+            aotf_table = None,              # optional measured (wavelength nm, RF Hz) rows. Tuning curve fit if None
+            external_start = False,         # arm, then start on a rising edge at PFI1 (e.g. electrophysiology rig, stimulus computer)
+            sync_input = False,             # timestamp every rising edge at PFI1 with the 100 MHz timebase and the frame count
+            start_timeout = 60.0):          # s. max wait for the external start edge
         
         # assign user inputs
         self.num_stacks = num_stacks
@@ -124,24 +145,137 @@ class nidaq:
         self.z_start = z_start
         self.z_end = z_end
         self.z_step = z_step
+        self.z_positions = z_positions
+        self.z_ranges = z_ranges
         self.rf_freq = rf_freq
         self.led_fraction_on = led_stack_fraction_on
         self.led_trigger = led_trigger
         self.led_time_on = led_time_on
         self.led_frequency = led_frequency
+        self.led_modulation = led_modulation
+        self.ao_oversampling = ao_oversampling
+        self.power_ramp = power_ramp
+        self.power_range = power_range
+        self.attenuation_length = attenuation_length
+        self.wavelengths = wavelengths
+        self.wavelength_switch = wavelength_switch
+        self.aotf_table = aotf_table
+        self.continuous = continuous
+        self.schedule = schedule
+        self.external_start = external_start
+        self.sync_input = sync_input
+        self.start_timeout = start_timeout
         
         # conversion from z to galvo voltage according to experimental calibration
         self.volt_per_z = 1.7 / (200)
+        self.calibration = calibration
+        # compiled galvo data per calibration version, step rate and z planes. Bounded: live edits add an entry each
+        self._galvo_cache = lru_cache()
+        # compiled LED modulation per function (or array), samples and rate, and power ramp per z planes
+        self._led_cache = lru_cache()
+        # optional FastMC_trace.tracer recording the time of every acquisition phase
+        self.tracer = None
+        # optional FastMC_compile.artifact: precompiled buffers used by acquire instead of regenerating them
+        self.compiled = None
+        # PFI1 edges of the last acquisition aligned to the frames (sync_input)
+        self.sync_edges = None
+        
+        if readout_mode == "fast":
+            self.line_time = self.LINE_TIME_FAST
+            self.readout_rate = self.READOUT_RATE_FAST
+            self.max_full_frame_rate = self.MAX_FRAME_RATE_FAST
+        elif readout_mode == "slow":
+            self.line_time = self.LINE_TIME_SLOW
+            self.readout_rate = self.READOUT_RATE_SLOW
+            self.max_full_frame_rate = self.MAX_FRAME_RATE_SLOW
+        
+        # every parameter rule lives in FastMC_constraints.RULES: all violations in one ValueError
+        FastMC_constraints.validate(self)
+        self.ao_oversampling = int(ao_oversampling)
         
+        if led_trigger == "hardware":
+            print("LED hardware trigger selected. Verify BNC cable connects Cam Exp Out to LED In")
+        elif led_trigger == "software_fraction" or led_trigger == "software_time":
+            print("LED software trigger selected. Verify BNC cable connects USER1 OUT to LED In")
+        elif led_trigger == "modulation":
+            print("LED analog modulation selected. Verify BNC cable connects AO1 to LED modulation In")
+        else:
+            print("No LED light control selected.")
         if self.multi_d:
             print("Stage (galvo) control enabled. Verify MicroManager NIDAQHub control is disabled.")
+        if self.wavelengths is not None:
+            print("AOTF wavelength switching selected. Verify BNC cable connects AO1 to AOTF driver frequency In")
+        if self.external_start or self.sync_input:
+            print("External TTL input selected. Verify BNC cable connects the external trigger to PFI1")
                     
 
+    def _trace(self, name):
+        """Get context manager recording the duration of an acquisition phase if a tracer is set"""
+        return self.tracer.span(name) if self.tracer is not None else NO_TRACE
+    
+    
+    def _data(self, name, compile_data):
+        """Get a channel buffer from the compiled protocol if set, else compile it"""
+        if self.compiled is None or name not in self.compiled.buffers:
+            return compile_data()
+        data = self.compiled.buffers[name]
+        # DO writes take lists of bool
+        return data.tolist() if name == "led" else data
+    
+    
     @property
     def frames_per_stack(self):
         """Get number of frames per stack) start and end inclusive"""
-        n = math.floor((self.z_end - self.z_start) / self.z_step) + 1 
-        return n if self.multi_d else 1
+        return len(self.z_planes) if self.multi_d else 1
+    
+    
+    @property
+    def z_planes(self):
+        """Get z position (microm) of every frame in a stack, in scan order"""
+        if not self.multi_d:
+            return np.array([self.z_start])
+        if self.z_positions is not None:
+            planes = np.asarray(self.z_positions, dtype=float)
+        else:
+            ranges = self.z_ranges if self.z_ranges is not None else [(self.z_start, self.z_end, self.z_step)]
+            planes = []
+            for start, end, step in ranges:
+                n = math.floor((end - start) / step) + 1 
+                planes.append(np.linspace(start, end, n))
+            planes = np.concatenate(planes)
+        if self.wavelengths is not None and self.wavelength_switch == "frame":
+            # every plane once per wavelength of the sequence: the galvo holds while the AOTF cycles
+            planes = np.repeat(planes, len(self.wavelengths))
+        return planes
+    
+    
+    @staticmethod
+    def adaptive_z_positions(z_start, z_end, roi_start, roi_end, dense_step, sparse_step):
+        """Get z positions (microm) sampled with dense_step inside the ROI and sparse_step elsewhere"""
+        roi_start, roi_end = max(roi_start, z_start), min(roi_end, z_end)
+        below = np.arange(z_start, roi_start, sparse_step)
+        roi = np.arange(roi_start, roi_end + dense_step / 2, dense_step)
+        above = np.arange(roi_end + sparse_step, z_end + sparse_step / 2, sparse_step)
+        return np.concatenate([below, roi, above])
+    
+    
+    @property
+    def num_stacks(self):
+        """Get number of stacks: the sum of the schedule rows if set (derived, so edits of the schedule follow)"""
+        if self.schedule is not None:
+            return sum(row[0] for row in self.schedule)
+        return self._num_stacks
+    
+    
+    @num_stacks.setter
+    def num_stacks(self, value):
+        self._num_stacks = value
+    
+    
+    @property
+    def total_frames(self):
+        """Get number of camera triggers in the whole acquisition"""
+        return self.num_stacks * self.frames_per_stack
     
     
 # ------------------------------- TIMING --------------------------------- #
@@ -197,8 +331,17 @@ class nidaq:
         return 10 / self.led_time_on
     
 
+    @property
+    def volume_rate(self):
+        """Get stacks per second without delay between stacks (limit of continuous streaming)"""
+        return self._get_trigger_exp_freq() / self.frames_per_stack
+
+
     def get_total_acq_time(self):
         """Get total time to acquire all stacks if 3D, or all frames if 2D"""
+        if self.schedule is not None:
+            high_times, low_times = self.compile_pulse_table()
+            return float(np.sum(high_times) + np.sum(low_times))
         return self.get_stack_time() * self.num_stacks + self.stack_delay_time * (self.num_stacks - 1)
         
         
@@ -220,19 +363,177 @@ class nidaq:
 # --------------------------- I/0 SETTINGS  ----------------------------- #
 
 
+    @property
+    def use_ao(self):
+        """Get whether an analog output task is needed: galvo (3D) and/or ao1 excitation"""
+        return self.multi_d or self.ao1_output is not None
+    
+    
+    @property
+    def ao1_output(self):
+        """Get what ao1 carries: "modulation", "power_ramp", "aotf" or None"""
+        if self.led_trigger == "modulation":
+            return "modulation"
+        if self.power_ramp is not None:
+            return "power_ramp"
+        if self.wavelengths is not None:
+            return "aotf"
+        return None
+
+
     def _create_ao_task(self):
-        """Create the analog output task for the galvo"""
-        task_ao = nidaqmx.Task("AO")
-        task_ao.ao_channels.add_ao_voltage_chan(self.ao0, min_val=self.MINV_GALVO, max_val=self.MAXV_GALVO)       
+        """Create the analog output task for the galvo and the ao1 excitation (one AO timing engine per device)"""
+        with self._trace("AO: create task"):
+            task_ao = nidaqmx.Task("AO")
+            if self.multi_d:
+                task_ao.ao_channels.add_ao_voltage_chan(self.ao0, min_val=self.MINV_GALVO, max_val=self.MAXV_GALVO)       
+            if self.ao1_output == "aotf":
+                task_ao.ao_channels.add_ao_voltage_chan(self.ao1, min_val=self.MINV_RF, max_val=self.MAXV_RF)
+            elif self.ao1_output is not None:
+                task_ao.ao_channels.add_ao_voltage_chan(self.ao1, min_val=self.MINV_LED, max_val=self.MAXV_LED)
         return task_ao
+    
+    
+    def _get_ao_data(self, clocked=False):
+        """Get the array data to write to the AO task: one row per channel (galvo, ao1 excitation)"""
+        if clocked:
+            # one sample per camera trigger
+            k, rate = 1, self._get_trigger_exp_freq()
+        else:
+            k = (1 if self.multi_d else 10) * self.ao_oversampling
+            rate = self.stack_sampling_rate * self.ao_oversampling
+        n = self.frames_per_stack * k
+        # wavelength per stack: the clocked buffer holds one stack per wavelength of the sequence
+        n_cycle = len(self.wavelengths) if self.ao1_output == "aotf" and self.wavelength_switch == "stack" else 1
+        rows = []
+        if self.multi_d:
+            galvo = self._get_ao_galvo_data()
+            rows.append(galvo if k == 1 else np.repeat(galvo, k))
+        if self.ao1_output == "modulation":
+            rows.append(self._get_ao_led_data_modulation(n, rate))
+        elif self.ao1_output == "power_ramp":
+            power = self._get_ao_power_data()
+            rows.append(power if k == 1 else np.repeat(power, k))
+        elif self.ao1_output == "aotf":
+            aotf = self._get_ao_aotf_data_wavelength()
+            rows.append(aotf if k == 1 else np.repeat(aotf, k))
+        if n_cycle > 1:
+            rows[:-1] = [np.tile(row, n_cycle) for row in rows[:-1]]
+        return rows[0] if len(rows) == 1 else np.vstack(rows)
 
 
     def _get_ao_galvo_data(self):
         """Get the array data to write to the ao channel"""
         # continuous sawtooth requires more samples than frames_per_stack  - could refine more how this is related to z step
-        return np.linspace(self.volt_per_z*self.z_start, self.volt_per_z*self.z_end, self.frames_per_stack)
+        return self._z_to_volt(self.z_planes)
+    
+    
+    def _z_to_volt(self, z):
+        """Get galvo voltage of z positions with the measured calibration, cached per calibration version"""
+        if self.calibration is None:
+            return self.volt_per_z * z
+        rate = self._get_trigger_exp_freq()
+        key = (self.calibration.version, rate, z.tobytes())
+        if key not in self._galvo_cache:
+            volts = self.calibration.z_to_volt(z, rate)
+            if np.any(volts > self.MAXV_GALVO) or np.any(volts < self.MINV_GALVO):
+                raise ValueError("Calibrated galvo voltage out of range [-1.7, 1.7] V")
+            volts.flags.writeable = False
+            self._galvo_cache[key] = volts
+        return self._galvo_cache[key]
+
 
+    def _get_ao_led_data_modulation(self, n, rate):
+        """Get the LED modulation voltage at n AO samples of a stack, cached per modulation, samples and rate"""
+        func = self.led_modulation
+        try:
+            # by content, not identity: an edited global or closure value of the function changes the key
+            key = (FastMC_compile.value_key(func) if callable(func) else np.asarray(func, dtype=float).tobytes(), n, rate)
+        except ValueError:
+            # function that cannot be hashed: compiled on every call
+            key = None
+        if key is None or key not in self._led_cache:
+            if callable(func):
+                t = np.arange(n) / rate
+                try:
+                    volts = np.asarray(func(t), dtype=float)
+                except TypeError:
+                    # scalar-only function (e.g. math.sin): evaluate sample by sample
+                    volts = np.vectorize(func, otypes=[float])(t)
+                volts = np.broadcast_to(volts, (n,)).copy()
+            else:
+                # array spread evenly over the stack, resampled to the AO samples
+                samples = np.asarray(func, dtype=float)
+                volts = samples.copy() if len(samples) == n else np.interp(np.arange(n) / n, np.arange(len(samples)) / len(samples), samples)
+            # one pass for the range. Written as "not inside" so NaN fails too
+            v_min, v_max = volts.min(), volts.max()
+            if not (v_min >= self.MINV_LED and v_max <= self.MAXV_LED):
+                raise ValueError(f"LED modulation out of volt range (0-5): [{v_min}, {v_max}]")
+            volts.flags.writeable = False
+            self._led_cache[key] = volts
+        return self._led_cache[key]
 
+
+    def _get_ao_power_data(self):
+        """Get the ao1 excitation voltage of every slice from the power ramp, cached per ramp and z planes"""
+        z = self.z_planes
+        ramp = self.power_ramp
+        key = ("ramp", ramp if isinstance(ramp, str) else np.asarray(ramp, dtype=float).tobytes(),
+               tuple(self.power_range), self.attenuation_length, z.tobytes())
+        if key not in self._led_cache:
+            # depth from the shallowest plane: larger z is deeper
+            depth = z - z.min()
+            if isinstance(ramp, str):
+                gain = depth if ramp == "linear" else np.expm1(depth / self.attenuation_length)
+            else:
+                # measured signal vs z: compensate by its inverse
+                z_measured, signal = np.asarray(ramp, dtype=float)
+                order = np.argsort(z_measured)
+                gain = 1 / np.interp(z, z_measured[order], signal[order])
+            span = gain.max() - gain.min()
+            gain = (gain - gain.min()) / span if span > 0 else np.zeros_like(gain)
+            v_bright, v_dim = self.power_range
+            volts = v_bright + (v_dim - v_bright) * gain
+            volts.flags.writeable = False
+            self._led_cache[key] = volts
+        return self._led_cache[key]
+    
+    
+    def wavelength_to_rf(self, wavelength):
+        """Get AOTF RF frequency (Hz) of wavelengths (nm) from the measured table or the tuning curve"""
+        wavelength = np.asarray(wavelength, dtype=float)
+        if self.aotf_table is not None:
+            table_nm, table_rf = np.asarray(self.aotf_table, dtype=float).T
+            order = np.argsort(table_nm)
+            if np.any(wavelength < table_nm.min()) or np.any(wavelength > table_nm.max()):
+                raise ValueError("Wavelength outside of the AOTF calibration table")
+            return np.interp(wavelength, table_nm[order], table_rf[order])
+        # acousto-optic tuning: f = a + b / wavelength through both ends of the tuning range
+        (nm1, rf1), (nm2, rf2) = self.AOTF_TUNING
+        b = (rf1 - rf2) / (1 / nm1 - 1 / nm2)
+        a = rf1 - b / nm1
+        return a + b / wavelength
+    
+    
+    def _get_ao_aotf_data_wavelength(self):
+        """Get the AOTF driver control voltage of every frame (or every stack of the sequence), cached per sequence"""
+        key = ("aotf", np.asarray(self.wavelengths, dtype=float).tobytes(), self.wavelength_switch,
+               None if self.aotf_table is None else np.asarray(self.aotf_table, dtype=float).tobytes(), self.frames_per_stack)
+        if key not in self._led_cache:
+            rf = self.wavelength_to_rf(self.wavelengths)
+            if np.any(rf < self.MIN_RF) or np.any(rf > self.MAX_RF):
+                raise ValueError("AOTF RF frequency out of range [74, 158] MHz")
+            volts = self.MINV_RF + (rf - self.MIN_RF) / (self.MAX_RF - self.MIN_RF) * (self.MAXV_RF - self.MINV_RF)
+            if self.wavelength_switch == "frame":
+                # sequence restarts at every stack
+                volts = np.resize(volts, self.frames_per_stack)
+            else:
+                volts = np.repeat(volts, self.frames_per_stack)
+            volts.flags.writeable = False
+            self._led_cache[key] = volts
+        return self._led_cache[key]
+    
+    
     def _get_ao_aotf_data(self):
         """Get the array data to drive the AOTF at RF frequency"""
         rate = 100
@@ -245,8 +546,9 @@ class nidaq:
     
     
     def _create_led_do_task(self):
-        task_do = nidaqmx.Task("LED")
-        task_do.do_channels.add_do_chan(self.do0)       # LED
+        with self._trace("LED: create task"):
+            task_do = nidaqmx.Task("LED")
+            task_do.do_channels.add_do_chan(self.do0)       # LED
         return task_do
     
     
@@ -275,87 +577,265 @@ class nidaq:
     # NOTE: discussions have been around the lack of core timing - this would provide that 
     def _stack_trigger(self):
         """generate rising edge trigger for each stack or frame"""    
-        task_ctr = nidaqmx.Task("stack_trigger")
-        task_ctr.co_channels.add_co_pulse_chan_freq(self.ctr0, idle_state=nidaqmx.constants.Level.LOW, 
-                                                    freq=1/self.get_stack_time(), duty_cycle=0.2)
+        with self._trace("stack_trigger: create task"):
+            task_ctr = nidaqmx.Task("stack_trigger")
+        with self._trace("stack_trigger: add_co_pulse_chan_freq"):
+            task_ctr.co_channels.add_co_pulse_chan_freq(self.ctr0, idle_state=nidaqmx.constants.Level.LOW, 
+                                                        freq=1/self.get_stack_time(), duty_cycle=0.2)
         samps = self.num_stacks if self.num_stacks != 1 else 2
-        task_ctr.timing.cfg_implicit_timing(sample_mode=nidaqmx.constants.AcquisitionType.FINITE, samps_per_chan=samps)
+        with self._trace("stack_trigger: cfg_implicit_timing"):
+            task_ctr.timing.cfg_implicit_timing(sample_mode=nidaqmx.constants.AcquisitionType.FINITE, samps_per_chan=samps)
+        self._cfg_external_start(task_ctr)
         
         return task_ctr
         
         
     def _cam_exposure_trigger(self):
         """generate TTL pulse train for parallel cam trigger"""
-        task_ctr = nidaqmx.Task("cam_trigger")
+        with self._trace("cam_trigger: create task"):
+            task_ctr = nidaqmx.Task("cam_trigger")
         # duty cycle < 1.0 means the real exposure time is slightly less than input with rising delay
-        task_ctr.co_channels.add_co_pulse_chan_freq(self.ctr1, idle_state=nidaqmx.constants.Level.LOW, freq=self._get_trigger_exp_freq(), duty_cycle=self.duty_cycle)
+        with self._trace("cam_trigger: add_co_pulse_chan_freq"):
+            task_ctr.co_channels.add_co_pulse_chan_freq(self.ctr1, idle_state=nidaqmx.constants.Level.LOW, freq=self._get_trigger_exp_freq(), duty_cycle=self.duty_cycle)
         # use the internal clock of the device
-        if self.multi_d:
-            if self.stack_delay_time == 0:
-                task_ctr.timing.cfg_implicit_timing(sample_mode=nidaqmx.constants.AcquisitionType.CONTINUOUS, samps_per_chan=self.frames_per_stack)
+        with self._trace("cam_trigger: cfg_implicit_timing"):
+            if self.multi_d:
+                if self.stack_delay_time == 0:
+                    task_ctr.timing.cfg_implicit_timing(sample_mode=nidaqmx.constants.AcquisitionType.CONTINUOUS, samps_per_chan=self.frames_per_stack)
+                else:
+                    # finite mode is able to finish with a delay between stacks
+                    task_ctr.timing.cfg_implicit_timing(sample_mode=nidaqmx.constants.AcquisitionType.FINITE, samps_per_chan=self.frames_per_stack)
             else:
-                # finite mode is able to finish with a delay between stacks
-                task_ctr.timing.cfg_implicit_timing(sample_mode=nidaqmx.constants.AcquisitionType.FINITE, samps_per_chan=self.frames_per_stack)
-        else:
-            task_ctr.timing.cfg_implicit_timing(sample_mode=nidaqmx.constants.AcquisitionType.FINITE, samps_per_chan=1)
+                task_ctr.timing.cfg_implicit_timing(sample_mode=nidaqmx.constants.AcquisitionType.FINITE, samps_per_chan=1)
         # trigger is activated when ctr0 goes up
-        task_ctr.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source=self.ctr0_internal, trigger_edge=nidaqmx.constants.Slope.RISING)
-        task_ctr.triggers.start_trigger.retriggerable = True
+        with self._trace("cam_trigger: cfg_dig_edge_start_trig"):
+            task_ctr.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source=self.ctr0_internal, trigger_edge=nidaqmx.constants.Slope.RISING)
+            task_ctr.triggers.start_trigger.retriggerable = True
 
         return task_ctr
     
     
-    def setup_triggered_task(self, task, data_task):
+    def setup_triggered_task(self, task, data_task, oversampling=1, start=True):
         """Setup task to be re-triggerable by ctr0"""
         # rate and number of samples stop it before delay (idle time)
-        samps = self.frames_per_stack if self.multi_d else 10
-        task.timing.cfg_samp_clk_timing(rate=self.stack_sampling_rate, sample_mode=nidaqmx.constants.AcquisitionType.FINITE, 
-                                            samps_per_chan= samps)
+        samps = (self.frames_per_stack if self.multi_d else 10) * oversampling
+        with self._trace(f"{task.name}: cfg_samp_clk_timing"):
+            task.timing.cfg_samp_clk_timing(rate=self.stack_sampling_rate * oversampling, sample_mode=nidaqmx.constants.AcquisitionType.FINITE, 
+                                                samps_per_chan= samps)
         # set start trigger
-        task.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source=self.ctr0_internal, trigger_edge=nidaqmx.constants.Edge.RISING)
+        with self._trace(f"{task.name}: cfg_dig_edge_start_trig"):
+            task.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source=self.ctr0_internal, trigger_edge=nidaqmx.constants.Edge.RISING)
         # retriggerable between stacks
         task.triggers.start_trigger.retriggerable = True
         # start and wait for stack trigger
-        task.write(data_task, auto_start=False)
-        task.start()
+        with self._trace(f"{task.name}: write"):
+            task.write(data_task, auto_start=False)
+        if start:
+            with self._trace(f"{task.name}: start"):
+                task.start()
         
-    def setup_not_triggered_task(self, task, data_task):
+    def setup_not_triggered_task(self, task, data_task, start=True):
         """Setup task to take a single trigger by ctr0. Sampling rate does include stack delay"""
         # rate and number of samples stop it before delay (idle time)
         samps = int(self.stack_sampling_rate_delay*self.get_total_acq_time())
-        task.timing.cfg_samp_clk_timing(rate=self.stack_sampling_rate_delay, sample_mode=nidaqmx.constants.AcquisitionType.FINITE, 
-                                            samps_per_chan= samps)
+        with self._trace(f"{task.name}: cfg_samp_clk_timing"):
+            task.timing.cfg_samp_clk_timing(rate=self.stack_sampling_rate_delay, sample_mode=nidaqmx.constants.AcquisitionType.FINITE, 
+                                                samps_per_chan= samps)
         # set start trigger
-        task.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source=self.ctr0_internal, trigger_edge=nidaqmx.constants.Edge.RISING)
+        with self._trace(f"{task.name}: cfg_dig_edge_start_trig"):
+            task.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source=self.ctr0_internal, trigger_edge=nidaqmx.constants.Edge.RISING)
         # retriggerable between stacks
         task.triggers.start_trigger.retriggerable = False
         # start and wait for stack trigger
-        task.write(data_task, auto_start=False)
-        task.start()
+        with self._trace(f"{task.name}: write"):
+            task.write(data_task, auto_start=False)
+        if start:
+            with self._trace(f"{task.name}: start"):
+                task.start()
         
         
-# ------------------------------ GRAPHING -------------------------------- #
+# ------------------------ CONTINUOUS STREAMING  -------------------------- #
 
-    def plot_preview(self, n_cycles=1):
+    def _cam_exposure_clock(self, free_running=False):
+        """generate TTL pulse train for all frames of all stacks: shared sample clock in continuous mode"""
+        with self._trace("cam_trigger: create task"):
+            task_ctr = nidaqmx.Task("cam_trigger")
+        with self._trace("cam_trigger: add_co_pulse_chan_freq"):
+            task_ctr.co_channels.add_co_pulse_chan_freq(self.ctr1, idle_state=nidaqmx.constants.Level.LOW, freq=self._get_trigger_exp_freq(), duty_cycle=self.duty_cycle)
+        with self._trace("cam_trigger: cfg_implicit_timing"):
+            if free_running:
+                # live mode: runs until stopped
+                task_ctr.timing.cfg_implicit_timing(sample_mode=nidaqmx.constants.AcquisitionType.CONTINUOUS, samps_per_chan=self.frames_per_stack)
+            else:
+                # hardware frame count: the counter stops after the last frame, which also stops the clocked tasks
+                task_ctr.timing.cfg_implicit_timing(sample_mode=nidaqmx.constants.AcquisitionType.FINITE, samps_per_chan=self.total_frames)
+                self._cfg_external_start(task_ctr)
         
-        t = np.linspace(0.0, n_cycles * self.get_stack_time(), n_cycles * 500, endpoint=False)
-        one_t = np.linspace(0.0, self.frames_per_stack / self._get_trigger_exp_freq(), 500, endpoint=False)
-        stack_pulse = 2.5 * (1 + scipy.signal.square(2 * np.pi * t / self.get_stack_time(), 0.2))
-        exp_pulse_on = 3.3/2 * (1 + scipy.signal.square(2 * np.pi * one_t * self._get_trigger_exp_freq(), self.duty_cycle))
+        return task_ctr
+    
+    
+    def _get_do_led_data_clocked(self):
+        """Get the array data to write to the do channel in continuous mode: one sample per frame"""
+        # fraction is rounded to whole frames. LED is switched off after the run instead of at each stack end
+        n_on = round(self.frames_per_stack * self.led_fraction_on)
+        return [True] * n_on + [False] * (self.frames_per_stack - n_on)
+    
+    
+    def setup_clocked_task(self, task, data_task, rate=None, start=True):
+        """Setup task to output one sample per camera trigger, regenerating the stack data without retriggering"""
+        # rate is only the expected max rate of the external clock
+        rate = rate if rate is not None else self._get_trigger_exp_freq()
+        with self._trace(f"{task.name}: cfg_samp_clk_timing"):
+            task.timing.cfg_samp_clk_timing(rate=rate, source=self.ctr1_internal, 
+                                            active_edge=nidaqmx.constants.Edge.RISING,
+                                            sample_mode=nidaqmx.constants.AcquisitionType.CONTINUOUS, 
+                                            samps_per_chan=np.shape(data_task)[-1])
+        # start and wait for the first camera trigger
+        with self._trace(f"{task.name}: write"):
+            task.write(data_task, auto_start=False)
+        if start:
+            with self._trace(f"{task.name}: start"):
+                task.start()
         
-        plt.figure(figsize=(10, 5))  # Set the figure size to create a big rectangle
         
-        # Plot the pulse train
-        plt.plot(t, stack_pulse)
-        #plt.plot(t, exp_pulse)
-        plt.xlabel('Time (s)')
-        plt.ylabel('Voltage (V)')
-        plt.ylim(-1, 6)
-        if self.multi_d:
-            plt.title("3D acquisition")
-        else:
-            plt.title("2D acquisition")
-        plt.show()
+    def _led_off(self):
+        """Set the LED line low with an on-demand write"""
+        with nidaqmx.Task("LED_off") as task_do:
+            task_do.do_channels.add_do_chan(self.do0)
+            task_do.write(False)
+            
+            
+    def _ao1_off(self):
+        """Set the ao1 excitation input to 0 V with an on-demand write"""
+        # AOTF: 0 V is the MIN_RF wavelength, RF power is not controlled here
+        with nidaqmx.Task("AO1_off") as task_ao:
+            task_ao.ao_channels.add_ao_voltage_chan(self.ao1, min_val=self.MINV_LED, max_val=self.MAXV_LED)
+            task_ao.write(0.0)
+            
+            
+    def _verify_frame_count(self, tasks):
+        """Get samples generated by each clocked task. All must equal the hardware frame count"""
+        counts = {task.name: task.out_stream.total_samp_per_chan_generated for task in tasks}
+        errors = [f"{name}: {n} samples for {self.total_frames} frames" for name, n in counts.items() if n != self.total_frames]
+        return counts, errors
+        
+        
+# ------------------------- PULSE TIMING TABLES  -------------------------- #
+
+    def compile_pulse_table(self):
+        """Get high and low time (s) of every camera trigger from the schedule table"""
+        schedule = self.schedule
+        if schedule is None:
+            schedule = [(self.num_stacks, [self.exposure_time], self.stack_delay_time)]
+        delay = self.frame_delay_time if self.multi_d else 0
+        n = self.frames_per_stack
+        high_times, low_times = [], []
+        for n_stacks, exposures, stack_delay in schedule:
+            exposures = np.broadcast_to(np.asarray(exposures, dtype=float), (n,))
+            if np.any(exposures < self.MIN_EXP) or np.any(exposures > self.MAX_EXP):
+                raise ValueError("Exposure time in schedule is not between 100e-6 and 10.0 sec")
+            # same timing as the uniform pulse train: readout limited period and 0.9 - delay * freq duty cycle
+            period = np.maximum(exposures, self._get_frame_time()) + delay
+            high = 0.9 * period - delay
+            low = period - high
+            high = np.tile(high, n_stacks)
+            low = np.tile(low, n_stacks)
+            # pause after every stack
+            low[n - 1::n] += stack_delay
+            high_times.append(high)
+            low_times.append(low)
+        high_times = np.concatenate(high_times)
+        low_times = np.concatenate(low_times)
+        if np.any(high_times <= 0):
+            raise ValueError("Frame delay time is too long for the exposure time: negative trigger pulse width")
+        return high_times, low_times
+    
+    
+    def _cam_exposure_table(self, high_times, low_times):
+        """generate buffered TTL pulse train with per-frame high and low times: shared sample clock of a schedule"""
+        with self._trace("cam_trigger: create task"):
+            task_ctr = nidaqmx.Task("cam_trigger")
+        with self._trace("cam_trigger: add_co_pulse_chan_time"):
+            task_ctr.co_channels.add_co_pulse_chan_time(self.ctr1, idle_state=nidaqmx.constants.Level.LOW, 
+                                                        low_time=low_times[0], high_time=high_times[0])
+        # one pulse per buffer sample, then stop
+        with self._trace("cam_trigger: cfg_implicit_timing"):
+            task_ctr.timing.cfg_implicit_timing(sample_mode=nidaqmx.constants.AcquisitionType.FINITE, samps_per_chan=len(high_times))
+        with self._trace("cam_trigger: write"):
+            writer = nidaqmx.stream_writers.CounterWriter(task_ctr.out_stream)
+            writer.write_many_sample_pulse_time(high_times, low_times)
+        self._cfg_external_start(task_ctr)
+        
+        return task_ctr
+        
+        
+# --------------------------- EXTERNAL TTL INPUT --------------------------- #
+
+    def _cfg_external_start(self, task):
+        """Set the master counter to start on a rising edge at PFI1 instead of on task start"""
+        if self.external_start:
+            with self._trace(f"{task.name}: cfg_dig_edge_start_trig PFI1"):
+                # terminal names need the leading slash
+                task.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source="/" + self.PFI1, trigger_edge=nidaqmx.constants.Edge.RISING)
+    
+    
+    def get_start_wait(self):
+        """Get max time (s) to wait for the acquisition to start"""
+        return self.start_timeout if self.external_start else 0.0
+    
+    
+    def _sync_input_tasks(self):
+        """Get counter input tasks latching the timebase count and the frame count at every PFI1 edge"""
+        tasks = []
+        for name, counter, term in (("sync_time", self.ctr2, self.TIMEBASE), ("sync_frame", self.ctr3, self.ctr1_internal)):
+            with self._trace(f"{name}: create task"):
+                task = nidaqmx.Task(name)
+                channel = task.ci_channels.add_ci_count_edges_chan(counter, edge=nidaqmx.constants.Edge.RISING)
+                channel.ci_count_edges_term = term
+            # one sample per PFI1 edge
+            with self._trace(f"{name}: cfg_samp_clk_timing"):
+                task.timing.cfg_samp_clk_timing(rate=self.MAX_SYNC_RATE, source="/" + self.PFI1, active_edge=nidaqmx.constants.Edge.RISING,
+                                                sample_mode=nidaqmx.constants.AcquisitionType.CONTINUOUS)
+            # count from the first camera trigger: time zero of the frame stream
+            task.triggers.arm_start_trigger.trig_type = nidaqmx.constants.TriggerType.DIGITAL_EDGE
+            task.triggers.arm_start_trigger.dig_edge_src = self.ctr1_internal
+            task.triggers.arm_start_trigger.dig_edge_edge = nidaqmx.constants.Edge.RISING
+            tasks.append(task)
+        return tasks
+    
+    
+    def _read_sync_input(self, tasks):
+        """Get every PFI1 edge of the acquisition aligned to the frame stream. Sets self.sync_edges"""
+        with self._trace("sync: read"):
+            ticks, frames = (np.asarray(task.read(number_of_samples_per_channel=nidaqmx.constants.READ_ALL_AVAILABLE), dtype=np.int64)
+                             for task in tasks)
+        self.sync_edges = self.align_sync_edges(ticks, frames)
+        return self.sync_edges
+    
+    
+    def align_sync_edges(self, ticks, frames):
+        """Get time (s) from the first camera trigger, frame index and time into that frame of every PFI1 edge"""
+        ticks = np.asarray(ticks, dtype=np.int64)
+        n = min(len(ticks), len(frames))
+        ticks, frames = ticks[:n], np.asarray(frames[:n], dtype=np.int64)
+        # 32 bit counter rolls over every 42.9 s at 100 MHz: edges must be closer than that
+        ticks = ticks + (1 << 32) * np.cumsum(np.diff(ticks, prepend=ticks[:1]) < 0)
+        t = ticks / self.TIMEBASE_RATE
+        # frame count at the edge is the frame index. ctr3 counts ctr1InternalOutput but is arm-started by its first
+        # rising edge, and DAQmx counts only the edges after the arm start trigger: frame 0 reads 0, frame k reads k.
+        # Edges before the first camera trigger are not sampled (counter not armed)
+        index = frames
+        high, low = self.compile_pulse_table()
+        frame_starts = np.concatenate([[0.0], np.cumsum(high + low)[:-1]])
+        offset = t - frame_starts[np.clip(index, 0, len(frame_starts) - 1)]
+        return {"time": t.tolist(), "frame": index.tolist(), "frame_offset": offset.tolist()}
+        
+        
+# ------------------------------ GRAPHING -------------------------------- #
+
+    def plot_preview(self, n_cycles=1):
+        """Plot all output lines of the first n_cycles stacks (pan and zoom to see the whole experiment)"""
+        return FastMC_timeline.timeline(self).show(0.0, n_cycles * self.get_stack_time())
         
         
     def print_parameters(self):
@@ -370,69 +850,213 @@ class nidaq:
             message = message + f"\nVoumes per second: \n{round(1/self.get_stack_time(),3)}\nFrames per z-stack: \n{self.frames_per_stack}"
         else:
             message = message + f"\nFrames per second: \n{round(self._get_trigger_exp_freq(),3)}"
+        if self.continuous:
+            message = message + "\nContinuous streaming (no retriggering between stacks)"
         message = message + "\n\nStart acquisition?"
         result = messagebox.askokcancel(title="Timing parameters", message=message)
         return result
         
 
+    def get_metadata(self):
+        """Get acquisition parameters and derived timing to store with the images"""
+        return {
+            "num_stacks": self.num_stacks,
+            "multi_d": self.multi_d,
+            "exposure_time": self.exposure_time,
+            "readout_mode": self.readout_mode,
+            "image_height": self.image_height,
+            "image_width": self.image_width,
+            "frame_delay_time": self.frame_delay_time,
+            "stack_delay_time": self.stack_delay_time,
+            "frames_per_stack": self.frames_per_stack,
+            "z_positions": self.z_planes.tolist(),
+            "galvo_calibration": self.calibration.version if self.calibration is not None else None,
+            "trigger_frequency": self._get_trigger_exp_freq(),
+            "stack_time": self.get_stack_time(),
+            "total_acq_time": self.get_total_acq_time(),
+            "led_trigger": self.led_trigger,
+            "ao_oversampling": self.ao_oversampling,
+            "power_ramp": self.power_ramp if self.power_ramp is None or isinstance(self.power_ramp, str) else "measured",
+            "power_volts": self._get_ao_power_data().tolist() if self.power_ramp is not None else None,
+            "wavelengths": list(self.wavelengths) if self.wavelengths is not None else None,
+            "wavelength_switch": self.wavelength_switch,
+            "continuous": self.continuous,
+            "external_start": self.external_start,
+            "sync_edges": self.sync_edges,
+        }
+    
+    
+    def save_metadata(self, path):
+        """Save acquisition metadata as JSON"""
+        with open(path, "w") as f:
+            json.dump(self.get_metadata(), f, indent=4)
+        
+
 # -------------------------------- MAIN ---------------------------------- #
 
-    def acquire(self):
+    def acquire(self, confirm=True):
         
-        if self.led_trigger == "software_time" and self.led_time_on > self.get_total_acq_time():
-            raise ValueError("LED time on is greater than total acquisition time")
+        # every protocol rule, before any task is created
+        FastMC_constraints.validate(self)
+        # edges of a previous acquisition must not end up in this one's metadata
+        self.sync_edges = None
         
-        ready = self.print_parameters()
+        if self.compiled is not None and self.compiled.key != FastMC_compile.current_key(self):
+            # parameters changed since compiling
+            self.compiled = None
         
-        if ready: 
+        with self._trace("parameters dialog"):
+            # confirm=False when the parameters were already confirmed (e.g. acquisition in a child process)
+            ready = self.print_parameters() if confirm else True
+        
+        if ready and (self.continuous or self.schedule is not None):
+            self._acquire_continuous()
+        elif ready: 
+            # every created task, released even if the acquisition fails (e.g. no external start edge before the timeout)
+            tasks = []
+            try:
+                self._acquire_retriggered(tasks)
+            finally:
+                self._release(tasks)
+                if self.ao1_output is not None:
+                    self._ao1_off()
 
-            # master trigger
-            stack_ctr = self._stack_trigger()
 
-            # galvo control
-            if self.multi_d:
-                task_galvo = self._create_ao_task()
-                data_galvo = self._get_ao_galvo_data()
-                self.setup_triggered_task(task_galvo, data_galvo)
+    def _acquire_retriggered(self, tasks):
+        """Run every stack off the stack trigger, appending the tasks it creates to tasks"""
+        # master trigger
+        stack_ctr = self._stack_trigger()
+        tasks.append(stack_ctr)
 
-            # LED control
-            if self.led_trigger == "software_fraction":
-                # same timing setup as galvo
-                task_led = self._create_led_do_task()
-                data_led = self._get_do_led_data_trigger()
-                # sample at rate without delay
-                self.setup_triggered_task(task_led, data_led)
-            elif self.led_trigger == "software_time":
-                task_led = self._create_led_do_task()
-                data_led = self._get_do_led_data_no_trigger()
-                # sample at rate with (if any) stack delay
-                self.setup_not_triggered_task(task_led, data_led)
-
-            # camera pulse train
-            exp_ctr = self._cam_exposure_trigger()
-            # start and wait for stack trigger
+        # galvo and ao1 excitation control
+        if self.use_ao:
+            # compile first: a range error must not leave a task open
+            with self._trace("AO: compile data"):
+                data_ao = self._data("ao", self._get_ao_data)
+            task_ao = self._create_ao_task()
+            tasks.append(task_ao)
+            self.setup_triggered_task(task_ao, data_ao, self.ao_oversampling)
+
+        # LED control
+        if self.led_trigger == "software_fraction":
+            # same timing setup as galvo
+            task_led = self._create_led_do_task()
+            tasks.append(task_led)
+            with self._trace("LED: compile data"):
+                data_led = self._data("led", self._get_do_led_data_trigger)
+            # sample at rate without delay
+            self.setup_triggered_task(task_led, data_led)
+        elif self.led_trigger == "software_time":
+            task_led = self._create_led_do_task()
+            tasks.append(task_led)
+            with self._trace("LED: compile data"):
+                data_led = self._data("led", self._get_do_led_data_no_trigger)
+            # sample at rate with (if any) stack delay
+            self.setup_not_triggered_task(task_led, data_led)
+
+        # camera pulse train
+        exp_ctr = self._cam_exposure_trigger()
+        tasks.append(exp_ctr)
+        # start and wait for stack trigger
+        with self._trace("cam_trigger: start"):
             exp_ctr.start()
 
-            # start stack or frame acquisition.
+        # PFI1 edge timestamps: armed by the first camera trigger
+        sync_tasks = self._sync_input_tasks() if self.sync_input else []
+        tasks.extend(sync_tasks)
+        for task in sync_tasks:
+            task.start()
+
+        # start stack or frame acquisition. With external start only armed until the PFI1 edge
+        if self.external_start:
+            print("Armed: waiting for a rising edge on PFI1")
+        with self._trace("stack_trigger: start"):
             stack_ctr.start()
+        with self._trace("stack_trigger: wait_until_done"):
             if self.num_stacks == 1:
-                stack_ctr.wait_until_done(self.get_stack_time())
+                stack_ctr.wait_until_done(self.get_stack_time() + self.get_start_wait())
             else:
-                stack_ctr.wait_until_done(self.get_total_acq_time())
-            stack_ctr.stop()
+                stack_ctr.wait_until_done(self.get_total_acq_time() + self.get_start_wait())
+        if sync_tasks:
+            self._read_sync_input(sync_tasks)
 
-            # stop tasks
-            exp_ctr.stop()
-            if self.multi_d:
-                task_galvo.stop()
-            if self.led_trigger == "software_time" or self.led_trigger == "software_fraction":
-                task_led.stop()
 
-            # close tasks
-            stack_ctr.close()
-            exp_ctr.close()
-            if self.multi_d:
-                task_galvo.close()
-            if self.led_trigger == "software_time" or self.led_trigger == "software_fraction":
-                task_led.close()
+    def _release(self, tasks):
+        """Stop, then close every task, even when one fails: a task left open keeps its counter and lines reserved"""
+        try:
+            with self._trace("stop tasks"):
+                for task in tasks:
+                    task.stop()
+        finally:
+            with self._trace("close tasks"), contextlib.ExitStack() as close:
+                for task in tasks:
+                    close.callback(task.close)
 
+
+    def _acquire_continuous(self):
+        """Stream all stacks off the camera counter: no stack trigger, no dead time between stacks"""
+        tasks = []
+        try:
+            counts, errors = self._acquire_clocked(tasks)
+        finally:
+            self._release(tasks)
+            if self.led_trigger == "software_fraction":
+                self._led_off()
+            if self.ao1_output is not None:
+                self._ao1_off()
+            
+        if errors:
+            raise RuntimeError("Clocked outputs out of sync with camera triggers: " + "; ".join(errors))
+        return counts
+
+
+    def _acquire_clocked(self, tasks):
+        """Run the camera counter clocked acquisition, appending the tasks it creates to tasks. Returns the sample counts"""
+        clocked = []
+        if self.schedule is not None:
+            with self._trace("cam_trigger: compile pulse table"):
+                high_times, low_times = self._data("pulse_table", self.compile_pulse_table)
+            rate = 1 / np.min(high_times + low_times)
+        else:
+            rate = self._get_trigger_exp_freq()
+        
+        # galvo and ao1 excitation control
+        if self.use_ao:
+            with self._trace("AO: compile data"):
+                data_ao = self._data("ao", lambda: self._get_ao_data(clocked=True))
+            task_ao = self._create_ao_task()
+            tasks.append(task_ao)
+            self.setup_clocked_task(task_ao, data_ao, rate)
+            clocked.append(task_ao)
+            
+        # LED control
+        if self.led_trigger == "software_fraction":
+            task_led = self._create_led_do_task()
+            tasks.append(task_led)
+            with self._trace("LED: compile data"):
+                data_led = self._data("led", self._get_do_led_data_clocked)
+            self.setup_clocked_task(task_led, data_led, rate)
+            clocked.append(task_led)
+            
+        # camera pulse train: the clock of all other tasks. Starting it starts the acquisition (or arms it: external start)
+        if self.schedule is not None:
+            exp_ctr = self._cam_exposure_table(high_times, low_times)
+        else:
+            exp_ctr = self._cam_exposure_clock()
+        tasks.append(exp_ctr)
+        sync_tasks = self._sync_input_tasks() if self.sync_input else []
+        tasks.extend(sync_tasks)
+        for task in sync_tasks:
+            task.start()
+        if self.external_start:
+            print("Armed: waiting for a rising edge on PFI1")
+        with self._trace("cam_trigger: start"):
+            exp_ctr.start()
+        with self._trace("cam_trigger: wait_until_done"):
+            exp_ctr.wait_until_done(self.get_total_acq_time() + 1.0 + self.get_start_wait())
+        if sync_tasks:
+            self._read_sync_input(sync_tasks)
+        
+        # cycle-exact check (meaningful on hardware and NI simulated devices)
+        counts, errors = self._verify_frame_count(clocked)
+        return counts, errors
@@ -0,0 +1,114 @@
+import numpy as np
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Deskew of raw oblique-plane stacks. The galvo sweeps frames_per_stack tilted
+# planes; in the raw stack (slice, y, x) the camera rows y run along the tilted
+# sheet, so consecutive slices are displaced along y by
+#     z_step * cos(sheet_angle) / pixel_size   (pixels)
+# Deskewing shears every slice back by its displacement (linear interpolation
+# for the fractional part). The output stays on the sheared grid: one slice per
+# raw slice at its z_positions spacing, not resliced to isotropic voxels, and
+# rows keep the camera pixel size. Columns x are independent, so volumes are processed
+# in x tiles by a thread pool (in memory) or a process pool (out of core, .npy
+# memory maps).
+#
+# Use:
+#   geometry = FastMC_deskew.geometry_from_scope(scope, pixel_size=0.115, sheet_angle=30)
+#   deskewed = FastMC_deskew.deskew_volume(raw_stack, geometry)
+#   FastMC_deskew.deskew_file("cam1.npy", "cam1_deskewed.npy", geometry)
+
+
+class deskew_geometry:
+
+    def __init__(self, z_positions, pixel_size, sheet_angle):
+        """z_positions: microm, one per slice. pixel_size: microm at the sample. sheet_angle: degrees"""
+        self.z_positions = np.asarray(z_positions, dtype=float)
+        self.pixel_size = pixel_size
+        self.sheet_angle = sheet_angle
+        theta = math.radians(sheet_angle)
+        # shear of every slice in camera rows, relative to the lowest slice
+        self.shifts = (self.z_positions - self.z_positions.min()) * math.cos(theta) / pixel_size
+
+    @property
+    def n_slices(self):
+        return len(self.z_positions)
+
+    def output_height(self, image_height):
+        """Get number of rows of a deskewed slice"""
+        return image_height + math.ceil(self.shifts.max()) + 1
+
+
+def geometry_from_scope(scope, pixel_size, sheet_angle):
+    """Get the deskew geometry of the stacks of a FastMC_core.nidaq acquisition"""
+    return deskew_geometry(scope.z_planes, pixel_size, sheet_angle)
+
+
+def _deskew_tile(raw, out, shifts, x0, x1):
+    """Deskew columns x0:x1 of one raw stack into out (accumulated in float32)"""
+    n, ny, _ = raw.shape
+    acc = np.zeros((n, out.shape[1], x1 - x0), dtype=np.float32)
+    for k in range(n):
+        s = int(shifts[k])
+        f = np.float32(shifts[k] - s)
+        src = raw[k, :, x0:x1].astype(np.float32)
+        acc[k, s:s + ny] += (1 - f) * src
+        if f:
+            acc[k, s + 1:s + 1 + ny] += f * src
+    if np.issubdtype(out.dtype, np.integer):
+        np.rint(acc, out=acc)
+    out[:, :, x0:x1] = acc
+
+
+def _tiles(width, tile):
+    return [(x0, min(x0 + tile, width)) for x0 in range(0, width, tile)]
+
+
+def deskew_volume(raw, geometry, out=None, tile=128, workers=None):
+    """Get the deskewed stack of one raw stack (slice, y, x), tiles processed by a thread pool"""
+    n, ny, nx = raw.shape
+    if n != geometry.n_slices:
+        raise ValueError(f"Stack has {n} slices, geometry has {geometry.n_slices}")
+    if out is None:
+        out = np.empty((n, geometry.output_height(ny), nx), dtype=raw.dtype)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda t: _deskew_tile(raw, out, geometry.shifts, *t), _tiles(nx, tile)))
+    return out
+
+
+def deskew_stream(volumes, geometry, tile=128, workers=None):
+    """Deskew each raw stack as it arrives (any iterable of stacks, e.g. filled from a frame ring)"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for raw in volumes:
+            n, ny, nx = raw.shape
+            out = np.empty((n, geometry.output_height(ny), nx), dtype=raw.dtype)
+            list(pool.map(lambda t: _deskew_tile(raw, out, geometry.shifts, *t), _tiles(nx, tile)))
+            yield out
+
+
+def _deskew_file_tile(in_path, out_path, shifts, v, x0, x1):
+    """Process pool job: deskew one tile of one stack between memory-mapped files"""
+    n = len(shifts)
+    raw = np.load(in_path, mmap_mode="r")[v * n:(v + 1) * n]
+    out = np.load(out_path, mmap_mode="r+")[v]
+    _deskew_tile(raw, out, shifts, x0, x1)
+    out.flush()
+
+
+def deskew_file(in_path, out_path, geometry, tile=256, workers=None):
+    """Deskew every stack of a raw .npy file (frames, y, x) out of core into a .npy file (stack, slice, y, x)"""
+    raw = np.load(in_path, mmap_mode="r")
+    n_frames, ny, nx = raw.shape
+    n = geometry.n_slices
+    if n_frames % n != 0:
+        raise ValueError(f"{n_frames} frames is not a whole number of {n}-slice stacks")
+    n_stacks = n_frames // n
+    out = np.lib.format.open_memmap(out_path, mode="w+", dtype=raw.dtype, shape=(n_stacks, n, geometry.output_height(ny), nx))
+    del out, raw
+    jobs = [(v, x0, x1) for v in range(n_stacks) for x0, x1 in _tiles(nx, tile)]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(_deskew_file_tile, in_path, out_path, geometry.shifts, *job) for job in jobs]
+        for f in futures:
+            f.result()
+    return n_stacks
@@ -0,0 +1,183 @@
+import queue
+import numpy as np
+
+# Event-triggered burst acquisition. A slow background protocol runs until a
+# cheap per-frame activity metric, computed in the ingestion path, crosses a
+# threshold; the DAQ is then re-armed (FastMC_session) with a fast burst
+# protocol until the activity has been below a release level for hold_frames,
+# and re-armed back. Idle frames are not written: they only go through a
+# pre-trigger ring, and on an event the last pre_trigger frames before it are
+# written with their original frame ids.
+#
+# Activity: mean absolute difference of a strided subsample of the frame from
+# a running background (exponential average of idle frames), relative to the
+# background mean. Thresholds use hysteresis so noise around the threshold
+# does not toggle the protocol.
+#
+# Use (camera process hook and DAQ loop, events through a multiprocessing queue):
+#   hook = FastMC_events.event_hook(h, w, threshold=0.05, pre_trigger=20, on_event=events.put)
+#   ... FastMC_stream.run_topology(..., hooks=[hook], append=True) ...     # kept frames only, with their ids
+#   s = FastMC_session.session(scope)
+#   FastMC_events.run_event_driven(s, background, burst, lambda: FastMC_events.drain(events), n_runs=100)
+
+
+class activity_detector:
+
+    def __init__(self, threshold=0.05, release=None, hold_frames=10, subsample=8, alpha=0.05, warmup=5):
+        self.threshold = threshold
+        self.release = threshold / 2 if release is None else release
+        if self.release > self.threshold:
+            raise ValueError("Release level must not be above the trigger threshold")
+        self.hold_frames = hold_frames
+        self.subsample = subsample
+        self.alpha = alpha
+        self.warmup = warmup
+        self.background = None
+        self.active = False
+        self.frames = 0
+        self._quiet = 0
+
+
+    def metric(self, frame):
+        """Get relative activity of a frame against the background, and its float subsample"""
+        sample = frame[::self.subsample, ::self.subsample].astype(np.float32)
+        if self.background is None:
+            self.background = sample
+            return 0.0, sample
+        diff = np.abs(sample - self.background).mean()
+        return float(diff / (self.background.mean() + 1.0)), sample
+
+
+    def update(self, frame):
+        """Get "start", "end" or None after adding a frame, and its activity metric"""
+        m, sample = self.metric(frame)
+        self.frames += 1
+        change = None
+        if not self.active:
+            if m > self.threshold and self.frames > self.warmup:
+                self.active, self._quiet, change = True, 0, "start"
+            else:
+                # background follows slow drifts (bleaching, focus) of idle frames only
+                self.background += self.alpha * (sample - self.background)
+        else:
+            self._quiet = self._quiet + 1 if m < self.release else 0
+            if self._quiet >= self.hold_frames:
+                self.active, change = False, "end"
+        return change, m
+
+
+class pretrigger_ring:
+
+    def __init__(self, n_frames, image_height, image_width, dtype="uint16"):
+        self.frames = np.empty((n_frames, image_height, image_width), dtype=dtype)
+        self.ids = np.empty(n_frames, dtype=np.int64)
+        self.n_frames = n_frames
+        self.count = 0
+
+
+    def push(self, frame, frame_id):
+        """Copy a frame in, overwriting the oldest when full"""
+        i = self.count % self.n_frames
+        self.frames[i] = frame
+        self.ids[i] = frame_id
+        self.count += 1
+
+
+    def drain(self):
+        """Get (frame, frame id) of the held frames, oldest first, and empty the ring"""
+        n = min(self.count, self.n_frames)
+        order = (self.count - n + np.arange(n)) % self.n_frames
+        self.count = 0
+        return [(self.frames[i], int(self.ids[i])) for i in order]
+
+
+class event_hook:
+
+    def __init__(self, image_height, image_width, threshold=0.05, release=None, hold_frames=10, pre_trigger=20,
+                 subsample=8, dtype="uint16", on_event=None):
+        self.detector = activity_detector(threshold, release, hold_frames, subsample)
+        self.ring = pretrigger_ring(pre_trigger, image_height, image_width, dtype) if pre_trigger else None
+        self.on_event = on_event
+        self.events = []
+        self.kept = 0
+
+
+    @property
+    def active(self):
+        return self.detector.active
+
+
+    def __call__(self, frame, frame_id):
+        """Hook signature of FastMC_stream: get the (frame, frame id) pairs to write for this frame"""
+        change, m = self.detector.update(frame)
+        if change is not None:
+            event = {"type": change, "frame_id": frame_id, "metric": m}
+            self.events.append(event)
+            if self.on_event is not None:
+                self.on_event(event)
+        if change == "start":
+            keep = (self.ring.drain() if self.ring is not None else []) + [(frame, frame_id)]
+        elif self.detector.active or change == "end":
+            keep = [(frame, frame_id)]
+        else:
+            if self.ring is not None:
+                self.ring.push(frame, frame_id)
+            keep = []
+        self.kept += len(keep)
+        return keep
+
+
+def drain(events):
+    """Get every event waiting in a queue without blocking"""
+    out = []
+    while True:
+        try:
+            out.append(events.get_nowait())
+        except queue.Empty:
+            return out
+
+
+def run_event_driven(session, background, burst, poll_events, n_runs, min_burst_runs=1):
+    """Run the background protocol and switch to the burst protocol while events are active. Returns the protocol of every run"""
+    # every parameter the burst changes must return to its background value
+    background = dict(background, **{name: getattr(session.scope, name) for name in burst if name not in background})
+    session.arm(**background)
+    active, mode, burst_runs, log = False, "background", 0, []
+    for _ in range(n_runs):
+        session.run()
+        log.append(mode)
+        for event in poll_events():
+            active = event["type"] == "start"
+        if mode == "background" and active:
+            session.arm(**burst)
+            mode, burst_runs = "burst", 0
+        elif mode == "burst":
+            burst_runs += 1
+            if not active and burst_runs >= min_burst_runs:
+                session.arm(**background)
+                mode = "background"
+    return log
+
+
+class synthetic_event_camera:
+    """Frame source of noisy background with bright blobs during events, for tests of event-triggered acquisition"""
+
+    def __init__(self, image_height, image_width, events, amplitude=3.0, radius=40, seed=0):
+        # events: (first frame, number of frames) of each event
+        self.image_height = image_height
+        self.image_width = image_width
+        self.events = events
+        self.amplitude = amplitude
+        self.radius = radius
+        self.seed = seed
+
+
+    def __call__(self, n_frames, start=0):
+        rng = np.random.default_rng(self.seed)
+        noise = rng.normal(1000, 30, size=(4, self.image_height, self.image_width)).astype(np.uint16)
+        y, x = np.ogrid[:self.image_height, :self.image_width]
+        blob = ((y - self.image_height / 2) ** 2 + (x - self.image_width / 2) ** 2 < self.radius ** 2)
+        lit = (noise[0] * (1 + self.amplitude * blob)).astype(np.uint16)
+        for i in range(start, start + n_frames):
+            in_event = any(first <= i < first + n for first, n in self.events)
+            yield lit if in_event else noise[i % 4]
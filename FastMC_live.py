@@ -0,0 +1,160 @@
+import nidaqmx
+import numpy as np
+import threading
+
+# Live preview for alignment: continuous stacks with parameters that can be
+# changed from another thread (e.g. a GUI) while the DAQ keeps running.
+#
+# The camera counter runs free and clocks the galvo and LED tasks (one sample
+# per frame, as in nidaq continuous mode). Regeneration is disabled and the
+# output buffers hold two stacks: one being generated and one queued. A writer
+# thread queues the next stack as soon as one finishes, so a parameter change
+# is output from the next stack written, with no task stop/start and no
+# missed frames. Latency is at most two stacks.
+
+class live:
+
+    def __init__(self, scope):
+        """scope: FastMC_core.nidaq with the initial parameters. Frames per stack are fixed while live"""
+        if scope.led_trigger == "software_time":
+            raise ValueError("Live mode does not support software_time LED trigger")
+        if scope.ao1_output is not None:
+            raise ValueError("Live mode does not support ao1 outputs (LED modulation, power ramp, AOTF wavelength)")
+        if scope.external_start or scope.sync_input:
+            raise ValueError("Live mode is started in software: external start and sync input are not supported")
+        self.scope = scope
+        self.n = scope.frames_per_stack
+        # planes of the acquisition (z_positions, z_ranges...). Live z_start / z_end stretch them to a new range
+        self.planes = scope.z_planes
+        self.z_start = float(self.planes.min())
+        self.z_end = float(self.planes.max())
+        self.led_fraction_on = scope.led_fraction_on
+        self.galvo_offset = 0.0          # V. added to the galvo voltage
+
+        self.use_galvo = scope.multi_d
+        self.use_led = scope.led_trigger == "software_fraction"
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._next = self._compile()
+        self.stacks_written = 0
+        self.error = None
+
+
+    def _compile(self):
+        """Get galvo and LED data of one stack from the current live parameters"""
+        galvo = None
+        led = None
+        if self.use_galvo:
+            z = self._z_planes()
+            galvo = self.scope._z_to_volt(z) + self.galvo_offset
+            if np.any(galvo > self.scope.MAXV_GALVO) or np.any(galvo < self.scope.MINV_GALVO):
+                raise ValueError("Galvo voltage out of range [-1.7, 1.7] V")
+        if self.use_led:
+            n_on = round(self.n * self.led_fraction_on)
+            led = [True] * n_on + [False] * (self.n - n_on)
+        return galvo, led
+
+
+    def _z_planes(self):
+        """Get the acquisition planes mapped linearly onto the live z range"""
+        lo, hi = self.planes.min(), self.planes.max()
+        if hi == lo:
+            return self.planes - lo + self.z_start
+        return self.z_start + (self.planes - lo) * (self.z_end - self.z_start) / (hi - lo)
+
+
+    def update(self, z_start=None, z_end=None, led_stack_fraction_on=None, galvo_offset=None):
+        """Change live parameters from any thread. Applied from the next stack written to the DAQ"""
+        with self._lock:
+            old = (self.z_start, self.z_end, self.led_fraction_on, self.galvo_offset)
+            if z_start is not None:
+                self.z_start = z_start
+            if z_end is not None:
+                self.z_end = z_end
+            if led_stack_fraction_on is not None:
+                self.led_fraction_on = led_stack_fraction_on
+            if galvo_offset is not None:
+                self.galvo_offset = galvo_offset
+            try:
+                if (self.z_end < self.z_start or self.z_end > 200 or self.z_start < -200):
+                    raise ValueError("z range must be within [-200, 200] with z_start <= z_end")
+                if not 0 <= self.led_fraction_on <= 1:
+                    raise ValueError("LED fraction on must be between 0 and 1")
+                # double buffer: the writer thread only ever sees complete stacks
+                self._next = self._compile()
+            except ValueError:
+                self.z_start, self.z_end, self.led_fraction_on, self.galvo_offset = old
+                raise
+
+
+    def _setup_streamed_task(self, task, data_task):
+        """Setup task clocked by the camera counter, fed one stack at a time without regeneration"""
+        task.timing.cfg_samp_clk_timing(rate=self.scope._get_trigger_exp_freq(), source=self.scope.ctr1_internal,
+                                        active_edge=nidaqmx.constants.Edge.RISING,
+                                        sample_mode=nidaqmx.constants.AcquisitionType.CONTINUOUS,
+                                        samps_per_chan=2 * self.n)
+        task.out_stream.regen_mode = nidaqmx.constants.RegenerationMode.DONT_ALLOW_REGENERATION
+        task.out_stream.output_buf_size = 2 * self.n
+        # prefill both halves of the buffer
+        task.write(data_task + data_task if isinstance(data_task, list) else np.tile(data_task, 2), auto_start=False)
+        task.start()
+
+
+    def start(self):
+        """Start live stacks. Returns immediately"""
+        galvo, led = self._next
+        self.task_galvo = None
+        self.task_led = None
+        if self.use_galvo:
+            self.task_galvo = self.scope._create_ao_task()
+            self._setup_streamed_task(self.task_galvo, galvo)
+        if self.use_led:
+            self.task_led = self.scope._create_led_do_task()
+            self._setup_streamed_task(self.task_led, led)
+        self.exp_ctr = self.scope._cam_exposure_clock(free_running=True)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._writer, name="FastMC_live_writer", daemon=True)
+        self._thread.start()
+        self.exp_ctr.start()
+
+
+    def _writer(self):
+        """Queue one stack each time the DAQ finishes generating one"""
+        timeout = 2 * self.scope.get_stack_time() + 1.0
+        try:
+            while not self._stop.is_set():
+                with self._lock:
+                    galvo, led = self._next
+                # blocks until a stack worth of buffer space is free
+                if self.task_galvo is not None:
+                    self.task_galvo.write(galvo, timeout=timeout)
+                if self.task_led is not None:
+                    self.task_led.write(led, timeout=timeout)
+                self.stacks_written += 1
+        except Exception as e:
+            # buffer underflow or DAQ error: keep it for the caller, stop() still closes the tasks
+            if not self._stop.is_set():
+                self.error = e
+
+
+    def stop(self):
+        """Stop live stacks and close all tasks"""
+        self._stop.set()
+        self.exp_ctr.stop()
+        if self.task_galvo is not None:
+            self.task_galvo.stop()
+        if self.task_led is not None:
+            self.task_led.stop()
+        self._thread.join()
+
+        self.exp_ctr.close()
+        if self.task_galvo is not None:
+            self.task_galvo.close()
+        if self.task_led is not None:
+            self.task_led.close()
+            self.scope._led_off()
+        if self.error is not None:
+            raise RuntimeError("Live mode stopped on DAQ error") from self.error
@@ -0,0 +1,93 @@
+import numpy as np
+import time
+
+# Orthogonal maximum-intensity projections of each stack, updated in place
+# frame by frame during acquisition (no stack is held in memory):
+#   xy: max over slices           (image_height, image_width)
+#   xz: max over rows, per slice  (frames_per_stack, image_width)
+#   yz: max over columns, per slice (frames_per_stack, image_height)
+# Projections are in raw (slice, row, column) coordinates. When a stack is
+# complete, block-max decimated copies are published to a callback, at most
+# display_rate times per second.
+#
+# As a hook of FastMC_stream the projector runs in the camera child process,
+# not in the process of the display: the callback must hand the projections
+# over to it, e.g. put of a multiprocessing queue read by the GUI. A plotting
+# function as callback would draw in the camera process, or not at all.
+#
+# Use:
+#   preview_queue = multiprocessing.Queue()
+#   projector = FastMC_projection.mip_projector(scope.frames_per_stack, h, w, callback=preview_queue.put)
+#   ... FastMC_stream.run_topology(..., hooks=[projector]) in the camera processes ...
+#   show(preview_queue.get())     # in the GUI process: {"stack", "xy", "xz", "yz"}
+
+
+class mip_projector:
+
+    def __init__(self, frames_per_stack, image_height, image_width, dtype="uint16", decimation=4,
+                 display_rate=20.0, callback=None):
+        self.frames_per_stack = frames_per_stack
+        self.decimation = decimation
+        self.display_interval = 1 / display_rate if display_rate else 0.0
+        self.callback = callback
+        dtype = np.dtype(dtype)
+        self.xy = np.zeros((image_height, image_width), dtype=dtype)
+        self.xz = np.zeros((frames_per_stack, image_width), dtype=dtype)
+        self.yz = np.zeros((frames_per_stack, image_height), dtype=dtype)
+        self.slice_index = 0
+        self.stacks = 0
+        self.published = 0
+        self._last_publish = -np.inf
+
+
+    def add_frame(self, frame, slice_index=None):
+        """Update the projections with the next frame of the stack"""
+        k = self.slice_index if slice_index is None else slice_index
+        if k == 0:
+            # first slice: overwrite instead of clearing the previous stack
+            np.copyto(self.xy, frame)
+        else:
+            np.maximum(self.xy, frame, out=self.xy)
+        np.max(frame, axis=0, out=self.xz[k])
+        np.max(frame, axis=1, out=self.yz[k])
+        self.slice_index = k + 1
+        if self.slice_index == self.frames_per_stack:
+            self.slice_index = 0
+            self.stacks += 1
+            self._publish()
+
+
+    def __call__(self, frame, frame_id):
+        """Hook signature of FastMC_stream: frame ids run over all stacks"""
+        self.add_frame(frame, frame_id % self.frames_per_stack)
+
+
+    @staticmethod
+    def _decimate(image, dy, dx):
+        """Get block maximum of image over dy x dx blocks"""
+        if dy == dx == 1:
+            return image.copy()
+        h, w = (image.shape[0] // dy) * dy, (image.shape[1] // dx) * dx
+        return image[:h, :w].reshape(h // dy, dy, w // dx, dx).max(axis=(1, 3))
+
+
+    def _publish(self):
+        """Send decimated projections of the completed stack, at most at display rate"""
+        if self.callback is None:
+            return
+        now = time.monotonic()
+        if now - self._last_publish < self.display_interval:
+            return
+        self._last_publish = now
+        self.published += 1
+        d = self.decimation
+        self.callback({"stack": self.stacks - 1,
+                       "xy": self._decimate(self.xy, d, d),
+                       "xz": self._decimate(self.xz, 1, d),
+                       "yz": self._decimate(self.yz, 1, d)})
+
+
+    def get_projections(self):
+        """Get full resolution projections of the current (possibly partial) stack"""
+        n = self.slice_index or self.frames_per_stack
+        return self.xy.copy(), self.xz[:n].copy(), self.yz[:n].copy()
@@ -0,0 +1,211 @@
+import numpy as np
+import hashlib
+from scipy import ndimage
+from scipy.spatial import cKDTree
+
+# Registration of camera 2 onto camera 1 for simultaneous two-camera imaging.
+#
+# calibrate() finds bright spots (beads, or the crosses of a grid target such
+# as the ArgoSIM slide) in one image of each camera, pairs them by nearest
+# neighbour and fits a polynomial mapping (order 1 = affine) from camera-1
+# pixel coordinates to camera-2 pixel coordinates. The mapping is compiled
+# once into a remap table (4 neighbour indices + bilinear weights per output
+# pixel), so registering a frame is a single vectorized gather.
+#
+# Use:
+#   reg = FastMC_registration.calibrate(beads_cam1, beads_cam2, order=2)
+#   reg.save("registration.npz")
+#   registered = reg.apply(frame_cam2)       # camera-2 frame on the camera-1 pixel grid
+#   reg = FastMC_registration.calibrate(grid_cam1, grid_cam2, initial=coarse_coefs)   # large rotation / magnification
+
+
+def find_spots(image, threshold=None, min_area=3):
+    """Get (row, col) centroids of connected bright spots"""
+    image = np.asarray(image, dtype=np.float32)
+    if threshold is None:
+        threshold = image.mean() + 5 * image.std()
+    labels, n = ndimage.label(image > threshold)
+    if n == 0:
+        return np.empty((0, 2))
+    index = np.arange(1, n + 1)
+    areas = ndimage.sum_labels(np.ones_like(image), labels, index)
+    centers = np.array(ndimage.center_of_mass(image, labels, index))
+    return centers[areas >= min_area]
+
+
+def _monomials(points, order):
+    """Get design matrix of all monomials r^i c^j with i + j <= order"""
+    r, c = points[:, 0], points[:, 1]
+    return np.stack([r ** i * c ** (d - i) for d in range(order + 1) for i in range(d + 1)], axis=1)
+
+
+def fit_mapping(src, dst, order=1):
+    """Get least-squares polynomial coefficients mapping src (row, col) points to dst points"""
+    n_terms = (order + 1) * (order + 2) // 2
+    if len(src) < n_terms:
+        raise ValueError(f"Need at least {n_terms} matched points for order {order}, got {len(src)}")
+    coefs, *_ = np.linalg.lstsq(_monomials(src, order), dst, rcond=None)
+    return coefs
+
+
+def coarse_offset(spots1, spots2, bin_size=10.0):
+    """Get (row, col) translation from camera 1 to camera 2 spots: the most frequent spot-to-spot displacement"""
+    if len(spots1) == 0 or len(spots2) == 0:
+        raise ValueError("No spots to register")
+    # the true shift is shared by every matched pair, wrong pairs spread out. The histogram of all pairwise
+    # displacements is the cross-correlation of the two spot histograms: computed by FFT, never N1 x N2 pairs
+    origin = np.minimum(spots1.min(axis=0), spots2.min(axis=0))
+    bins1 = np.floor((spots1 - origin) / bin_size).astype(np.int64)
+    bins2 = np.floor((spots2 - origin) / bin_size).astype(np.int64)
+    shape = np.maximum(bins1.max(axis=0), bins2.max(axis=0)) + 1
+    hist1, hist2 = np.zeros(shape), np.zeros(shape)
+    np.add.at(hist1, tuple(bins1.T), 1)
+    np.add.at(hist2, tuple(bins2.T), 1)
+    # zero padded to twice the size: displacements -(shape - 1)..(shape - 1) do not wrap onto each other
+    size = tuple(2 * shape)
+    counts = np.fft.irfft2(np.fft.rfft2(hist2, size) * np.conj(np.fft.rfft2(hist1, size)), size)
+    # a displacement d * bin_size <= shift < (d + 1) * bin_size gives bin differences d and d + 1: sum 2 x 2 windows
+    counts = counts + np.roll(counts, -1, axis=0)
+    counts = counts + np.roll(counts, -1, axis=1)
+    d = np.array(np.unravel_index(np.argmax(counts), size))
+    d = np.where(d >= shape, d - 2 * shape, d)
+    peak = (d + 0.5) * bin_size
+    # refine with the pairs within bin_size of the peak
+    near = cKDTree(spots2).query_ball_point(spots1 + peak, r=bin_size, p=np.inf)
+    i = np.repeat(np.arange(len(spots1)), [len(j) for j in near])
+    j = np.concatenate(near).astype(np.int64)
+    return np.median(spots2[j] - spots1[i], axis=0)
+
+
+def match_spots(spots1, spots2, order=1, max_distance=10.0, initial=None, iterations=10):
+    """Get matched (camera 1, camera 2) spot pairs and the fitted mapping, refining pairs and fit alternately"""
+    tree = cKDTree(spots2)
+    coefs = initial
+    if coefs is None:
+        # translation seed (constant, col and row terms of _monomials): the cameras may be shifted by more than
+        # max_distance. Rotation or magnification moving spots by more than max_distance needs an initial mapping,
+        # and a regular grid only fixes the shift up to one pitch: check the residual
+        coefs = np.array([coarse_offset(spots1, spots2, max_distance), [0.0, 1.0], [1.0, 0.0]])
+    for _ in range(iterations):
+        predicted = _monomials(spots1, _order_of(coefs)) @ coefs
+        dist, nearest = tree.query(predicted, distance_upper_bound=max_distance)
+        ok = np.isfinite(dist)
+        if not ok.any():
+            raise ValueError(f"No spot pairs within {max_distance} px: give an initial mapping")
+        pairs1, pairs2 = spots1[ok], spots2[nearest[ok]]
+        new = fit_mapping(pairs1, pairs2, order)
+        if coefs.shape == new.shape and np.allclose(new, coefs):
+            break
+        coefs = new
+    return pairs1, pairs2, coefs
+
+
+def _order_of(coefs):
+    """Get polynomial order from the number of coefficient rows"""
+    n, order = len(coefs), 0
+    while (order + 1) * (order + 2) // 2 < n:
+        order += 1
+    return order
+
+
+class camera_registration:
+
+    def __init__(self, coefs, image_height, image_width, residual=None):
+        """coefs: polynomial mapping from camera-1 (row, col) to camera-2 (row, col)"""
+        self.coefs = np.asarray(coefs, dtype=float)
+        self.order = _order_of(self.coefs)
+        self.image_height = image_height
+        self.image_width = image_width
+        self.residual = residual
+        h = hashlib.sha1(self.coefs.tobytes())
+        h.update(np.array([image_height, image_width]).tobytes())
+        self.version = h.hexdigest()[:12]
+        self._table = None
+        # gather, product and sum buffers of apply
+        self._buffers = None
+        self._out = None
+
+
+    def map_points(self, points):
+        """Get camera-2 coordinates of camera-1 (row, col) points"""
+        return _monomials(np.asarray(points, dtype=float), self.order) @ self.coefs
+
+
+    def compile(self):
+        """Get remap table: flat camera-2 indices (4, N) and bilinear weights (4, N) of every camera-1 pixel"""
+        if self._table is not None:
+            return self._table
+        h, w = self.image_height, self.image_width
+        rows, cols = np.mgrid[0:h, 0:w]
+        mapped = self.map_points(np.stack([rows.ravel(), cols.ravel()], axis=1))
+        # int32 indices: a full 2048 x 2060 frame has 4.2e6 pixels. Half the table of int64
+        r0 = np.floor(mapped[:, 0]).astype(np.int32)
+        c0 = np.floor(mapped[:, 1]).astype(np.int32)
+        fr = (mapped[:, 0] - r0).astype(np.float32)
+        fc = (mapped[:, 1] - c0).astype(np.float32)
+        idx = np.empty((4, h * w), dtype=np.int32)
+        weights = np.empty((4, h * w), dtype=np.float32)
+        for k, (dr, dc, wgt) in enumerate([(0, 0, (1 - fr) * (1 - fc)), (0, 1, (1 - fr) * fc),
+                                           (1, 0, fr * (1 - fc)), (1, 1, fr * fc)]):
+            r, c = r0 + dr, c0 + dc
+            inside = (r >= 0) & (r < h) & (c >= 0) & (c < w)
+            # pixels mapped outside camera 2 read index 0 with weight 0
+            idx[k] = np.where(inside, r * w + c, 0)
+            weights[k] = np.where(inside, wgt, 0)
+        self._table = (idx, weights)
+        return self._table
+
+
+    def apply(self, frame, out=None):
+        """Get camera-2 frame resampled on the camera-1 pixel grid, written to out if given"""
+        idx, weights = self.compile()
+        flat = frame.reshape(-1)
+        n = self.image_height * self.image_width
+        if self._buffers is None or self._buffers[0].dtype != frame.dtype:
+            self._buffers = (np.empty(n, dtype=frame.dtype), np.empty(n, dtype=np.float32), np.empty(n, dtype=np.float32))
+        gather, product, acc = self._buffers
+        # one neighbour at a time in preallocated buffers: no per-frame allocation
+        for k in range(4):
+            np.take(flat, idx[k], out=gather)
+            np.multiply(gather, weights[k], out=acc if k == 0 else product)
+            if k:
+                acc += product
+        if np.issubdtype(frame.dtype, np.integer):
+            np.rint(acc, out=acc)
+        if out is None:
+            out = np.empty((self.image_height, self.image_width), dtype=frame.dtype)
+        np.copyto(out, acc.reshape(self.image_height, self.image_width), casting="unsafe")
+        return out
+
+
+    def __call__(self, frame, frame_id):
+        """Hook signature of FastMC_stream: register camera-2 frames on ingestion"""
+        # the ring copies the returned frame: one output buffer serves every frame
+        if self._out is None or self._out.dtype != frame.dtype:
+            self._out = np.empty((self.image_height, self.image_width), dtype=frame.dtype)
+        return self.apply(frame, self._out)
+
+
+    def save(self, path):
+        """Save mapping to a .npz file"""
+        np.savez(path, coefs=self.coefs, shape=np.array([self.image_height, self.image_width]),
+                 residual=np.array(np.nan if self.residual is None else self.residual))
+
+
+    @classmethod
+    def load(cls, path):
+        """Load mapping from a .npz file"""
+        with np.load(path) as data:
+            residual = float(data["residual"])
+            return cls(data["coefs"], *data["shape"].tolist(), None if np.isnan(residual) else residual)
+
+
+def calibrate(image1, image2, order=1, max_distance=10.0, threshold=None, initial=None):
+    """Get the registration of camera 2 onto camera 1 from one bead or grid image of each camera"""
+    spots1 = find_spots(image1, threshold)
+    spots2 = find_spots(image2, threshold)
+    if len(spots1) == 0 or len(spots2) == 0:
+        raise ValueError("No spots found in calibration images")
+    pairs1, pairs2, coefs = match_spots(spots1, spots2, order, max_distance, initial)
+    residual = float(np.sqrt(np.mean(np.sum((_monomials(pairs1, order) @ coefs - pairs2) ** 2, axis=1))))
+    return camera_registration(coefs, image1.shape[0], image1.shape[1], residual)
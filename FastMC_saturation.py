@@ -0,0 +1,207 @@
+import numpy as np
+
+# Saturation monitoring of incoming frames and exposure feedback between
+# stacks. saturation_monitor is a per-frame hook of the camera processes in
+# FastMC_stream: it histograms a strided subsample of each frame with one
+# bincount (no copy of the full frame, ~0.6 ms for 2048 x 2060 at subsample
+# 4) and counts the pixels at the saturation level. When a stack is complete
+# its statistics go to a callback (e.g. a multiprocessing queue).
+#
+# exposure_feedback turns those statistics into a new LED fraction, LED
+# modulation amplitude or exposure time, applied with FastMC_session between
+# stacks: the camera path never waits for the controller.
+#
+# Use:
+#   monitor = FastMC_saturation.saturation_monitor(scope.frames_per_stack, callback=stats_queue.put)
+#   ... FastMC_stream.run_topology(..., hooks=[monitor]) in the camera processes ...
+#   s = FastMC_session.session(scope)
+#   FastMC_saturation.run_with_feedback(s, stats_queue.get, FastMC_saturation.exposure_feedback("exposure_time"), 50)
+
+# pco.edge 16 bit: saturated profiles in data_analysis/MM0.csv peg at 65503-65535
+SATURATION = 65500
+
+
+class saturation_monitor:
+
+    def __init__(self, frames_per_stack, bit_depth=16, n_bins=256, subsample=4, saturation_level=SATURATION,
+                 percentile=0.999, callback=None):
+        if n_bins & (n_bins - 1) or n_bins > 2 ** bit_depth:
+            raise ValueError("Number of histogram bins must be a power of 2 up to 2 ** bit_depth")
+        self.frames_per_stack = frames_per_stack
+        self.n_bins = n_bins
+        self.shift = bit_depth - int(np.log2(n_bins))
+        self.full_scale = 2 ** bit_depth - 1
+        self.subsample = subsample
+        self.saturation_level = saturation_level
+        self.percentile = percentile
+        self.callback = callback
+        self.histogram = np.zeros(n_bins, dtype=np.int64)
+        self.saturated = np.zeros(frames_per_stack, dtype=np.int64)
+        self.slice_index = 0
+        self.stacks = 0
+        self.frames = 0
+        self.saturated_frames = 0
+        self.history = []
+
+
+    def add_frame(self, frame, slice_index=None):
+        """Add the subsampled histogram and saturated pixel count of the next frame of the stack"""
+        k = self.slice_index if slice_index is None else slice_index
+        if k == 0:
+            self.histogram[:] = 0
+            self.saturated[:] = 0
+        sample = frame[::self.subsample, ::self.subsample]
+        self.histogram += np.bincount((sample >> self.shift).ravel(), minlength=self.n_bins)
+        self.saturated[k] = np.count_nonzero(sample >= self.saturation_level)
+        self.frames += 1
+        self.saturated_frames += bool(self.saturated[k])
+        self.slice_index = k + 1
+        if self.slice_index == self.frames_per_stack:
+            self.slice_index = 0
+            self.stacks += 1
+            self._publish()
+
+
+    def __call__(self, frame, frame_id):
+        """Hook signature of FastMC_stream: frame ids run over all stacks"""
+        self.add_frame(frame, frame_id % self.frames_per_stack)
+
+
+    def _publish(self):
+        """Send the statistics of the completed stack"""
+        stats = self.stack_stats()
+        self.history.append({k: v for k, v in stats.items() if k != "histogram"})
+        if self.callback is not None:
+            self.callback(stats)
+
+
+    def stack_stats(self):
+        """Get histogram, saturated fraction, saturated slices and high percentile level of the last stack"""
+        total = int(self.histogram.sum())
+        cumulative = np.cumsum(self.histogram)
+        # upper edge of the bin holding the percentile
+        level = (int(np.searchsorted(cumulative, self.percentile * total)) + 1) << self.shift
+        return {"stack": self.stacks - 1,
+                "histogram": self.histogram.copy(),
+                "saturated_fraction": float(self.saturated.sum()) / total if total else 0.0,
+                "saturated_slices": np.flatnonzero(self.saturated).tolist(),
+                "level": min(level, self.full_scale),
+                "relative_level": min(level / self.saturation_level, 1.0)}
+
+
+class exposure_feedback:
+
+    PARAMETERS = ("led_fraction_on", "led_modulation", "exposure_time")
+
+    def __init__(self, parameter="exposure_time", target=0.7, max_saturated=1e-4, backoff=0.5, max_gain=2.0,
+                 deadband=0.05, bounds=None):
+        if parameter not in self.PARAMETERS:
+            raise ValueError(f"Feedback parameter must be one of {self.PARAMETERS}")
+        if not 0 < target < 1:
+            raise ValueError("Target level must be a fraction of the saturation level in (0, 1)")
+        self.parameter = parameter
+        self.target = target
+        self.max_saturated = max_saturated
+        self.backoff = backoff
+        self.max_gain = max_gain
+        self.deadband = deadband
+        self.bounds = bounds
+        # led_modulation: amplitude gain applied to the original modulation
+        self.gain = 1.0
+        self._modulation = None
+
+
+    def gain_for(self, stats):
+        """Get the factor to scale the excitation dose by after a stack"""
+        if stats["saturated_fraction"] > self.max_saturated:
+            # clipped: the histogram no longer shows how bright, back off by a fixed factor
+            return self.backoff
+        level = max(stats["relative_level"], 1e-3)
+        return float(np.clip(self.target / level, 1 / self.max_gain, self.max_gain))
+
+
+    def update(self, scope, stats):
+        """Get the parameter edit {name: value} for the next stack, empty if within the deadband"""
+        gain = self.gain_for(stats)
+        if abs(gain - 1) < self.deadband:
+            return {}
+        if self.parameter == "led_modulation":
+            if self._modulation is None:
+                self._modulation = scope.led_modulation
+            gain = self.gain * gain
+            if self.bounds is not None:
+                gain = float(np.clip(gain, *self.bounds))
+            if gain == self.gain:
+                return {}
+            self.gain = gain
+            return {"led_modulation": _scaled(self._modulation, gain)}
+        if self.parameter == "led_fraction_on":
+            low, high = self.bounds if self.bounds is not None else (0.0, 1.0)
+        else:
+            low, high = self.bounds if self.bounds is not None else (scope.MIN_EXP, scope.MAX_EXP)
+        value = float(np.clip(getattr(scope, self.parameter) * gain, low, high))
+        return {} if value == getattr(scope, self.parameter) else {self.parameter: value}
+
+
+class scaled_modulation:
+    """LED modulation function of time (s) with its amplitude scaled by gain"""
+
+    def __init__(self, modulation, gain):
+        self.modulation = modulation
+        self.gain = gain
+
+
+    def __call__(self, t):
+        return self.gain * np.asarray(self.modulation(t), dtype=float)
+
+
+    # equal per (modulation, gain): a gain the feedback returns to hits the compiled buffer of nidaq._led_cache
+    def __eq__(self, other):
+        return isinstance(other, scaled_modulation) and (self.modulation, self.gain) == (other.modulation, other.gain)
+
+
+    def __hash__(self):
+        return hash((self.modulation, self.gain))
+
+
+def _scaled(modulation, gain):
+    """Get modulation (function of time or array, V) with its amplitude scaled by gain"""
+    if callable(modulation):
+        return scaled_modulation(modulation, gain)
+    return gain * np.asarray(modulation, dtype=float)
+
+
+def run_with_feedback(session, next_stats, feedback, n_stacks, timeout=None):
+    """Acquire n_stacks one stack per run, adjusting the excitation between stacks. Returns the edits per stack"""
+    scope = session.scope
+    if feedback.parameter == "led_fraction_on" and scope.multi_d:
+        # 3D: the fraction selects the lit slices, it does not dim a frame
+        raise ValueError("LED fraction sets the lit slices of a 3D stack: adjust exposure_time or led_modulation")
+    if feedback.parameter == "led_fraction_on" and scope.led_trigger != "software_fraction":
+        raise ValueError("LED fraction feedback requires software_fraction LED trigger")
+    if feedback.parameter == "led_modulation" and scope.led_trigger != "modulation":
+        raise ValueError("LED modulation feedback requires modulation LED trigger")
+    num_stacks = scope.num_stacks
+    session.arm(num_stacks=1)
+    edits = []
+    try:
+        for _ in range(n_stacks):
+            session.run()
+            stats = next_stats() if timeout is None else next_stats(timeout=timeout)
+            gain = feedback.gain
+            edit = feedback.update(scope, stats)
+            if edit:
+                try:
+                    session.arm(**edit)
+                except ValueError as e:
+                    # e.g. modulation out of volt range: keep the armed protocol
+                    print(f"Exposure feedback not applied: {e}")
+                    feedback.gain, edit = gain, {}
+            edits.append(edit)
+    finally:
+        # the caller's protocol, with the last exposure edit
+        if session.armed:
+            session.arm(num_stacks=num_stacks)
+        else:
+            scope.num_stacks = num_stacks
+    return edits
@@ -0,0 +1,252 @@
+import nidaqmx
+import nidaqmx.stream_writers
+import numpy as np
+import FastMC_compile
+import FastMC_constraints
+
+# Consecutive acquisitions with the DAQ tasks kept armed between runs.
+#
+# Each arm() compiles the protocol into a plan: one entry per task setting
+# (counter frequency / duty cycle / sample count, AO and LED sample timing,
+# AO and LED buffers). The plan is diffed against the armed one and only what
+# changed is sent to the driver: a new LED fraction rewrites only the LED
+# buffer, a new exposure time only changes the counter frequency and the
+# sample clock rates. A change of the task structure (LED mode, 2D/3D,
+# continuous, ao1 output) closes and rebuilds all tasks.
+#
+# Use:
+#   s = FastMC_session.session(scope)
+#   s.arm()
+#   s.run()
+#   s.arm(led_fraction_on=0.3)      # -> ["led_data"]
+#   s.run()
+#   s.close()
+
+
+def _same(a, b):
+    """Get whether two plan entries are equal (tuples of numbers or arrays)"""
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return a is not None and b is not None and np.shape(a) == np.shape(b) and np.array_equal(a, b)
+    return a == b
+
+
+class session:
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.tasks = {}
+        self.armed = {}
+        self.last_changes = []
+
+
+    @property
+    def clocked(self):
+        """Get whether outputs are clocked by the camera counter (continuous or schedule) instead of retriggered"""
+        return self.scope.continuous or self.scope.schedule is not None
+
+
+    def _plan(self):
+        """Get every task setting of the current scope parameters"""
+        s = self.scope
+        FastMC_constraints.validate(s)
+        if s.compiled is not None and s.compiled.key != FastMC_compile.current_key(s):
+            s.compiled = None
+        plan = {"structure": (self.clocked, s.multi_d, s.led_trigger, s.use_ao, s.ao1_output, s.schedule is not None,
+                              s.external_start, s.sync_input)}
+        freq = s._get_trigger_exp_freq()
+        if not self.clocked:
+            plan["stack_ctr"] = (1 / s.get_stack_time(), s.num_stacks if s.num_stacks != 1 else 2)
+            mode = "continuous" if s.multi_d and s.stack_delay_time == 0 else "finite"
+            plan["exp_ctr"] = (freq, s.duty_cycle, mode, s.frames_per_stack if s.multi_d else 1)
+        elif s.schedule is not None:
+            plan["exp_table"] = np.vstack(s._data("pulse_table", s.compile_pulse_table))
+            freq = 1 / np.min(plan["exp_table"].sum(axis=0))
+        else:
+            plan["exp_ctr"] = (freq, s.duty_cycle, "finite", s.total_frames)
+
+        if s.use_ao:
+            if self.clocked:
+                plan["ao_data"] = np.asarray(s._data("ao", lambda: s._get_ao_data(clocked=True)))
+                plan["ao_timing"] = (freq, plan["ao_data"].shape[-1])
+            else:
+                plan["ao_data"] = np.asarray(s._data("ao", s._get_ao_data))
+                plan["ao_timing"] = (s.stack_sampling_rate * s.ao_oversampling, plan["ao_data"].shape[-1])
+        if s.led_trigger == "software_fraction":
+            if self.clocked:
+                plan["led_data"] = np.asarray(s._data("led", s._get_do_led_data_clocked), dtype=bool)
+                plan["led_timing"] = (freq, len(plan["led_data"]))
+            else:
+                plan["led_data"] = np.asarray(s._data("led", s._get_do_led_data_trigger), dtype=bool)
+                plan["led_timing"] = (s.stack_sampling_rate, len(plan["led_data"]))
+        elif s.led_trigger == "software_time":
+            plan["led_data"] = np.asarray(s._data("led", s._get_do_led_data_no_trigger), dtype=bool)
+            plan["led_timing"] = (s.stack_sampling_rate_delay, len(plan["led_data"]))
+        return plan
+
+
+    def arm(self, **params):
+        """Set scope parameters (nidaq attribute names) and reconfigure only the changed task settings. Returns them"""
+        for name in params:
+            if not hasattr(self.scope, name):
+                raise ValueError(f"Unknown parameter {name}")
+        old = {name: getattr(self.scope, name) for name in params}
+        old_plan, plan = self.armed, None
+        try:
+            for name, value in params.items():
+                setattr(self.scope, name, value)
+            plan = self._plan()
+            changed = [key for key in plan if key not in self.armed or not _same(plan[key], self.armed[key])]
+            # a new schedule (pulse table) changes frame count and every clocked buffer: rebuild, do not patch
+            if "structure" in changed or "exp_table" in changed or set(plan) != set(self.armed):
+                self._build(plan)
+                changed = ["all"]
+            else:
+                self._apply(plan, changed)
+        except Exception:
+            # invalid parameters (FastMC_constraints), values of the wrong type or a driver error: keep the armed protocol
+            for name, value in old.items():
+                setattr(self.scope, name, value)
+            if plan is not None:
+                # tasks may be half configured with the new plan
+                self._restore(old_plan)
+            raise
+        self.armed = plan
+        self.last_changes = changed
+        return changed
+
+
+    def _restore(self, plan):
+        """Configure the tasks from a previous plan again, or close them if that fails too"""
+        try:
+            if plan:
+                self._build(plan)
+            else:
+                self._close_tasks()
+        except Exception:
+            self._close_tasks()
+            self.armed = {}
+
+
+    def _build(self, plan):
+        """Close all tasks and create them again from the plan"""
+        self._close_tasks()
+        s = self.scope
+        if "stack_ctr" in plan:
+            self.tasks["stack_ctr"] = s._stack_trigger()
+        if "exp_table" in plan:
+            self.tasks["exp_ctr"] = s._cam_exposure_table(*plan["exp_table"])
+        elif self.clocked:
+            self.tasks["exp_ctr"] = s._cam_exposure_clock()
+        else:
+            self.tasks["exp_ctr"] = s._cam_exposure_trigger()
+        if "ao_data" in plan:
+            self.tasks["ao"] = s._create_ao_task()
+            self._setup("ao", plan)
+        if "led_data" in plan:
+            self.tasks["led"] = s._create_led_do_task()
+            self._setup("led", plan)
+        if s.sync_input:
+            self.tasks["sync_time"], self.tasks["sync_frame"] = s._sync_input_tasks()
+
+
+    def _setup(self, name, plan):
+        """Configure sample timing, trigger and buffer of the AO or LED task without starting it"""
+        s = self.scope
+        task, data = self.tasks[name], plan[name + "_data"]
+        data = data.tolist() if name == "led" else data
+        if self.clocked:
+            s.setup_clocked_task(task, data, plan[name + "_timing"][0], start=False)
+        elif s.led_trigger == "software_time" and name == "led":
+            s.setup_not_triggered_task(task, data, start=False)
+        else:
+            s.setup_triggered_task(task, data, s.ao_oversampling if name == "ao" else 1, start=False)
+
+
+    def _apply(self, plan, changed):
+        """Send only the changed settings to the armed tasks"""
+        finite = nidaqmx.constants.AcquisitionType.FINITE
+        if "stack_ctr" in changed:
+            freq, samps = plan["stack_ctr"]
+            task = self.tasks["stack_ctr"]
+            if freq != self.armed["stack_ctr"][0]:
+                task.co_channels[0].co_pulse_freq = freq
+            if samps != self.armed["stack_ctr"][1]:
+                task.timing.cfg_implicit_timing(sample_mode=finite, samps_per_chan=samps)
+        if "exp_ctr" in changed:
+            freq, duty, mode, samps = plan["exp_ctr"]
+            task = self.tasks["exp_ctr"]
+            if freq != self.armed["exp_ctr"][0]:
+                task.co_channels[0].co_pulse_freq = freq
+            if duty != self.armed["exp_ctr"][1]:
+                task.co_channels[0].co_pulse_duty_cyc = duty
+            if (mode, samps) != self.armed["exp_ctr"][2:]:
+                sample_mode = nidaqmx.constants.AcquisitionType.CONTINUOUS if mode == "continuous" else finite
+                task.timing.cfg_implicit_timing(sample_mode=sample_mode, samps_per_chan=samps)
+        if "exp_table" in changed:
+            high_times, low_times = plan["exp_table"]
+            task = self.tasks["exp_ctr"]
+            if len(high_times) != self.armed["exp_table"].shape[1]:
+                task.timing.cfg_implicit_timing(sample_mode=finite, samps_per_chan=len(high_times))
+            nidaqmx.stream_writers.CounterWriter(task.out_stream).write_many_sample_pulse_time(high_times, low_times)
+        for name in ("ao", "led"):
+            timing, data = name + "_timing", name + "_data"
+            if timing in changed and plan[timing][1] != self.armed[timing][1]:
+                # buffer size changed: timing, trigger and buffer
+                self._setup(name, plan)
+                continue
+            if timing in changed:
+                self.tasks[name].timing.samp_clk_rate = plan[timing][0]
+            if data in changed:
+                self.tasks[name].write(plan[data].tolist() if name == "led" else plan[data], auto_start=False)
+
+
+    def run(self):
+        """Run the armed protocol once. Tasks stay configured for the next arm()"""
+        if not self.armed:
+            raise RuntimeError("Session is not armed")
+        s = self.scope
+        # edges of the previous run must not end up in this one's metadata
+        s.sync_edges = None
+        outputs = [self.tasks[name] for name in ("ao", "led") if name in self.tasks]
+        sync = [self.tasks[name] for name in ("sync_time", "sync_frame") if name in self.tasks]
+        for task in outputs:
+            task.start()
+        exp_ctr = self.tasks["exp_ctr"]
+        if self.clocked:
+            for task in sync:
+                task.start()
+            exp_ctr.start()
+            exp_ctr.wait_until_done(s.get_total_acq_time() + 1.0 + s.get_start_wait())
+        else:
+            exp_ctr.start()
+            for task in sync:
+                task.start()
+            stack_ctr = self.tasks["stack_ctr"]
+            stack_ctr.start()
+            stack_ctr.wait_until_done((s.get_stack_time() if s.num_stacks == 1 else s.get_total_acq_time()) + s.get_start_wait())
+            stack_ctr.stop()
+        if sync:
+            s._read_sync_input(sync)
+        counts, errors = s._verify_frame_count(outputs) if self.clocked else ({}, [])
+        exp_ctr.stop()
+        for task in outputs + sync:
+            task.stop()
+        if errors:
+            raise RuntimeError("Clocked outputs out of sync with camera triggers: " + "; ".join(errors))
+        return counts
+
+
+    def _close_tasks(self):
+        for task in self.tasks.values():
+            task.close()
+        self.tasks = {}
+
+
+    def close(self):
+        """Close all tasks and switch excitation off"""
+        self._close_tasks()
+        if self.armed and self.scope.led_trigger == "software_fraction":
+            self.scope._led_off()
+        if self.armed and self.scope.ao1_output is not None:
+            self.scope._ao1_off()
+        self.armed = {}
@@ -0,0 +1,366 @@
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import os
+import time
+import queue
+import itertools
+
+# Multi-process acquisition: one DAQ-control process, one ingestion process
+# per camera and one writer process, so trigger control, camera readout and
+# disk writing do not compete for one interpreter (GIL).
+#
+# Each camera process hands frames to the writer through a frame_ring: a
+# single-producer / single-consumer ring buffer in shared memory, sized from
+# image_height x image_width. Hand-off is lock-free: the producer fills a slot
+# and then advances the write count, the consumer reads the slot and then
+# advances the read count. Each count is written by one process only.
+#
+# Use (Windows needs the __main__ guard):
+#   if __name__ == "__main__":
+#       stats = FastMC_stream.run_topology(params, [FastMC_stream.pco_camera(serial1), FastMC_stream.pco_camera(serial2)],
+#                                          n_frames=scope.total_frames, paths=["cam1.npy", "cam2.npy"])
+
+# header layout (int64): counters on separate cache lines
+_WRITE = 0
+_READ = 8
+_DROPPED = 16
+_CLOSED = 24
+_FAILED = 25     # written by the producer, like _CLOSED
+_HEADER_LEN = 32
+
+
+class frame_ring:
+
+    def __init__(self, image_height, image_width, n_slots=32, dtype="uint16", name=None):
+        """Create the ring in shared memory, or attach to an existing one by name"""
+        self.image_height = image_height
+        self.image_width = image_width
+        self.n_slots = n_slots
+        self.dtype = np.dtype(dtype)
+        header_bytes = _HEADER_LEN * 8
+        meta_bytes = n_slots * 2 * 8
+        frame_bytes = image_height * image_width * self.dtype.itemsize
+        create = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=header_bytes + meta_bytes + n_slots * frame_bytes)
+        self.owner = create
+
+        buf = self.shm.buf
+        self.header = np.ndarray((_HEADER_LEN,), dtype=np.int64, buffer=buf)
+        # frame id and ingestion timestamp (ns, monotonic clock) of each slot
+        self.meta = np.ndarray((n_slots, 2), dtype=np.int64, buffer=buf, offset=header_bytes)
+        self.frames = np.ndarray((n_slots, image_height, image_width), dtype=self.dtype, buffer=buf,
+                                 offset=header_bytes + meta_bytes)
+        if create:
+            self.header[:] = 0
+
+
+    @property
+    def spec(self):
+        """Get arguments to attach to this ring from another process"""
+        return (self.image_height, self.image_width, self.n_slots, self.dtype.str, self.shm.name)
+
+
+    @classmethod
+    def attach(cls, spec):
+        """Get the ring created by another process"""
+        return cls(*spec)
+
+
+    # ------------------------------ producer ------------------------------ #
+
+    def write_slot(self):
+        """Get the next free frame slot to fill in place, or None if the ring is full"""
+        w = int(self.header[_WRITE])
+        if w - int(self.header[_READ]) >= self.n_slots:
+            return None
+        return self.frames[w % self.n_slots]
+
+
+    def commit(self, frame_id):
+        """Publish the slot returned by write_slot"""
+        w = int(self.header[_WRITE])
+        self.meta[w % self.n_slots] = (frame_id, time.monotonic_ns())
+        # publish after the frame and meta are written
+        self.header[_WRITE] = w + 1
+
+
+    def put(self, frame, frame_id):
+        """Copy a frame into the ring. Returns False (and counts a drop) if the ring is full"""
+        slot = self.write_slot()
+        if slot is None:
+            self.header[_DROPPED] += 1
+            return False
+        slot[...] = frame
+        self.commit(frame_id)
+        return True
+
+
+    def close_stream(self):
+        """Mark that no more frames will be written"""
+        self.header[_CLOSED] = 1
+
+
+    def fail(self):
+        """Mark that the source raised: the stream is incomplete"""
+        self.header[_FAILED] = 1
+
+
+    # ------------------------------ consumer ------------------------------ #
+
+    def read_slot(self):
+        """Get (frame, frame id, ingestion time ns) of the oldest frame, or None if empty. Call release() after use"""
+        r = int(self.header[_READ])
+        if r >= int(self.header[_WRITE]):
+            return None
+        i = r % self.n_slots
+        return self.frames[i], int(self.meta[i, 0]), int(self.meta[i, 1])
+
+
+    def release(self):
+        """Give the slot returned by read_slot back to the producer"""
+        self.header[_READ] += 1
+
+
+    def latest(self):
+        """Get the newest frame without consuming it (preview only: it may be overwritten while read)"""
+        w = int(self.header[_WRITE])
+        return self.frames[(w - 1) % self.n_slots] if w else None
+
+
+    @property
+    def finished(self):
+        """Check that the producer closed the stream and every frame was read"""
+        return bool(self.header[_CLOSED]) and int(self.header[_READ]) >= int(self.header[_WRITE])
+
+
+    @property
+    def dropped(self):
+        return int(self.header[_DROPPED])
+
+
+    @property
+    def failed(self):
+        return bool(self.header[_FAILED])
+
+
+    def close(self):
+        """Release the shared memory. The creating process also frees it"""
+        self.header = self.meta = self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# ------------------------------ CAMERA SOURCES ------------------------------ #
+
+# Sources are generators of frames. A source that must be set up before the
+# first trigger (open, configure, start recording) yields ARMED once it is
+# ready: ingest() runs it up to that point before releasing the DAQ.
+ARMED = "armed"
+
+
+class synthetic_camera:
+    """Frame source at a fixed frame rate, for benchmarks and tests of the topology"""
+
+    def __init__(self, image_height, image_width, fps, seed=0):
+        self.image_height = image_height
+        self.image_width = image_width
+        self.fps = fps
+        self.seed = seed
+
+    def __call__(self, n_frames):
+        rng = np.random.default_rng(self.seed)
+        frames = rng.integers(100, 4000, size=(4, self.image_height, self.image_width), dtype=np.uint16)
+        yield ARMED
+        t0 = time.perf_counter()
+        for i in range(n_frames):
+            # wait for the next frame trigger
+            delay = t0 + i / self.fps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            yield frames[i % 4]
+
+
+class pco_camera:
+    """Frames of a PCO camera in external exposure control. Micro-Manager must not hold the camera"""
+
+    def __init__(self, serial=None, n_buffers=32):
+        self.serial = serial
+        self.n_buffers = n_buffers
+
+    def __call__(self, n_frames):
+        import pco
+        with pco.Camera(serial=self.serial) as cam:
+            cam.configuration = {"trigger": "external exposure control"}
+            cam.record(number_of_images=self.n_buffers, mode="fifo")
+            # recording: waits for the external exposure triggers
+            yield ARMED
+            for _ in range(n_frames):
+                cam.wait_for_new_image(timeout=10.0)
+                image, meta = cam.image(0)
+                yield image
+            cam.stop()
+
+
+# ------------------------------- PROCESSES ---------------------------------- #
+
+def daq_control(params, start):
+    """DAQ-control process: run the acquisition once every camera is ready"""
+    import FastMC_core
+    scope = FastMC_core.nidaq(**params)
+    start.wait()
+    scope.acquire(confirm=False)
+
+
+def ingest(ring_spec, source, n_frames, ready, hook=None):
+    """Camera process: copy every frame of the source into its ring, after the optional hook(frame, frame_id)"""
+    ring = frame_ring.attach(ring_spec)
+    try:
+        frames = iter(source(n_frames))
+        # run the source until its camera is armed, so no trigger comes before it
+        first = next(frames, ARMED)
+        if first is not ARMED:
+            frames = itertools.chain([first], frames)
+        ready.set()
+        for i, frame in enumerate(frames):
+            if hook is not None:
+                # per-frame processing in the ingestion path (projections, registration...). A returned frame replaces it
+                processed = hook(frame, i)
+                if isinstance(processed, list):
+                    # (frame, frame id) pairs to write instead, possibly none or earlier frames (FastMC_events)
+                    for kept, frame_id in processed:
+                        ring.put(kept, frame_id)
+                    continue
+                if processed is not None:
+                    frame = processed
+            ring.put(frame, i)
+    except BaseException:
+        ring.fail()
+        raise
+    finally:
+        # a source failing before ARMED must not leave run_topology waiting for it
+        ready.set()
+        ring.close_stream()
+        ring.close()
+
+
+def write_frames(ring_specs, paths, n_frames, results, append=False):
+    """Writer process: save the frames of every ring to .npy files (None: discard) and report latencies"""
+    # append=False: frame k goes to row k. append=True: rows in arrival order, file cut to the frames received,
+    # frame ids reported and saved as <path>_ids.npy. For hooks keeping some frames, sent late with earlier ids (FastMC_events)
+    rings = [frame_ring.attach(spec) for spec in ring_specs]
+    outs = [None if path is None else np.lib.format.open_memmap(path, mode="w+", dtype=ring.dtype, shape=(n_frames, ring.image_height, ring.image_width))
+            for ring, path in zip(rings, paths)]
+    latencies = [np.empty(n_frames, dtype=np.int64) for _ in rings]
+    ids = [np.empty(n_frames, dtype=np.int64) for _ in rings]
+    counts = [0] * len(rings)
+    overflow = [0] * len(rings)
+    t_start = None
+    while not all(ring.finished for ring in rings):
+        idle = True
+        for k, ring in enumerate(rings):
+            got = ring.read_slot()
+            if got is None:
+                continue
+            frame, frame_id, t_ingest = got
+            if t_start is None:
+                t_start = time.monotonic_ns()
+            row = counts[k] if append else frame_id
+            if counts[k] >= n_frames or not 0 <= row < n_frames:
+                # more frames than rows (or an id out of range): never write past the file
+                overflow[k] += 1
+                ring.release()
+                idle = False
+                continue
+            if outs[k] is not None:
+                outs[k][row] = frame
+            ids[k][counts[k]] = frame_id
+            latencies[k][counts[k]] = time.monotonic_ns() - t_ingest
+            counts[k] += 1
+            ring.release()
+            idle = False
+        if idle:
+            time.sleep(100e-6)
+    elapsed = (time.monotonic_ns() - t_start) * 1e-9 if t_start is not None else 0.0
+    for out in outs:
+        if out is not None:
+            out.flush()
+    stats = {"frames": counts, "dropped": [ring.dropped for ring in rings], "overflow": overflow, "elapsed": elapsed,
+             "latencies": [lat[:n] for lat, n in zip(latencies, counts)]}
+    if append:
+        stats["frame_ids"] = [frame_ids[:n] for frame_ids, n in zip(ids, counts)]
+        for k, path in enumerate(paths):
+            if path is not None:
+                outs[k] = None
+                _truncate(path, counts[k])
+                np.save(path[:-len(".npy")] + "_ids.npy" if path.endswith(".npy") else path + "_ids.npy", stats["frame_ids"][k])
+    results.put(stats)
+    for ring in rings:
+        ring.close()
+
+
+def _truncate(path, n):
+    """Cut a .npy file to its first n frames"""
+    data = np.load(path, mmap_mode="r")
+    if len(data) == n:
+        return
+    tmp = path + ".part.npy"
+    np.save(tmp, data[:n])
+    del data
+    os.replace(tmp, path)
+
+
+def run_topology(daq_params, sources, n_frames, paths=None, image_height=None, image_width=None, n_slots=32,
+                 daq_target=daq_control, hooks=None, append=False):
+    """Run DAQ, one ingestion process per camera source and the writer. Returns throughput and latency stats"""
+    if image_height is None:
+        image_height, image_width = daq_params["image_height"], daq_params["image_width"]
+    paths = paths if paths is not None else [None] * len(sources)
+    hooks = hooks if hooks is not None else [None] * len(sources)
+    rings = [frame_ring(image_height, image_width, n_slots) for _ in sources]
+    results = mp.Queue()
+    start = mp.Event()
+    ready = [mp.Event() for _ in sources]
+    try:
+        writer = mp.Process(target=write_frames, args=([r.spec for r in rings], paths, n_frames, results, append), name="FastMC_writer")
+        cams = [mp.Process(target=ingest, args=(r.spec, src, n_frames, rdy, hook), name=f"FastMC_camera{k + 1}")
+                for k, (r, src, rdy, hook) in enumerate(zip(rings, sources, ready, hooks))]
+        daq = mp.Process(target=daq_target, args=(daq_params, start), name="FastMC_daq")
+        writer.start()
+        for p in cams:
+            p.start()
+        daq.start()
+        for rdy, p in zip(ready, cams):
+            # poll as well: a camera process killed before arming never sets its event
+            while not rdy.wait(0.1):
+                if p.exitcode is not None:
+                    break
+        if any(r.failed or p.exitcode not in (None, 0) for r, p in zip(rings, cams)):
+            # no trigger for a camera that is not recording
+            daq.terminate()
+        else:
+            start.set()
+        for p in cams + [daq]:
+            p.join()
+        # the DAQ process only counts when it was not stopped here
+        failed = [p.name for p in cams + ([daq] if start.is_set() else []) if p.exitcode != 0]
+        try:
+            stats = results.get(timeout=60)
+        except queue.Empty:
+            raise RuntimeError("Writer process did not report" + (f" (failed: {', '.join(failed)})" if failed else ""))
+        writer.join()
+        if failed:
+            raise RuntimeError(f"Acquisition processes failed: {', '.join(failed)}")
+    finally:
+        for r in rings:
+            r.close()
+
+    lat = np.concatenate(stats.pop("latencies")) * 1e-9
+    frame_bytes = image_height * image_width * np.dtype("uint16").itemsize
+    total = sum(stats["frames"])
+    stats["fps"] = total / stats["elapsed"] if stats["elapsed"] else 0.0
+    stats["MB_per_s"] = stats["fps"] * frame_bytes / 1e6
+    if len(lat):
+        stats["latency_s"] = {"median": float(np.median(lat)), "p99": float(np.percentile(lat, 99)), "max": float(lat.max())}
+    return stats
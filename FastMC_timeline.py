@@ -0,0 +1,130 @@
+import numpy as np
+import matplotlib.pyplot as plt
+
+# Timeline of every output line of an acquisition (stack trigger, camera
+# exposure, galvo, ao1 excitation, LED) over the whole experiment, built from
+# the compiled pulse table and channel buffers of FastMC_core.nidaq rather than
+# from approximations. Each channel is a step waveform: value v[i] holds from
+# t[i] until t[i + 1].
+#
+# Drawing uses min/max decimation per pixel: for each pixel column only the
+# minimum and maximum of the samples inside it are plotted, so a pulse of any
+# width stays visible and million-sample channels redraw instantly when
+# panning or zooming (the view is re-decimated on every x-limit change).
+#
+# Use:
+#   FastMC_timeline.timeline(scope).show()              # whole experiment
+#   FastMC_timeline.timeline(scope).show(0, 2 * scope.get_stack_time())
+
+TTL = 5.0   # V. level drawn for counter and digital lines
+
+
+def decimate(t, v, t0, t1, n_pixels):
+    """Get pixel centers and min/max of the step waveform (t, v) in each of n_pixels bins over [t0, t1]"""
+    edges = np.linspace(t0, t1, n_pixels + 1)
+    # sample held at each bin start, and end (exclusive) of the samples starting inside the bin
+    start = np.clip(np.searchsorted(t, edges[:-1], side="right") - 1, 0, len(t) - 1)
+    stop = np.maximum(np.searchsorted(t, edges[1:], side="left"), start + 1)
+    # reduceat over interleaved (start, stop) pairs: even results are the bin reductions
+    idx = np.column_stack([start, stop]).ravel()
+    padded = np.append(v, v[-1])
+    v_min = np.minimum.reduceat(padded, idx)[::2]
+    v_max = np.maximum.reduceat(padded, idx)[::2]
+    return (edges[:-1] + edges[1:]) / 2, v_min, v_max
+
+
+def _sampled(data, starts, rate):
+    """Get step waveform of a buffer output at rate from every start time"""
+    data = np.asarray(data, dtype=float)
+    t = (np.asarray(starts)[:, None] + np.arange(len(data)) / rate).ravel()
+    return t, np.tile(data, len(starts))
+
+
+def _clocked(data, frame_starts):
+    """Get step waveform of a regenerated buffer output one sample per camera trigger"""
+    data = np.asarray(data, dtype=float)
+    return frame_starts, data[np.arange(len(frame_starts)) % len(data)]
+
+
+def compile_channels(scope):
+    """Get {name: (t, v)} step waveforms of all output lines of the whole acquisition"""
+    high, low = scope.compile_pulse_table()
+    period = high + low
+    frame_starts = np.concatenate([[0.0], np.cumsum(period)[:-1]])
+    stack_starts = frame_starts[::scope.frames_per_stack]
+    end = float(np.sum(period))
+    clocked = scope.continuous or scope.schedule is not None
+    channels = {}
+    analog = []
+
+    if not clocked:
+        stack_time = scope.get_stack_time()
+        t = np.column_stack([stack_starts, stack_starts + 0.2 * stack_time]).ravel()
+        channels["stack trigger (ctr0)"] = (t, np.tile([TTL, 0.0], len(stack_starts)))
+    t = np.column_stack([frame_starts, frame_starts + high]).ravel()
+    channels["exposure (ctr1)"] = (t, np.tile([TTL, 0.0], len(frame_starts)))
+
+    if scope.use_ao:
+        data = np.atleast_2d(scope._get_ao_data(clocked=clocked))
+        names = (["galvo (ao0)"] if scope.multi_d else []) + ([f"{scope.ao1_output} (ao1)"] if scope.ao1_output else [])
+        rate = scope.stack_sampling_rate * scope.ao_oversampling
+        for name, row in zip(names, data):
+            channels[name] = _clocked(row, frame_starts) if clocked else _sampled(row, stack_starts, rate)
+            analog.append(name)
+
+    if scope.led_trigger == "hardware":
+        channels["LED (cam exposure out)"] = channels["exposure (ctr1)"]
+    elif scope.led_trigger == "software_fraction":
+        if clocked:
+            channels["LED (do0)"] = _clocked(TTL * np.asarray(scope._get_do_led_data_clocked()), frame_starts)
+        else:
+            channels["LED (do0)"] = _sampled(TTL * np.asarray(scope._get_do_led_data_trigger()), stack_starts, scope.stack_sampling_rate)
+    elif scope.led_trigger == "software_time":
+        channels["LED (do0)"] = _sampled(TTL * np.asarray(scope._get_do_led_data_no_trigger()), [0.0], scope.stack_sampling_rate_delay)
+
+    # digital lines end low after the last frame, analog outputs hold their last value
+    return {name: (np.append(t, end), np.append(v, v[-1] if name in analog else 0.0)) for name, (t, v) in channels.items()}
+
+
+class timeline:
+
+    def __init__(self, scope, n_pixels=2000):
+        self.scope = scope
+        self.n_pixels = n_pixels
+        self.channels = compile_channels(scope)
+        self.end = max(t[-1] for t, _ in self.channels.values())
+        self._lines = {}
+
+
+    def show(self, t_start=0.0, t_end=None):
+        """Plot all channels over [t_start, t_end] (whole experiment by default), re-decimated on pan and zoom"""
+        t_end = self.end if t_end is None else t_end
+        fig, axes = plt.subplots(len(self.channels), 1, sharex=True, squeeze=False,
+                                 figsize=(10, 1.5 * len(self.channels) + 1))
+        for ax, (name, (t, v)) in zip(axes[:, 0], self.channels.items()):
+            line, = ax.plot([], [], lw=1)
+            self._lines[name] = (ax, line)
+            ax.set_ylabel(name, rotation=0, ha="right", va="center")
+            lo, hi = v.min(), v.max()
+            margin = 0.1 * (hi - lo) or 0.5
+            ax.set_ylim(lo - margin, hi + margin)
+        axes[-1, 0].set_xlabel("Time (s)")
+        axes[0, 0].set_title("3D acquisition" if self.scope.multi_d else "2D acquisition")
+        axes[0, 0].set_xlim(t_start, t_end)
+        self._redraw(axes[0, 0])
+        # shared x axis: one callback redraws all channels
+        axes[0, 0].callbacks.connect("xlim_changed", self._redraw)
+        fig.tight_layout()
+        plt.show()
+        return fig
+
+
+    def _redraw(self, ax):
+        """Re-decimate every channel to the pixel width of the current view"""
+        t0, t1 = ax.get_xlim()
+        n_pixels = max(int(ax.bbox.width), 1) if ax.figure is not None else self.n_pixels
+        for name, (t, v) in self.channels.items():
+            x, v_min, v_max = decimate(t, v, t0, t1, min(n_pixels, self.n_pixels))
+            # vertical min-max segment per pixel, joined into one polyline
+            self._lines[name][1].set_data(np.repeat(x, 2), np.column_stack([v_min, v_max]).ravel())
+        ax.figure.canvas.draw_idle()
@@ -0,0 +1,112 @@
+import numpy as np
+import time
+import threading
+import json
+
+# Low-overhead timing of the acquisition phases (task creation, configuration,
+# writes, start, wait, stop/close). Timestamps are monotonic nanoseconds stored
+# in preallocated arrays, so recording a phase does not allocate.
+#
+# Use:
+#   scope.tracer = FastMC_trace.tracer()
+#   scope.acquire()
+#   scope.tracer.export_chrome("trace.json")   # open in chrome://tracing or ui.perfetto.dev
+#   scope.tracer.print_summary()
+
+class _span:
+    """Context manager recording one phase in the tracer buffers"""
+    __slots__ = ("tracer", "name_id", "i")
+
+    def __init__(self, tracer, name_id):
+        self.tracer = tracer
+        self.name_id = name_id
+
+    def __enter__(self):
+        t = self.tracer
+        self.i = i = t.n
+        if i < t.capacity:
+            t.n += 1
+            t._names[i] = self.name_id
+            t._threads[i] = threading.get_ident()
+            t._start[i] = time.perf_counter_ns()
+        else:
+            t.dropped += 1
+        return self
+
+    def __exit__(self, *exc):
+        if self.i < self.tracer.capacity:
+            self.tracer._end[self.i] = time.perf_counter_ns()
+        return False
+
+
+class tracer:
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._names = np.zeros(capacity, dtype=np.int32)
+        self._threads = np.zeros(capacity, dtype=np.int64)
+        self._start = np.zeros(capacity, dtype=np.int64)
+        self._end = np.zeros(capacity, dtype=np.int64)
+        self._name_ids = {}
+        self.names = []
+        self.n = 0
+        self.dropped = 0
+
+
+    def span(self, name):
+        """Get context manager recording the start and end time of a phase"""
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        return _span(self, name_id)
+
+
+    def clear(self):
+        """Forget all recorded phases, keep the buffers"""
+        self.n = 0
+        self.dropped = 0
+
+
+    def get_events(self):
+        """Get recorded phases as (name, start, duration) in seconds from the first phase"""
+        n = self.n
+        if n == 0:
+            return []
+        t0 = self._start[:n].min()
+        starts = (self._start[:n] - t0) * 1e-9
+        durations = (self._end[:n] - self._start[:n]) * 1e-9
+        return [(self.names[k], s, d) for k, s, d in zip(self._names[:n], starts, durations)]
+
+
+    def summary(self):
+        """Get count, total, mean, min and max duration (s) of every phase name"""
+        n = self.n
+        durations = (self._end[:n] - self._start[:n]) * 1e-9
+        ids = self._names[:n]
+        stats = {}
+        for name_id in np.unique(ids):
+            d = durations[ids == name_id]
+            stats[self.names[name_id]] = {"count": int(len(d)), "total": float(d.sum()), "mean": float(d.mean()),
+                                          "min": float(d.min()), "max": float(d.max())}
+        return stats
+
+
+    def print_summary(self):
+        """Print phases sorted by total time"""
+        stats = sorted(self.summary().items(), key=lambda item: -item[1]["total"])
+        for name, st in stats:
+            print(f"{name:45s} n={st['count']:4d}  total={st['total'] * 1e3:10.3f} ms  mean={st['mean'] * 1e3:9.3f} ms  max={st['max'] * 1e3:9.3f} ms")
+        if self.dropped:
+            print(f"{self.dropped} phases dropped: tracer capacity {self.capacity} reached")
+
+
+    def export_chrome(self, path):
+        """Save recorded phases in Chrome trace event format (JSON)"""
+        n = self.n
+        t0 = self._start[:n].min() if n else 0
+        events = [{"name": self.names[self._names[i]], "ph": "X", "pid": 0, "tid": int(self._threads[i]),
+                   "ts": (self._start[i] - t0) / 1e3, "dur": (self._end[i] - self._start[i]) / 1e3}
+                  for i in range(n)]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"summary": self.summary()}}, f)
@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Throughput (voxels/s) of the deskew engine (FastMC_deskew) on synthetic
+# raw stacks: in memory (thread pool), streaming, and out of core (process pool).
+#
+# Run from the repository root:
+#   python benchmarks/bench_deskew.py --slices 101 --height 256 --width 2060 --stacks 4
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import FastMC_deskew
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--slices", type=int, default=101)
+    parser.add_argument("--height", type=int, default=256)
+    parser.add_argument("--width", type=int, default=2060)
+    parser.add_argument("--stacks", type=int, default=4)
+    parser.add_argument("--z-step", type=float, default=0.4)
+    parser.add_argument("--pixel-size", type=float, default=0.115)
+    parser.add_argument("--sheet-angle", type=float, default=30.0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=os.path.join(HERE, "results", "deskew.json"))
+    args = parser.parse_args()
+
+    z = np.arange(args.slices) * args.z_step
+    geometry = FastMC_deskew.deskew_geometry(z, args.pixel_size, args.sheet_angle)
+    rng = np.random.default_rng(0)
+    stack = rng.integers(100, 4000, size=(args.slices, args.height, args.width), dtype=np.uint16)
+    voxels = stack.size * args.stacks
+    results = {"config": vars(args)}
+
+    t0 = time.perf_counter()
+    for _ in range(args.stacks):
+        FastMC_deskew.deskew_volume(stack, geometry, workers=args.workers)
+    results["volume_voxels_per_s"] = voxels / (time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    for _ in FastMC_deskew.deskew_stream((stack for _ in range(args.stacks)), geometry, workers=args.workers):
+        pass
+    results["stream_voxels_per_s"] = voxels / (time.perf_counter() - t0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        in_path = os.path.join(tmp, "raw.npy")
+        out_path = os.path.join(tmp, "deskewed.npy")
+        raw = np.lib.format.open_memmap(in_path, mode="w+", dtype=np.uint16, shape=(args.slices * args.stacks, args.height, args.width))
+        raw[:] = np.tile(stack, (args.stacks, 1, 1))
+        raw.flush()
+        del raw
+        t0 = time.perf_counter()
+        FastMC_deskew.deskew_file(in_path, out_path, geometry, workers=args.workers)
+        results["file_voxels_per_s"] = voxels / (time.perf_counter() - t0)
+
+    print(json.dumps(results, indent=2))
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
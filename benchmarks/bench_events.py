@@ -0,0 +1,165 @@
+import argparse
+import contextlib
+import functools
+import io
+import json
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# End-to-end event-triggered acquisition (FastMC_events) on the fake backend
+# with a synthetic event stream: background protocol, activity detection in
+# the frame hook, re-arm to the burst protocol and back with FastMC_session.
+# Reports the switch latency in stacks, the frames kept (pre-trigger ring +
+# event) against all frames, and the per-frame cost of the hook.
+#
+# --topology runs the same loop through FastMC_stream: the hook in a camera
+# process, events to the DAQ process through a queue, kept frames written in
+# append mode. Checks that the file holds every kept frame with its own id.
+#
+# Run from the repository root:
+#   python benchmarks/bench_events.py
+#   python benchmarks/bench_events.py --events 300:60 900:30 --pre-trigger 40
+#   python benchmarks/bench_events.py --topology
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import fake_backend
+fake_backend.install()
+
+import FastMC_core
+import FastMC_events
+import FastMC_session
+import FastMC_stream
+from bench_fastmc import SCENARIOS
+
+BACKGROUND = dict(exposure_time=100e-3, num_stacks=1)
+BURST = dict(exposure_time=10e-3, num_stacks=3)
+
+
+class paced_camera:
+    """Frame source at a fixed frame rate, like a triggered camera"""
+
+    def __init__(self, camera, fps):
+        self.camera = camera
+        self.fps = fps
+
+    def __call__(self, n_frames):
+        t0 = time.perf_counter()
+        for i, frame in enumerate(self.camera(n_frames)):
+            delay = t0 + i / self.fps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            yield frame
+
+
+def event_daq_control(events, log, n_runs, params, start):
+    """DAQ-control process on the fake backend: event-driven protocol switching from the camera events"""
+    fake_backend.install()
+    with contextlib.redirect_stdout(io.StringIO()):
+        scope = FastMC_core.nidaq(**params)
+    session = FastMC_session.session(scope)
+    start.wait()
+    with contextlib.redirect_stdout(io.StringIO()):
+        log.put(FastMC_events.run_event_driven(session, BACKGROUND, BURST, lambda: FastMC_events.drain(events), n_runs))
+    session.close()
+
+
+def run_topology(args, events):
+    """Get the writer output of an event-driven run through FastMC_stream against the frames the hook keeps"""
+    n_frames = max(first + n for first, n in events) + 200
+    camera = FastMC_events.synthetic_event_camera(args.height, args.width, events)
+    # expected: the same hook on the same frames in this process
+    expected = FastMC_events.event_hook(args.height, args.width, threshold=args.threshold, pre_trigger=args.pre_trigger)
+    kept = [frame_id for i, frame in enumerate(camera(n_frames)) for _, frame_id in expected(frame, i)]
+
+    event_queue, log = mp.Queue(), mp.Queue()
+    hook = FastMC_events.event_hook(args.height, args.width, threshold=args.threshold, pre_trigger=args.pre_trigger,
+                                    on_event=event_queue.put)
+    params = dict(SCENARIOS["3d_21_slices"], num_stacks=1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "events.npy")
+        stats = FastMC_stream.run_topology(params, [paced_camera(camera, args.fps)], n_frames, [path], args.height, args.width, hooks=[hook],
+                                           daq_target=functools.partial(event_daq_control, event_queue, log, args.runs),
+                                           append=True)
+        frames, ids = np.load(path), np.load(os.path.join(tmp, "events_ids.npy"))
+        # every written frame is the source frame of its id
+        source = camera(n_frames)
+        by_id = {i: frame for i, frame in enumerate(source) if i in set(ids.tolist())}
+        intact = all(np.array_equal(frames[k], by_id[i]) for k, i in enumerate(ids.tolist()))
+    # frames the ring dropped (camera faster than the writer) are missing, the others keep their order
+    position = {frame_id: k for k, frame_id in enumerate(kept)}
+    in_order = all(i in position for i in ids.tolist()) and np.all(np.diff([position[i] for i in ids.tolist()]) > 0)
+    ids_match = bool(in_order) and len(ids) + stats["dropped"][0] == len(kept)
+    return {"frames": n_frames, "written": int(len(ids)), "expected": len(kept), "ids_match": ids_match,
+            "unique_ids": len(set(ids.tolist())) == len(ids), "frames_intact": intact, "dropped": stats["dropped"][0], "overflow": stats["overflow"][0],
+            "protocols": log.get(timeout=60)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--events", nargs="*", default=["300:60", "900:30"], help="first_frame:n_frames of each event")
+    parser.add_argument("--runs", type=int, default=60)
+    parser.add_argument("--pre-trigger", type=int, default=20)
+    parser.add_argument("--threshold", type=float, default=0.05)
+    parser.add_argument("--topology", action="store_true", help="run through FastMC_stream processes")
+    parser.add_argument("--fps", type=float, default=200, help="camera frame rate with --topology")
+    parser.add_argument("--output", default=os.path.join(HERE, "results", "events.json"))
+    args = parser.parse_args()
+
+    events = [tuple(int(x) for x in e.split(":")) for e in args.events]
+    if args.topology:
+        results = run_topology(args, events)
+        print(json.dumps({k: v for k, v in results.items() if k != "protocols"}, indent=2))
+        if not (results["ids_match"] and results["frames_intact"]):
+            sys.exit(1)
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        scope = FastMC_core.nidaq(**dict(SCENARIOS["3d_21_slices"], num_stacks=1))
+    session = FastMC_session.session(scope)
+    camera = FastMC_events.synthetic_event_camera(args.height, args.width, events)
+    hook = FastMC_events.event_hook(args.height, args.width, threshold=args.threshold, pre_trigger=args.pre_trigger)
+    state = {"frame": 0, "seen": 0, "hook_s": 0.0, "stack_ends": []}
+
+    def poll_events():
+        # the frames of the run that just finished go through the ingestion hook
+        n = scope.total_frames
+        for frame in camera(n, start=state["frame"]):
+            t0 = time.perf_counter()
+            hook(frame, state["frame"])
+            state["hook_s"] += time.perf_counter() - t0
+            state["frame"] += 1
+        state["stack_ends"].append(state["frame"])
+        new = hook.events[state["seen"]:]
+        state["seen"] = len(hook.events)
+        return new
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        log = FastMC_events.run_event_driven(session, BACKGROUND, BURST, poll_events, args.runs)
+    session.close()
+
+    # stacks acquired between the event onset and the first burst run
+    latencies = []
+    for first, _ in events:
+        onset = next((k for k, end in enumerate(state["stack_ends"]) if end > first), None)
+        switch = next((k for k in range(onset or 0, len(log)) if log[k] == "burst"), None) if onset is not None else None
+        latencies.append(None if switch is None else switch - onset)
+    results = {"config": vars(args), "detected": hook.events, "protocols": log, "switch_latency_runs": latencies,
+               "frames": state["frame"], "kept": hook.kept, "kept_fraction": hook.kept / state["frame"],
+               "hook_ms_per_frame": 1e3 * state["hook_s"] / state["frame"]}
+    print(json.dumps({k: v for k, v in results.items() if k != "protocols"}, indent=2))
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Benchmarks of the FastMC timing model, waveform generation and simulated
+# acquisition (fake nidaqmx, see fake_backend.py).
+#
+# Run from the repository root:
+#   python benchmarks/bench_fastmc.py                        # run, save benchmarks/results/latest.json
+#   python benchmarks/bench_fastmc.py --check                # also fail on thresholds.json regressions and CONSTRAINT_CASES
+#   python benchmarks/bench_fastmc.py --compare old.json     # also fail if slower than old.json by --tolerance
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import fake_backend
+fake_backend.install()
+import FastMC_core
+import FastMC_compile
+import FastMC_constraints
+
+
+# Reproducible scenarios: constructor arguments of FastMC_core.nidaq
+SCENARIOS = {
+    # 2D: many fast frames, smallest ROI
+    "2d_fast_frames": dict(num_stacks=1000, stack_delay_time=0.0, exposure_time=1e-3, readout_mode="fast",
+                           multi_d=False, image_height=16, led_stack_fraction_on=0.5, led_trigger="software_fraction"),
+    # 3D: defaults of FastMC_1-31-24.py (21 slices)
+    "3d_21_slices": dict(num_stacks=2, stack_delay_time=0.0, exposure_time=100e-3, readout_mode="fast", multi_d=True,
+                         z_start=-10.0, z_end=10.0, z_step=1.0, image_height=242, image_width=2060,
+                         led_stack_fraction_on=0.5, led_trigger="software_fraction"),
+    # 3D: 1000 slices over the full galvo range
+    "3d_1000_slices": dict(num_stacks=10, stack_delay_time=0.0, exposure_time=1e-3, readout_mode="fast", multi_d=True,
+                           z_start=-200.0, z_end=199.6, z_step=0.4, image_height=64,
+                           led_stack_fraction_on=0.5, led_trigger="software_fraction"),
+    # 3D: 1000 slices with 1 kHz analog LED modulation, 100 AO samples per frame
+    "3d_led_modulation": dict(num_stacks=10, stack_delay_time=0.0, exposure_time=1e-3, readout_mode="fast", multi_d=True,
+                              z_start=-200.0, z_end=199.6, z_step=0.4, image_height=64, led_trigger="modulation",
+                              led_modulation=lambda t: 2.5 * (1 + np.sin(2 * np.pi * 1e3 * t)), ao_oversampling=100),
+    # 2D: one hour of frames with a software_time LED pulse train
+    "hour_software_time": dict(num_stacks=36000, stack_delay_time=0.0, exposure_time=100e-3, readout_mode="fast",
+                               multi_d=False, led_trigger="software_time", led_time_on=1.0, led_frequency=1/3),
+}
+
+# Protocols checked by --check: changes to the scenario and the rules FastMC_constraints.check must report
+CONSTRAINT_CASES = {
+    # schedule total time feeds the software_time rules: must report, not raise
+    "schedule_software_time": (dict(schedule=[(2, [0.01], 0.05)], led_trigger="software_time", led_time_on=0.001,
+                                    led_frequency=10), ["continuous_led"]),
+    # rows are (n_stacks, exposures, delay): a missing delay is reported, not a crash in num_stacks
+    "schedule_short_row": (dict(schedule=[(2, [0.01])], led_trigger="hardware"), ["schedule_rows"]),
+    # 3D stack of 21 frames: 2 exposures fit neither one per stack nor one per frame
+    "schedule_exposure_count": (dict(multi_d=True, z_start=0, z_end=20, z_step=1, schedule=[(1, [0.01, 0.02], 0)]),
+                                ["schedule_exposures"]),
+    # 2D streaming has one DO sample per frame: no fraction of a frame
+    "continuous_2d_fraction": (dict(continuous=True), ["continuous_fraction"]),
+}
+
+TIMING_METHODS = ("_get_frame_time", "_get_trigger_exp_freq", "get_stack_time", "get_total_acq_time")
+
+
+def make_scope(params):
+    """Get a nidaq instance without the confirmation dialog"""
+    scope = FastMC_core.nidaq(**params)
+    scope.print_parameters = lambda: True
+    return scope
+
+
+def measure(func, repeat=7, number=1):
+    """Get best and median time (s) of one call of func"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - t0) / number)
+    return {"best": min(times), "median": statistics.median(times), "repeat": repeat, "number": number}
+
+
+def bench_scenario(params):
+    """Get timings of all benchmarks of one scenario"""
+    scope = make_scope(params)
+    results = {}
+    results["timing_model"] = measure(lambda: [getattr(scope, m)() for m in TIMING_METHODS] + [scope.duty_cycle], number=1000)
+    results["constraint_check"] = measure(lambda: FastMC_constraints.check(scope), number=1000)
+    if scope.multi_d:
+        results["galvo_data"] = measure(scope._get_ao_galvo_data, number=100)
+    if scope.led_trigger == "software_fraction":
+        results["led_data_trigger"] = measure(scope._get_do_led_data_trigger, number=100)
+    if scope.led_trigger == "modulation":
+        # uncached compile of galvo + modulation rows
+        results["ao_data_modulation"] = measure(lambda: (scope._led_cache.clear(), scope._get_ao_data()), number=10)
+    if scope.led_trigger == "software_time":
+        results["led_data_no_trigger"] = measure(scope._get_do_led_data_no_trigger)
+    results["acquire"] = measure(scope.acquire)
+    with tempfile.TemporaryDirectory() as cache:
+        # known protocol: load the compiled artifact, then acquire from its memory mapped buffers
+        FastMC_compile.compile(scope, cache)
+        results["compile_cached"] = measure(lambda: FastMC_compile.compile(scope, cache), number=10)
+        results["acquire_compiled"] = measure(scope.acquire)
+        scope.compiled = None
+    if scope.led_trigger != "software_time" and scope.stack_delay_time == 0:
+        # one AO sample per camera trigger when streaming
+        scope.continuous, scope.ao_oversampling = True, 1
+        if not scope.multi_d and scope.led_trigger == "software_fraction":
+            # one LED sample per frame in 2D streaming: the camera exposure output drives the LED
+            scope.led_trigger = "hardware"
+        results["acquire_continuous"] = measure(scope.acquire)
+    return results
+
+
+def run(scenarios):
+    """Get the benchmark report of the given scenarios"""
+    report = {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+              "date": time.strftime("%Y-%m-%d %H:%M:%S"), "scenarios": {}}
+    for name in scenarios:
+        # timing methods print when readout limited
+        with contextlib.redirect_stdout(io.StringIO()):
+            report["scenarios"][name] = bench_scenario(SCENARIOS[name])
+    return report
+
+
+def constraint_failures(cases=CONSTRAINT_CASES, base="2d_fast_frames"):
+    """Get constraint cases whose reported rules differ from the expected ones"""
+    found = []
+    for name, (changes, expected) in cases.items():
+        with contextlib.redirect_stdout(io.StringIO()):
+            scope = make_scope(SCENARIOS[base])
+        for key, value in changes.items():
+            setattr(scope, key, value)
+        try:
+            rules = [v["rule"] for v in FastMC_constraints.check(scope)]
+        except Exception as e:
+            rules = [f"{type(e).__name__}: {e}"]
+        if rules != expected:
+            found.append(f"constraints/{name}: {rules} != {expected}")
+    return found
+
+
+def regressions(report, limits, key="best"):
+    """Get benchmarks slower than limits {scenario: {bench: seconds}}"""
+    found = []
+    for scenario, benches in limits.items():
+        for bench, limit in benches.items():
+            result = report["scenarios"].get(scenario, {}).get(bench)
+            if result is not None and result[key] > limit:
+                found.append(f"{scenario}/{bench}: {result[key] * 1e3:.3f} ms > {limit * 1e3:.3f} ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="run only these scenarios")
+    parser.add_argument("--output", default=os.path.join(HERE, "results", "latest.json"))
+    parser.add_argument("--check", action="store_true", help="fail if above thresholds.json")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="allowed slowdown ratio for --compare")
+    args = parser.parse_args()
+
+    report = run(args.scenario or list(SCENARIOS))
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for scenario, benches in report["scenarios"].items():
+        for bench, result in benches.items():
+            print(f"{scenario:20s} {bench:22s} best {result['best'] * 1e3:10.4f} ms   median {result['median'] * 1e3:10.4f} ms")
+
+    failed = []
+    if args.check:
+        with open(os.path.join(HERE, "thresholds.json")) as f:
+            failed += regressions(report, json.load(f))
+        failed += constraint_failures()
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        limits = {s: {b: r["best"] * args.tolerance for b, r in benches.items()} for s, benches in old["scenarios"].items()}
+        failed += regressions(report, limits)
+    if failed:
+        print("\nRegressions:\n" + "\n".join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# Per-frame cost of the incremental max-intensity projections (FastMC_projection).
+# Keeping up with N cameras at F fps on one core needs frame_ms < 1000 / (N * F).
+#
+# Run from the repository root:
+#   python benchmarks/bench_projection.py --height 2048 --width 2060 --slices 21
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import FastMC_projection
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--height", type=int, default=2048)
+    parser.add_argument("--width", type=int, default=2060)
+    parser.add_argument("--slices", type=int, default=21)
+    parser.add_argument("--stacks", type=int, default=5)
+    parser.add_argument("--cameras", type=int, default=2)
+    parser.add_argument("--fps", type=float, default=100)
+    parser.add_argument("--output", default=os.path.join(HERE, "results", "projection.json"))
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frames = rng.integers(100, 4000, size=(4, args.height, args.width), dtype=np.uint16)
+    previews = []
+    projector = FastMC_projection.mip_projector(args.slices, args.height, args.width, callback=previews.append, display_rate=0)
+    n = args.slices * args.stacks
+    t0 = time.perf_counter()
+    for i in range(n):
+        projector(frames[i % 4], i)
+    frame_ms = (time.perf_counter() - t0) / n * 1e3
+    budget_ms = 1e3 / (args.cameras * args.fps)
+    results = {"config": vars(args), "frame_ms": frame_ms, "budget_ms": budget_ms, "keeps_up": frame_ms < budget_ms,
+               "previews": len(previews)}
+    print(json.dumps(results, indent=2))
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# Per-frame cost of the saturation monitor (FastMC_saturation) in the ingestion
+# path. Keeping up with N cameras at F fps on one core needs frame_ms < 1000 / (N * F).
+#
+# Run from the repository root:
+#   python benchmarks/bench_saturation.py --height 2048 --width 2060 --subsample 4
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import FastMC_saturation
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--height", type=int, default=2048)
+    parser.add_argument("--width", type=int, default=2060)
+    parser.add_argument("--slices", type=int, default=21)
+    parser.add_argument("--stacks", type=int, default=5)
+    parser.add_argument("--subsample", type=int, default=4)
+    parser.add_argument("--cameras", type=int, default=2)
+    parser.add_argument("--fps", type=float, default=100)
+    parser.add_argument("--output", default=os.path.join(HERE, "results", "saturation.json"))
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frames = rng.integers(100, 65535, size=(4, args.height, args.width), dtype=np.uint16)
+    stats = []
+    monitor = FastMC_saturation.saturation_monitor(args.slices, subsample=args.subsample, callback=stats.append)
+    n = args.slices * args.stacks
+    t0 = time.perf_counter()
+    for i in range(n):
+        monitor(frames[i % 4], i)
+    frame_ms = (time.perf_counter() - t0) / n * 1e3
+    budget_ms = 1e3 / (args.cameras * args.fps)
+    results = {"config": vars(args), "frame_ms": frame_ms, "budget_ms": budget_ms, "keeps_up": frame_ms < budget_ms,
+               "stacks": len(stats), "saturated_fraction": stats[-1]["saturated_fraction"]}
+    print(json.dumps(results, indent=2))
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
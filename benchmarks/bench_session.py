@@ -0,0 +1,92 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+# Re-arm latency between consecutive acquisitions: a full rebuild (close and
+# create all tasks, as acquire() does) vs FastMC_session.arm() with a single
+# parameter edit, in wall time and number of driver calls on the fake backend.
+# --latency adds a fixed cost to every driver call to model real DAQmx.
+#
+# Run from the repository root:
+#   python benchmarks/bench_session.py                      # 1 ms per driver call
+#   python benchmarks/bench_session.py --latency 0 --continuous
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import fake_backend
+fake_backend.install()
+
+import FastMC_core
+import FastMC_session
+from bench_fastmc import SCENARIOS
+
+EDITS = [("led_fraction_on", 0.3), ("exposure_time", 50e-3), ("z_end", 8.0), ("num_stacks", 5)]
+
+
+def measure(fn, repeats):
+    """Get best wall time (s) and driver calls of fn"""
+    best, calls = float("inf"), 0
+    for _ in range(repeats):
+        c = fake_backend.calls
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+        calls = fake_backend.calls - c
+    return best, calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", default="3d_21_slices", choices=sorted(SCENARIOS))
+    parser.add_argument("--latency", type=float, default=1e-3, help="s per driver call")
+    parser.add_argument("--continuous", action="store_true")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default=os.path.join(HERE, "results", "session.json"))
+    args = parser.parse_args()
+    fake_backend.CALL_LATENCY = args.latency
+
+    params = dict(SCENARIOS[args.scenario], continuous=args.continuous)
+    with contextlib.redirect_stdout(io.StringIO()):
+        scope = FastMC_core.nidaq(**params)
+    results = {"config": vars(args), "edits": {}}
+    for name, value in EDITS:
+        base = getattr(scope, name)
+
+        def rebuild():
+            setattr(scope, name, value)
+            s = FastMC_session.session(scope)
+            s.arm()
+            s._close_tasks()
+            setattr(scope, name, base)
+
+        s = FastMC_session.session(scope)
+        s.arm()
+        flip = [value, base]
+
+        def rearm():
+            s.arm(**{name: flip[0]})
+            flip.reverse()
+
+        full_s, full_calls = measure(rebuild, args.repeats)
+        diff_s, diff_calls = measure(rearm, args.repeats)
+        changed = s.last_changes
+        s._close_tasks()
+        setattr(scope, name, base)
+        results["edits"][f"{name}={value}"] = {"rebuild_ms": 1e3 * full_s, "rebuild_calls": full_calls,
+                                              "rearm_ms": 1e3 * diff_s, "rearm_calls": diff_calls, "changed": changed}
+        print(f"{name + '=' + repr(value):<22} rebuild {1e3 * full_s:8.2f} ms {full_calls:3d} calls   "
+              f"re-arm {1e3 * diff_s:8.2f} ms {diff_calls:3d} calls   {changed}")
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
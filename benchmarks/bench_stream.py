@@ -0,0 +1,56 @@
+import argparse
+import json
+import os
+import sys
+
+# Throughput and latency of the multi-process topology (FastMC_stream) on a
+# synthetic load: N cameras at a fixed frame rate, DAQ on the fake backend.
+#
+# Run from the repository root:
+#   python benchmarks/bench_stream.py                          # 2 cameras, 100 fps, 10 s, 2048 x 2060
+#   python benchmarks/bench_stream.py --write /data/tmp       # also write .npy files
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import FastMC_stream
+
+
+def fake_daq_control(params, start):
+    """DAQ-control process on the fake nidaqmx backend"""
+    import fake_backend
+    fake_backend.install()
+    FastMC_stream.daq_control(params, start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cameras", type=int, default=2)
+    parser.add_argument("--fps", type=float, default=100)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--height", type=int, default=2048)
+    parser.add_argument("--width", type=int, default=2060)
+    parser.add_argument("--slots", type=int, default=32)
+    parser.add_argument("--write", help="directory for .npy output (default: discard frames)")
+    parser.add_argument("--output", default=os.path.join(HERE, "results", "stream.json"))
+    args = parser.parse_args()
+
+    n_frames = int(args.fps * args.seconds)
+    params = dict(num_stacks=n_frames, stack_delay_time=0.0, exposure_time=1 / args.fps, readout_mode="fast",
+                  multi_d=False, image_height=args.height, image_width=args.width)
+    sources = [FastMC_stream.synthetic_camera(args.height, args.width, args.fps, seed=k) for k in range(args.cameras)]
+    paths = None
+    if args.write:
+        paths = [os.path.join(args.write, f"cam{k + 1}.npy") for k in range(args.cameras)]
+
+    stats = FastMC_stream.run_topology(params, sources, n_frames, paths, n_slots=args.slots, daq_target=fake_daq_control)
+    stats["config"] = vars(args)
+    print(json.dumps(stats, indent=2))
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(stats, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import sys
+import time
+import types
+import enum
+
+# In-process stand-in for nidaqmx and pco so FastMC_core can be benchmarked
+# (and exercised) without a DAQ card or a camera. install() must run before
+# FastMC_core is imported.
+#
+# Only the parts of the API used by FastMC are modeled. Each task records its
+# configuration; a finite counter used as a sample clock (ctr1InternalOutput)
+# advances the generated sample count of the tasks it clocks when it is waited
+# on, so the continuous-mode frame count check behaves as on a simulated device.
+
+CALL_LATENCY = 0.0   # s. optional cost added to every driver call, to model real DAQmx latency
+calls = 0            # number of driver calls so far
+
+_tasks = []
+
+
+def _driver_call():
+    global calls
+    calls += 1
+    if CALL_LATENCY:
+        time.sleep(CALL_LATENCY)
+
+
+class Level(enum.Enum):
+    LOW = 10214
+    HIGH = 10192
+
+class AcquisitionType(enum.Enum):
+    FINITE = 10178
+    CONTINUOUS = 10123
+    HW_TIMED_SINGLE_POINT = 12522
+
+class Slope(enum.Enum):
+    RISING = 10280
+    FALLING = 10171
+
+class Edge(enum.Enum):
+    RISING = 10280
+    FALLING = 10171
+
+class TriggerType(enum.Enum):
+    DIGITAL_EDGE = 10150
+    NONE = 10230
+
+
+class RegenerationMode(enum.Enum):
+    ALLOW_REGENERATION = 10097
+    DONT_ALLOW_REGENERATION = 10158
+
+
+class _Channel:
+    def __init__(self, kind, physical_channel, **kwargs):
+        self.kind = kind
+        self.physical_channel = physical_channel
+        self.__dict__.update(kwargs)
+        # counter output properties that can be changed while a task exists
+        self.co_pulse_freq = kwargs.get("freq")
+        self.co_pulse_duty_cyc = kwargs.get("duty_cycle")
+        self.co_pulse_high_time = kwargs.get("high_time")
+        self.co_pulse_low_time = kwargs.get("low_time")
+        self.ci_count_edges_term = None
+        self._ready = True
+
+    def __setattr__(self, name, value):
+        # property writes on an existing channel are driver calls too
+        if self.__dict__.get("_ready"):
+            _driver_call()
+        object.__setattr__(self, name, value)
+
+
+class _Channels:
+    def __init__(self, task, kind):
+        self._task = task
+        self._kind = kind
+
+    def _add(self, physical_channel, **kwargs):
+        _driver_call()
+        chan = _Channel(self._kind, physical_channel, **kwargs)
+        self._task.channels.append(chan)
+        return chan
+
+    def add_ao_voltage_chan(self, physical_channel, min_val=-10.0, max_val=10.0, **kwargs):
+        return self._add(physical_channel, min_val=min_val, max_val=max_val)
+
+    def add_do_chan(self, lines, **kwargs):
+        return self._add(lines)
+
+    def add_co_pulse_chan_freq(self, counter, idle_state=Level.LOW, freq=1.0, duty_cycle=0.5, **kwargs):
+        if not 0 < duty_cycle < 1:
+            raise ValueError(f"Invalid duty cycle {duty_cycle} on {counter}")
+        return self._add(counter, idle_state=idle_state, freq=freq, duty_cycle=duty_cycle)
+
+    def add_co_pulse_chan_time(self, counter, idle_state=Level.LOW, low_time=0.01, high_time=0.01, **kwargs):
+        return self._add(counter, idle_state=idle_state, low_time=low_time, high_time=high_time)
+
+    def add_ci_count_edges_chan(self, counter, **kwargs):
+        return self._add(counter)
+
+    def __getitem__(self, i):
+        return [c for c in self._task.channels if c.kind == self._kind][i]
+
+
+class _Timing:
+    def __init__(self, task):
+        self._task = task
+        self.samp_clk_src = ""
+        self.samp_clk_rate = None
+        self.samp_quant_samp_mode = None
+        self.samp_quant_samp_per_chan = None
+        self._ready = True
+
+    def __setattr__(self, name, value):
+        # property writes outside the cfg_ functions are driver calls too
+        if self.__dict__.get("_ready"):
+            _driver_call()
+        object.__setattr__(self, name, value)
+
+    def cfg_implicit_timing(self, sample_mode=AcquisitionType.FINITE, samps_per_chan=1000):
+        _driver_call()
+        self.__dict__.update(samp_quant_samp_mode=sample_mode, samp_quant_samp_per_chan=samps_per_chan)
+
+    def cfg_samp_clk_timing(self, rate, source="", active_edge=Edge.RISING, sample_mode=AcquisitionType.FINITE, samps_per_chan=1000):
+        _driver_call()
+        self.__dict__.update(samp_clk_rate=rate, samp_clk_src=source, samp_quant_samp_mode=sample_mode,
+                             samp_quant_samp_per_chan=samps_per_chan)
+
+
+class _StartTrigger:
+    def __init__(self):
+        self.source = None
+        self.retriggerable = False
+
+    def cfg_dig_edge_start_trig(self, trigger_source, trigger_edge=Edge.RISING):
+        _driver_call()
+        self.source = trigger_source
+
+
+class _ArmStartTrigger:
+    def __init__(self):
+        self.trig_type = TriggerType.NONE
+        self.dig_edge_src = ""
+        self.dig_edge_edge = Edge.RISING
+
+
+class _Triggers:
+    def __init__(self):
+        self.start_trigger = _StartTrigger()
+        self.arm_start_trigger = _ArmStartTrigger()
+
+
+class _OutStream:
+    def __init__(self):
+        self.regen_mode = RegenerationMode.ALLOW_REGENERATION
+        self.output_buf_size = 0
+        self.total_samp_per_chan_generated = 0
+        self.space_avail = 2 ** 31
+
+
+class _InStream:
+    def __init__(self):
+        self.avail_samp_per_chan = 0
+
+
+class Task:
+
+    def __init__(self, new_task_name=""):
+        _driver_call()
+        self.name = new_task_name
+        self.channels = []
+        self.ao_channels = _Channels(self, "ao")
+        self.do_channels = _Channels(self, "do")
+        self.co_channels = _Channels(self, "co")
+        self.ci_channels = _Channels(self, "ci")
+        self.timing = _Timing(self)
+        self.triggers = _Triggers()
+        self.out_stream = _OutStream()
+        self.in_stream = _InStream()
+        self.data = None
+        self.running = False
+        self.closed = False
+        self.n_writes = 0
+        _tasks.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data, auto_start=False, timeout=10.0):
+        _driver_call()
+        self.data = data
+        self.n_writes += 1
+        return len(data) if hasattr(data, "__len__") else 1
+
+    def read(self, number_of_samples_per_channel=-1, timeout=10.0):
+        _driver_call()
+        return []
+
+    def start(self):
+        _driver_call()
+        self.running = True
+        # the generated sample count restarts with every run
+        self.out_stream.total_samp_per_chan_generated = 0
+
+    def stop(self):
+        _driver_call()
+        self.running = False
+
+    def close(self):
+        _driver_call()
+        self.running = False
+        self.closed = True
+        if self in _tasks:
+            _tasks.remove(self)
+
+    def is_task_done(self):
+        return True
+
+    def wait_until_done(self, timeout=10.0):
+        _driver_call()
+        # a finite counter clocking other tasks: they generate one sample per pulse
+        if self.channels and self.channels[0].kind == "co" and self.timing.samp_quant_samp_mode == AcquisitionType.FINITE:
+            counter = self.channels[0].physical_channel.split("/")[-1]
+            for task in _tasks:
+                if task.timing.samp_clk_src.lower().startswith(counter.lower()):
+                    task.out_stream.total_samp_per_chan_generated += self.timing.samp_quant_samp_per_chan
+
+
+class CounterWriter:
+    def __init__(self, out_stream):
+        self.out_stream = out_stream
+
+    def write_many_sample_pulse_time(self, high_time, low_time, timeout=10.0):
+        _driver_call()
+        return len(high_time)
+
+
+def install():
+    """Register the fake nidaqmx and pco modules in sys.modules"""
+    nidaqmx = types.ModuleType("nidaqmx")
+    constants = types.ModuleType("nidaqmx.constants")
+    system = types.ModuleType("nidaqmx.system")
+    stream_writers = types.ModuleType("nidaqmx.stream_writers")
+    for cls in (Level, AcquisitionType, Slope, Edge, TriggerType, RegenerationMode):
+        setattr(constants, cls.__name__, cls)
+    constants.WAIT_INFINITELY = -1.0
+    constants.READ_ALL_AVAILABLE = -1
+    stream_writers.CounterWriter = CounterWriter
+    nidaqmx.Task = Task
+    nidaqmx.constants = constants
+    nidaqmx.system = system
+    nidaqmx.stream_writers = stream_writers
+    pco = types.ModuleType("pco")
+    sys.modules.update({"nidaqmx": nidaqmx, "nidaqmx.constants": constants, "nidaqmx.system": system,
+                        "nidaqmx.stream_writers": stream_writers, "pco": pco})
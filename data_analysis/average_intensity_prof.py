@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from profile_analysis import binned_average
 
 # Read the CSV files
 df1 = pd.read_csv('fastmc1.csv')
@@ -15,13 +16,13 @@ intensity2 = df2['Intensity']
 # Subtract the intensity values
 n = 15
 
-# Calculate the average of every group of 10 values
-grouped_average = [np.mean(intensity1[i:i+n]) for i in range(0, len(intensity1), n)]
-grouped_average2 = [np.mean(intensity2[i:i+n]) for i in range(0, len(intensity2), n)]
+# Calculate the average of every group of n values
+grouped_average = binned_average(intensity1, n)
+grouped_average2 = binned_average(intensity2, n)
 
 # Create an array of x-values for the grouped averages
 x_values = np.arange(0, len(grouped_average) * n, n)
-diff = [grouped_average[i] - grouped_average2[i] for i in range(len(grouped_average))]
+diff = grouped_average - grouped_average2[:len(grouped_average)]
 
 # Plot the grouped averages
 plt.plot(x_values, grouped_average, label='FastMC', linewidth=0.75)
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+
+# Collection efficiency of OPM tilt geometries (same definitions as
+# NA_Millett_et_al.py), vectorized over grids of NA, immersion index and
+# sheet angle:
+#   cap 1: collection cone of the primary objective, half-angle asin(NA1 / n1)
+#   cap 2: acceptance cone of the secondary objective, half-angle asin(NA2)
+#   cap 3: hemisphere tilted by (pi/2 - cap 1 half-angle) + sheet half-angle
+# ratio_1_2: fraction of cap 1 covered by cap 2 (coaxial caps: closed form)
+# ratio_2_3: fraction of cap 2 inside the tilted hemisphere. For each polar
+#   angle the covered azimuth fraction is closed form; the fully covered polar
+#   band is closed form too and only the partially covered band is integrated by
+#   Gauss-Legendre quadrature, with the difference to half the nodes as error
+#   estimate. fibonacci_fraction() gives an independent quasi-Monte Carlo
+#   check.
+#
+# Use:
+#   table = collection_efficiency.sweep(na1=np.linspace(1.2, 1.49, 30), n1=[1.33, 1.406, 1.51],
+#                                       na2=[0.9, 0.95], sheet_half_angle=np.radians(np.linspace(0, 10, 21)))
+#   table["ratio_2_3"], table["error_2_3"]     # NaN where NA1 > n1 (e.g. NA 1.4 in water)
+
+
+def cap_half_angle(na, n_medium=1.0):
+    """Get half-angle (rad) of the cone of an objective"""
+    return np.arcsin(np.asarray(na, dtype=float) / n_medium)
+
+
+def coaxial_overlap(alpha1, alpha2):
+    """Get fraction of cap alpha1 covered by the coaxial cap alpha2"""
+    alpha1, alpha2 = np.asarray(alpha1, dtype=float), np.asarray(alpha2, dtype=float)
+    return (1 - np.cos(np.minimum(alpha1, alpha2))) / (1 - np.cos(alpha1))
+
+
+def _azimuth_fraction(theta, tilt):
+    """Get fraction of the circle at polar angle theta inside the hemisphere whose pole is tilted by tilt"""
+    # inside: sin(tilt) sin(theta) sin(phi) + cos(tilt) cos(theta) > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        c = -np.cos(tilt) * np.cos(theta) / (np.sin(tilt) * np.sin(theta))
+    c = np.where(np.isnan(c), -np.sign(np.cos(tilt) * np.cos(theta)), c)
+    return (np.pi - 2 * np.arcsin(np.clip(c, -1, 1))) / (2 * np.pi)
+
+
+def _hemisphere_fraction_quad(alpha, tilt, n_nodes):
+    nodes, weights = np.polynomial.legendre.leggauss(n_nodes)
+    alpha, tilt = np.asarray(alpha, dtype=float), np.asarray(tilt, dtype=float)
+    # polar angles below pi/2 - tilt are fully inside, above pi/2 + tilt fully outside:
+    # only the band in between needs quadrature (over u = cos(theta), uniform in area)
+    theta1 = np.clip(np.pi / 2 - np.abs(tilt), 0, alpha)
+    theta2 = np.clip(np.pi / 2 + np.abs(tilt), theta1, alpha)
+    u1, u2 = np.cos(theta1)[..., None], np.cos(theta2)[..., None]
+    u = u2 + (u1 - u2) * (nodes + 1) / 2
+    band = np.sum(weights * _azimuth_fraction(np.arccos(u), tilt[..., None]), axis=-1) * (u1 - u2)[..., 0] / 2
+    return (1 - np.cos(theta1) + band) / (1 - np.cos(alpha))
+
+
+def hemisphere_fraction(alpha, tilt, n_nodes=64):
+    """Get fraction of cap alpha inside the hemisphere tilted by tilt, and its error estimate"""
+    full = _hemisphere_fraction_quad(alpha, tilt, n_nodes)
+    half = _hemisphere_fraction_quad(alpha, tilt, n_nodes // 2)
+    return full, np.abs(full - half)
+
+
+def fibonacci_fraction(alpha, tilt, n_points=4096):
+    """Get quasi-Monte Carlo fraction of cap alpha inside the tilted hemisphere, and its error estimate"""
+    alpha, tilt = np.asarray(alpha, dtype=float)[..., None], np.asarray(tilt, dtype=float)[..., None]
+    i = np.arange(n_points) + 0.5
+    # golden-angle spiral, uniform in area over the cap
+    z = 1 - (1 - np.cos(alpha)) * i / n_points
+    phi = np.pi * (3 - np.sqrt(5)) * i
+    inside = np.sin(tilt) * np.sqrt(1 - z ** 2) * np.sin(phi) + np.cos(tilt) * z > 0
+    full = inside.mean(axis=-1)
+    half = inside[..., ::2].mean(axis=-1)
+    return full, np.abs(full - half)
+
+
+def collection_efficiency(na1, n1, na2, sheet_half_angle, n_nodes=64):
+    """Get ratio_1_2, ratio_2_3 and the error of ratio_2_3 (broadcast over all arguments)"""
+    cap_1 = cap_half_angle(na1, n1)
+    cap_2 = cap_half_angle(na2)
+    cap_3_tilt = (np.pi / 2 - cap_1) + sheet_half_angle
+    ratio_1_2 = coaxial_overlap(cap_1, cap_2)
+    ratio_2_3, error_2_3 = hemisphere_fraction(cap_2 * np.ones_like(cap_3_tilt), cap_3_tilt, n_nodes)
+    return ratio_1_2, ratio_2_3, error_2_3
+
+
+def sweep(na1, n1, na2, sheet_half_angle, n_nodes=64):
+    """Get collection efficiency on the grid of all parameter combinations (axes: na1, n1, na2, sheet_half_angle). NaN where NA1 > n1"""
+    grids = [np.atleast_1d(np.asarray(g, dtype=float)) for g in (na1, n1, na2, sheet_half_angle)]
+    mesh = list(np.meshgrid(*grids, indexing="ij"))
+    # NA1 above the immersion index has no collection cone: NaN in the table, not an error for the whole grid
+    invalid = mesh[0] > mesh[1]
+    mesh[0] = np.minimum(mesh[0], mesh[1])
+    ratio_1_2, ratio_2_3, error_2_3 = collection_efficiency(*mesh, n_nodes=n_nodes)
+    for values in (ratio_1_2, ratio_2_3, error_2_3):
+        values[invalid] = np.nan
+    return {"na1": grids[0], "n1": grids[1], "na2": grids[2], "sheet_half_angle": grids[3],
+            "ratio_1_2": ratio_1_2, "ratio_2_3": ratio_2_3, "error_2_3": error_2_3}
+
+
+def cached_sweep(cache_dir, na1, n1, na2, sheet_half_angle, n_nodes=64):
+    """Get sweep() from a .npz lookup table in cache_dir, computing and saving it on first use"""
+    grids = [np.atleast_1d(np.asarray(g, dtype=float)) for g in (na1, n1, na2, sheet_half_angle)]
+    h = hashlib.sha1(np.array([n_nodes], dtype=float).tobytes())
+    for g in grids:
+        h.update(g.tobytes())
+    path = os.path.join(cache_dir, f"collection_efficiency_{h.hexdigest()[:12]}.npz")
+    if os.path.exists(path):
+        with np.load(path) as data:
+            return {k: data[k] for k in data.files}
+    table = sweep(*grids, n_nodes=n_nodes)
+    os.makedirs(cache_dir, exist_ok=True)
+    np.savez(path, **table)
+    return table
+
+
+def lookup(table, key="ratio_2_3"):
+    """Get interpolator of a sweep table: f([[na1, n1, na2, sheet_half_angle], ...])"""
+    axes = [table[k] for k in ("na1", "n1", "na2", "sheet_half_angle")]
+    # singleton axes cannot be interpolated: drop them and fix their value
+    keep = [len(a) > 1 for a in axes]
+    values = np.asarray(table[key]).reshape([len(a) for a in axes])
+    values = values.reshape([len(a) for a, k in zip(axes, keep) if k])
+    interp = RegularGridInterpolator([a for a, k in zip(axes, keep) if k], values)
+    return lambda points: interp(np.atleast_2d(points)[:, keep])
+
+
+if __name__ == "__main__":
+    # geometry of NA_Millett_et_al.py
+    r12, r23, err = collection_efficiency(1.49, 1.51, 0.95, 3 * np.pi / 180)
+    qmc, qmc_err = fibonacci_fraction(cap_half_angle(0.95), (np.pi / 2 - cap_half_angle(1.49, 1.51)) + 3 * np.pi / 180)
+    print("Fraction of cap 1 covered by cap 2: %0.5f" % r12)
+    print("Fraction of cap 2 covered by cap 3: %0.5f +- %0.1e (quasi-Monte Carlo: %0.5f +- %0.1e)" % (r23, err, qmc, qmc_err))
@@ -1,7 +1,7 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
+from profile_fitting import fit_profile, smooth_square_wave
 
 # Read the CSV files
 df1 = pd.read_csv('fastmc0.csv')
@@ -13,16 +13,11 @@ intensity1 = df1['Intensity']
 Distance2 = df2['Distance']
 intensity2 = df2['Intensity']
 
-# Define the square wave function
-def square_wave(x, amplitude, period, phase, offset):
-    return amplitude * np.sign(np.sin(2 * np.pi * x / period + phase)) + offset
-
-# Fit the square wave function to the data
-p0 = [50, 20, 0, 0]  # Initial guess for the parameters
-params, _ = curve_fit(square_wave, Distance1, intensity1, p0=p0)
+# Fit a smooth square wave, seeded from the FFT of the profile
+params = fit_profile(Distance1, intensity1)
 
 # Generate the fitted square wave
-fitted_wave = square_wave(Distance1, *params)
+fitted_wave = smooth_square_wave(Distance1, *params)
 
 # Plot the original data and the fitted square wave
 plt.plot(Distance1, intensity1, label='Original Data', linewidth=0.5)
@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Analysis of oscilloscope (PicoScope) captures of the DAQ, camera, LED and
+# galvo signals. Captures are loaded memory mapped: CSV exports are parsed once
+# and cached as .npy next to the CSV, raw binary captures are mapped directly.
+# Edges are detected with hysteresis and timed at the mid-level crossing, all
+# in vectorized NumPy, so millions of samples per channel take well under a
+# second.
+#
+# Example: camera trigger on channel A, LED on channel B, compared with the
+# timing of the acquisition (metadata saved with nidaq.save_metadata)
+#   python scope_traces.py capture.csv --reference 1 --channels 2 --metadata acq.json
+
+SYS_DELAY = 2.99e-6     # sec, nidaq.SYS_DELAY
+JITTER = 0.3e-6         # sec, nidaq.JITTER
+TIME_UNITS = {"(s)": 1.0, "(ms)": 1e-3, "(us)": 1e-6, "(ns)": 1e-9}
+
+
+def load_trace(path, n_channels=None, dtype="float32", dt=None):
+    """Get capture (n_samples, 1 + n_channels) with float64 time (s) in column 0, memory mapped"""
+    if path.endswith(".csv"):
+        cache = path[:-4] + ".npy"
+        if not os.path.exists(cache) or os.path.getmtime(cache) < os.path.getmtime(path):
+            # PicoScope exports a header row, a units row and a blank row before the samples
+            with open(path) as f:
+                header = [f.readline() for _ in range(3)]
+            units = header[1].strip().split(",")
+            skip = sum(1 for line in header if not line.strip() or not line.strip()[0].isdigit() and line.strip()[0] != "-")
+            data = pd.read_csv(path, skiprows=skip, header=None, dtype=np.float64, engine="c").to_numpy()
+            data[:, 0] *= TIME_UNITS.get(units[0], 1.0)
+            # time stays float64 (float32 is ~1 us at 10 s, coarser than the jitter measured): only the signals are cast
+            data[:, 1:] = data[:, 1:].astype(dtype)
+            np.save(cache, data)
+        return np.load(cache, mmap_mode="r")
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    # raw binary: interleaved samples of n_channels, no time column. Cached with the time column
+    # added, in chunks so the capture is never fully in memory
+    if n_channels is None or dt is None:
+        raise ValueError("n_channels and dt are required for binary captures")
+    cache = path + ".npy"
+    if not os.path.exists(cache) or os.path.getmtime(cache) < os.path.getmtime(path):
+        samples = np.memmap(path, dtype=dtype, mode="r").reshape(-1, n_channels)
+        out = np.lib.format.open_memmap(cache, mode="w+", dtype=np.float64, shape=(len(samples), 1 + n_channels))
+        for i in range(0, len(samples), 1 << 20):
+            chunk = samples[i:i + (1 << 20)]
+            out[i:i + len(chunk), 0] = np.arange(i, i + len(chunk)) * dt
+            out[i:i + len(chunk), 1:] = chunk
+        out.flush()
+        del out
+    return np.load(cache, mmap_mode="r")
+
+
+def find_edges(t, signal, low=None, high=None):
+    """Get times (s) of rising and falling edges, detected with hysteresis between low and high"""
+    signal = np.asarray(signal, dtype=np.float32)
+    if low is None or high is None:
+        lo, hi = np.percentile(signal[::max(1, len(signal) // 100000)], [1, 99])
+        low, high = lo + 0.3 * (hi - lo), lo + 0.7 * (hi - lo)
+    # state: 1 above high, 0 below low, held from the last decided sample in between
+    decided = (signal >= high) | (signal <= low)
+    last = np.maximum.accumulate(np.where(decided, np.arange(len(signal)), 0))
+    state = (signal >= high)[last]
+    switch = np.flatnonzero(np.diff(state.astype(np.int8))) + 1
+    rising = switch[state[switch]]
+    falling = switch[~state[switch]]
+    # time each edge at the last mid-level crossing before the hysteresis switch
+    mid = (low + high) / 2
+    above = signal >= mid
+    cross = np.flatnonzero(above[1:] != above[:-1])
+    return _cross_time(t, signal, mid, cross, rising), _cross_time(t, signal, mid, cross, falling)
+
+
+def _cross_time(t, signal, mid, cross, switch):
+    """Get linearly interpolated mid-level crossing time preceding every switch index"""
+    if len(switch) == 0:
+        return np.empty(0)
+    i = cross[np.maximum(np.searchsorted(cross, switch, side="left") - 1, 0)]
+    t = np.asarray(t, dtype=np.float64)
+    y0, y1 = signal[i].astype(np.float64), signal[i + 1].astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.where(y1 != y0, (mid - y0) / (y1 - y0), 0.0)
+    return t[i] + frac * (t[i + 1] - t[i])
+
+
+def pulses(rising, falling):
+    """Get widths, periods and duty cycles of the pulses starting at each rising edge"""
+    rising, falling = np.asarray(rising), np.asarray(falling)
+    nxt = np.searchsorted(falling, rising)
+    ok = nxt < len(falling)
+    widths = falling[nxt[ok]] - rising[ok]
+    periods = np.diff(rising)
+    n = min(len(widths), len(periods))
+    return {"width": widths, "period": periods, "duty_cycle": widths[:n] / periods[:n]}
+
+
+def delays(reference, edges):
+    """Get delay from every reference edge to the first following edge"""
+    reference, edges = np.asarray(reference), np.asarray(edges)
+    nxt = np.searchsorted(edges, reference)
+    ok = nxt < len(edges)
+    return edges[nxt[ok]] - reference[ok]
+
+
+def distribution(x):
+    """Get mean, std, min, max, peak-to-peak jitter and count of a set of intervals"""
+    x = np.asarray(x, dtype=float)
+    if len(x) == 0:
+        return {"mean": np.nan, "std": np.nan, "min": np.nan, "max": np.nan, "jitter": np.nan, "n": 0}
+    return {"mean": x.mean(), "std": x.std(), "min": x.min(), "max": x.max(), "jitter": np.ptp(x), "n": len(x)}
+
+
+def predicted_timing(scope):
+    """Get exposure trigger period, high time and delay predicted by a nidaq object or its metadata"""
+    if isinstance(scope, dict):
+        freq = scope["trigger_frequency"]
+        delay = scope["frame_delay_time"] if scope["multi_d"] else 0.0
+        duty = 0.9 - scope["frame_delay_time"] * freq
+        return {"period": 1 / freq, "width": duty / freq, "duty_cycle": duty, "delay": SYS_DELAY,
+                "jitter": JITTER, "frame_delay": delay}
+    freq = scope._get_trigger_exp_freq()
+    return {"period": 1 / freq, "width": scope.duty_cycle / freq, "duty_cycle": scope.duty_cycle,
+            "delay": scope.SYS_DELAY, "jitter": scope.JITTER,
+            "frame_delay": scope.frame_delay_time if scope.multi_d else 0.0}
+
+
+def analyze(capture, reference=1, channels=(), thresholds=None):
+    """Get pulse and delay distributions of the reference channel and of every other channel relative to it"""
+    thresholds = thresholds or {}
+    t = capture[:, 0]
+    ref_rising, ref_falling = find_edges(t, capture[:, reference], *thresholds.get(reference, (None, None)))
+    report = {reference: {k: distribution(v) for k, v in pulses(ref_rising, ref_falling).items()}}
+    for ch in channels:
+        rising, falling = find_edges(t, capture[:, ch], *thresholds.get(ch, (None, None)))
+        report[ch] = {k: distribution(v) for k, v in pulses(rising, falling).items()}
+        report[ch]["delay"] = distribution(delays(ref_rising, rising))
+    return report
+
+
+def compare(report, scope, reference=1, channel=None, rtol=0.01):
+    """Get measured vs predicted timing of the exposure trigger (reference) and the trigger-to-channel delay"""
+    predicted = predicted_timing(scope)
+    rows = []
+    for key in ("period", "width", "duty_cycle"):
+        measured = report[reference][key]["mean"]
+        rows.append((key, predicted[key], measured, bool(np.isclose(measured, predicted[key], rtol=rtol))))
+    if channel is not None:
+        d = report[channel]["delay"]
+        # delays are small: compare within the measured system jitter instead of relative tolerance
+        rows.append(("delay", predicted["delay"], d["mean"], bool(abs(d["mean"] - predicted["delay"]) <= 3 * predicted["jitter"])))
+        rows.append(("jitter", predicted["jitter"], d["jitter"], bool(d["jitter"] <= 3 * predicted["jitter"])))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture", help=".csv (PicoScope export), .npy, or raw binary capture")
+    parser.add_argument("--reference", type=int, default=1, help="column of the exposure trigger")
+    parser.add_argument("--channels", type=int, nargs="*", default=[], help="columns timed relative to the reference")
+    parser.add_argument("--n-channels", type=int, help="binary captures only")
+    parser.add_argument("--dt", type=float, help="binary captures only: sample interval (s)")
+    parser.add_argument("--dtype", default="float32")
+    parser.add_argument("--metadata", help="JSON saved by nidaq.save_metadata to compare against")
+    args = parser.parse_args()
+
+    capture = load_trace(args.capture, args.n_channels, args.dtype, args.dt)
+    report = analyze(capture, args.reference, args.channels)
+    for ch, stats in report.items():
+        for key, d in stats.items():
+            print(f"ch {ch} {key:>10}: mean {d['mean']:.6g}  std {d['std']:.3g}  jitter {d['jitter']:.3g}  (n={d['n']})")
+    if args.metadata:
+        with open(args.metadata) as f:
+            metadata = json.load(f)
+        rows = compare(report, metadata, args.reference, args.channels[0] if args.channels else None)
+        for key, predicted, measured, ok in rows:
+            print(f"{key:>10}: predicted {predicted:.6g}  measured {measured:.6g}  {'OK' if ok else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()